@@ -0,0 +1,490 @@
+"""
+A JSON API over the work log for scripts and dashboards, served over
+HTTP/1.1 on localhost with asyncio.
+
+    GET    /tasks          search tasks, one page at a time
+    POST   /tasks          add a task
+    GET    /tasks/<id>     read a task
+    PATCH  /tasks/<id>     edit some of a task's fields
+    DELETE /tasks/<id>     delete a task
+    GET    /employees      employees with tasks, or ?name= to look one up
+
+GET /tasks takes at most one of the menu's searches as query parameters:
+employee, duration, keyword, date, or from and to.  'limit' sets the page
+size and 'after' continues from the 'next' cursor of the previous page.
+Tasks come newest first, or best match first for a keyword, and pages
+are streamed as they are read from the database.
+
+Database work runs on a bounded pool of threads, each with its own
+connection.  Connections are kept alive and may pipeline requests: each
+request starts as soon as it is read and responses go back in request
+order.
+"""
+import asyncio
+import functools
+import json
+import threading
+import traceback
+import urllib.parse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from task import Task
+import exporter
+from paging import order_for, page_query
+import search
+import validation
+import writes
+
+
+HOST = '127.0.0.1'
+PORT = 8080
+
+# Threads doing database work.
+WORKERS = 4
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Requests read ahead of the response being sent on one connection.
+PIPELINE_DEPTH = 16
+
+# Tasks per chunk of a streamed page.
+STREAM_BATCH = 100
+
+MAX_BODY = 1024 * 1024
+
+# Task fields a client may set, and the validation for each.
+FIELDS = {
+    'employee': lambda value: validation.clean_employee(str(value)),
+    'duration': validation.clean_duration,
+    'title': lambda value: validation.clean_title(str(value)),
+    'notes': str,
+    'created_at': validation.clean_date,
+}
+
+REQUIRED = ['employee', 'duration', 'title']
+
+Request = namedtuple('Request', 'method path query body keep_alive')
+
+
+class HTTPError(Exception):
+    """An error reported to the client with an HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Response:
+    """
+    A response with a JSON 'body', or with 'stream', a function returning
+    an async iterator of body chunks.
+    """
+
+    def __init__(self, status=HTTPStatus.OK, body=None, stream=None):
+        self.status = status
+        self.body = body
+        self.stream = stream
+
+
+def task_json(row):
+    """Converts a row of exporter.COLUMNS into a JSON object."""
+    return dict(zip(exporter.NAMES, row), created_at=str(row[-1]))
+
+
+def get_task(task_id):
+    """Returns the task with 'task_id' as JSON."""
+    row = next(exporter.task_rows(search.task_with_id(task_id)), None)
+    if row is not None:
+        return task_json(row)
+    raise HTTPError(HTTPStatus.NOT_FOUND,
+                    "No task with id {}.".format(task_id))
+
+
+def clean_task(record, partial=False):
+    """
+    Validates the task fields in a JSON object, requiring the employee,
+    duration and title unless 'partial'.  Raises ValueError describing the
+    first problem found.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("Expected an object with task fields.")
+    unknown = sorted(record.keys() - FIELDS.keys())
+    if unknown:
+        raise ValueError("Unknown field {}.".format(unknown[0]))
+    if not partial:
+        for name in REQUIRED:
+            if record.get(name) is None:
+                raise ValueError("Missing {}.".format(name))
+    return {name: FIELDS[name](value) for name, value in record.items()}
+
+
+def add_task(body):
+    """Adds the task described by a JSON request body."""
+    fields = clean_task(json.loads(body or b'null'))
+    task = writes.add_task(fields['employee'], fields['duration'],
+                           fields['title'], fields.get('notes', ''),
+                           fields.get('created_at'))
+    return get_task(task.id)
+
+
+def update_task(task_id, body):
+    """Applies the fields in a JSON request body to a task."""
+    fields = clean_task(json.loads(body or b'null'), partial=True)
+    if fields and not writes.update_task(task_id, fields):
+        raise HTTPError(HTTPStatus.NOT_FOUND,
+                        "No task with id {}.".format(task_id))
+    return get_task(task_id)
+
+
+def delete_task(task_id):
+    """Deletes a task."""
+    if not writes.delete_task(task_id):
+        raise HTTPError(HTTPStatus.NOT_FOUND,
+                        "No task with id {}.".format(task_id))
+
+
+def employees(params):
+    """
+    Lists employees with tasks and their task counts, or the names that
+    match a 'name' parameter, best first.
+    """
+    if 'name' in params:
+        return {'employees': search.employee_candidates(params['name'])}
+    return {'employees': [{'name': name, 'tasks': count}
+                          for name, count in search.employees_with_tasks()]}
+
+
+def search_query(params):
+    """
+    Returns the task query for the search in the request parameters, or
+    every task when there is none.
+    """
+    searches = [name for name in ['employee', 'duration', 'keyword', 'date']
+                if name in params]
+    if 'from' in params or 'to' in params:
+        searches.append('from/to')
+    if len(searches) > 1:
+        raise ValueError("Search by only one of employee, duration, "
+                         "keyword, date or from/to.")
+    if 'employee' in params:
+        return search.tasks_by_employee(params['employee'])
+    if 'duration' in params:
+        return search.tasks_by_duration(
+            validation.clean_duration(params['duration']))
+    if 'keyword' in params:
+        return search.tasks_by_keyword(params['keyword'])
+    if 'date' in params:
+        return search.tasks_on_date(validation.clean_date(params['date']))
+    if searches:
+        if 'from' not in params or 'to' not in params:
+            raise ValueError("Give both from and to for a date range.")
+        return search.tasks_in_range(validation.clean_date(params['from']),
+                                     validation.clean_date(params['to']))
+    return search.all_tasks()
+
+
+def find_cursor(tasks, after):
+    """
+    Returns the task a page continues after, read through the search query
+    so it carries the search's sort keys.
+    """
+    try:
+        return tasks.where(Task.id == int(after)).get()
+    except (ValueError, Task.DoesNotExist):
+        raise ValueError("The 'after' cursor doesn't match a task in these "
+                         "results.")
+
+
+def page_chunks(tasks, after, limit, stopped):
+    """
+    Yields the JSON for one page of search results in chunks of
+    STREAM_BATCH tasks, ending with the cursor for the next page.
+    """
+    keys = order_for(tasks)
+    rows = exporter.task_rows(page_query(tasks, keys, after,
+                                         limit=limit + 1))
+    separator = ''
+    batch = []
+    count = 0
+    last = None
+    more = False
+    yield '{"tasks": ['
+    for row in rows:
+        if count == limit:
+            more = True
+            break
+        batch.append(json.dumps(task_json(row)))
+        last = row[0]
+        count += 1
+        if len(batch) == STREAM_BATCH:
+            yield separator + ', '.join(batch)
+            separator = ', '
+            batch = []
+        if stopped.is_set():
+            return
+    if batch:
+        yield separator + ', '.join(batch)
+    yield '], "next": {}}}'.format(json.dumps(last if more else None))
+
+
+class Server:
+    """Serves the API, running database work on a pool of threads."""
+
+    def __init__(self, workers=WORKERS):
+        self.executor = ThreadPoolExecutor(workers,
+                                           thread_name_prefix='api')
+
+    async def run(self, func, *args):
+        """Runs func(*args) on the database thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,
+                                          functools.partial(func, *args))
+
+    async def start(self, host=HOST, port=PORT):
+        """Starts listening and returns the asyncio server."""
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self):
+        self.executor.shutdown()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Reads requests from one connection and starts each straight away,
+        while a second task sends the responses back in order.
+        """
+        responses = asyncio.Queue(PIPELINE_DEPTH)
+        sender = asyncio.ensure_future(self.send_responses(responses,
+                                                           writer))
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as error:
+                    response = asyncio.get_running_loop().create_future()
+                    response.set_result(error_response(error.status,
+                                                       str(error)))
+                    await responses.put((response, False))
+                    break
+                if request is None:
+                    break
+                await responses.put((asyncio.ensure_future(
+                    self.respond(request)), request.keep_alive))
+                if not request.keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            await responses.put(None)
+            await sender
+            writer.close()
+
+    async def send_responses(self, responses, writer):
+        """Writes responses in request order until told to stop."""
+        broken = False
+        while True:
+            item = await responses.get()
+            if item is None:
+                return
+            response, keep_alive = item
+            response = await response
+            if broken:
+                continue
+            try:
+                await write_response(writer, response, keep_alive)
+            except Exception:
+                # The client went away or a stream failed part way, after
+                # its status was sent; all that's left is to hang up.
+                broken = True
+                writer.transport.abort()
+
+    async def respond(self, request):
+        """Routes a request, turning errors into JSON error responses."""
+        try:
+            return await self.route(request)
+        except HTTPError as error:
+            return error_response(error.status, str(error))
+        except ValueError as error:
+            return error_response(HTTPStatus.BAD_REQUEST, str(error))
+        except Exception:
+            traceback.print_exc()
+            return error_response(HTTPStatus.INTERNAL_SERVER_ERROR,
+                                  "Something went wrong.")
+
+    async def route(self, request):
+        parts = request.path.strip('/').split('/')
+        method = request.method
+        if parts == ['tasks']:
+            if method == 'GET':
+                return await self.list_tasks(request.query)
+            if method == 'POST':
+                return Response(HTTPStatus.CREATED,
+                                await self.run(add_task, request.body))
+        elif len(parts) == 2 and parts[0] == 'tasks' and parts[1].isdigit():
+            task_id = int(parts[1])
+            if method == 'GET':
+                return Response(body=await self.run(get_task, task_id))
+            if method == 'PATCH':
+                return Response(body=await self.run(update_task, task_id,
+                                                    request.body))
+            if method == 'DELETE':
+                await self.run(delete_task, task_id)
+                return Response(HTTPStatus.NO_CONTENT)
+        elif parts == ['employees']:
+            if method == 'GET':
+                return Response(body=await self.run(employees,
+                                                    request.query))
+        else:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "No such resource.")
+        raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED,
+                        "{} isn't supported here.".format(method))
+
+    async def list_tasks(self, params):
+        """
+        Checks the search and cursor up front, so mistakes get a 400, then
+        streams the page once the response's turn comes.
+        """
+        try:
+            limit = int(params.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_LIMIT:
+            raise ValueError("limit must be from 1 to {}.".format(MAX_LIMIT))
+        # Building a search reads the partition catalog, so it runs on
+        # the pool too.
+        tasks = await self.run(search_query, params)
+        after = None
+        if 'after' in params:
+            after = await self.run(find_cursor, tasks, params['after'])
+        return Response(stream=lambda: self.stream(
+            functools.partial(page_chunks, tasks, after, limit)))
+
+    async def stream(self, chunks):
+        """
+        Runs the generator function 'chunks' on the thread pool and yields
+        what it produces.  At most a couple of chunks wait in memory, so a
+        slow client holds back the database read rather than filling RAM.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(2)
+        stopped = threading.Event()
+
+        def produce():
+            try:
+                for chunk in chunks(stopped):
+                    if stopped.is_set():
+                        return
+                    asyncio.run_coroutine_threadsafe(
+                        queue.put(chunk.encode()), loop).result()
+            except Exception as error:
+                asyncio.run_coroutine_threadsafe(queue.put(error),
+                                                 loop).result()
+            finally:
+                asyncio.run_coroutine_threadsafe(queue.put(None),
+                                                 loop).result()
+
+        done = loop.run_in_executor(self.executor, produce)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            stopped.set()
+            while not done.done():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    await asyncio.wait([done], timeout=0.01)
+
+
+async def read_request(reader):
+    """
+    Reads one request, returning None at a clean end of the connection.
+    """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as error:
+        if not error.partial.strip():
+            return None
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Incomplete request.")
+    except asyncio.LimitOverrunError:
+        raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                        "Request headers are too large.")
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line.")
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Bad Content-Length.")
+    if length > MAX_BODY:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                        "Request body is too large.")
+    body = await reader.readexactly(length) if length else b''
+    url = urllib.parse.urlsplit(target)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.1':
+        keep_alive = connection != 'close'
+    else:
+        keep_alive = connection == 'keep-alive'
+    return Request(method, urllib.parse.unquote(url.path), query, body,
+                   keep_alive)
+
+
+def error_response(status, message):
+    return Response(status, {'error': message})
+
+
+async def write_response(writer, response, keep_alive):
+    """Sends a response, streaming it with chunked encoding if needed."""
+    status = HTTPStatus(response.status)
+    head = ['HTTP/1.1 {} {}'.format(status.value, status.phrase),
+            'Content-Type: application/json',
+            'Connection: {}'.format('keep-alive' if keep_alive else 'close')]
+    if response.stream is None:
+        body = b''
+        if response.body is not None:
+            body = json.dumps(response.body).encode()
+        head.append('Content-Length: {}'.format(len(body)))
+        writer.write('\r\n'.join(head).encode() + b'\r\n\r\n' + body)
+    else:
+        head.append('Transfer-Encoding: chunked')
+        writer.write('\r\n'.join(head).encode() + b'\r\n\r\n')
+        async for chunk in response.stream():
+            writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            await writer.drain()
+        writer.write(b'0\r\n\r\n')
+    await writer.drain()
+
+
+def serve(host=HOST, port=PORT, workers=WORKERS):
+    """Runs the API until interrupted."""
+    async def main():
+        server = Server(workers)
+        listener = await server.start(host, port)
+        address = listener.sockets[0].getsockname()
+        print("Serving the work log API on http://{}:{}/".format(*address[:2]),
+              flush=True)
+        try:
+            async with listener:
+                await listener.serve_forever()
+        finally:
+            server.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,100 @@
+"""
+Cold storage for old tasks.
+
+Most work is on recent tasks, so archiving moves every task created
+before a cutoff date out of the main database, or out of the partitions
+of a partitioned work log, into one archive file next to it:
+work_log.archive.db.  The archive has the complete work log schema, so
+task queries run on it unchanged.  It is opened read only, and after
+each archiving its full-text index is merged, its statistics gathered
+and the file vacuumed, so it is as compact and quick to read as SQLite
+makes it.
+
+The archive is listed among the partitions as ending the day before the
+cutoff, so searches of later dates never open it.  Archived tasks can't
+be edited or deleted, no task can be dated before the cutoff, and the
+cutoff only moves forward.
+
+The new cutoff is listed before any task moves, together with an
+'archiving' setting, and the setting is removed once every file has been
+emptied.  Until then searches still read the files the tasks are moving
+out of, so archiving that stops partway hides nothing, and running it
+again with the same cutoff moves the rest.
+"""
+import datetime
+import os
+
+from peewee import fn
+
+from task import (DATABASE, EPOCH, Partition, Setting, Task, TaskStats,
+                  day_number)
+import partitions
+
+
+def archive(before):
+    """
+    Moves every task created before the day of 'before' into the archive,
+    then shrinks the files they came from.  Returns the number of tasks
+    moved.  Raises ValueError if 'before' is after today, or earlier than
+    a previous cutoff.
+    """
+    cutoff = day_number(before)
+    if cutoff > day_number(datetime.date.today()):
+        raise ValueError("Only tasks from before today can be archived.")
+    through = partitions.archived_through()
+    if through is not None and cutoff <= through:
+        raise ValueError("Tasks before {} are already archived.".format(
+            EPOCH + datetime.timedelta(days=through + 1)))
+
+    if partitions.period() is None:
+        sources = [DATABASE]
+        # Archived tasks keep their ids, so SQLite can't number new ones.
+        (TaskStats.insert(name='last_task_id', value=0)
+         .on_conflict_ignore().execute())
+    else:
+        sources = [partitions.database(name) for name in
+                   partitions.partitions(last_day=cutoff - 1)
+                   if name != partitions.ARCHIVE]
+    first_days = {}
+    for source in sources:
+        first_day = (Task.select(fn.MIN(Task.day)).where(Task.day < cutoff)
+                     .bind(source).scalar())
+        if first_day is not None:
+            first_days[source] = first_day
+
+    # Listing the archive first stops tasks being dated before the cutoff
+    # while they move.
+    earliest = [cutoff - 1] + list(first_days.values())
+    if through is not None:
+        earliest.append(Partition.get_by_id(partitions.ARCHIVE).first_day)
+    with DATABASE.atomic():
+        (Partition.replace(name=partitions.ARCHIVE, first_day=min(earliest),
+                           last_day=cutoff - 1)
+         .execute())
+        Setting.replace(name='archiving', value=str(cutoff)).execute()
+    partitions.writable_archive().close()
+    moved = sum(partitions.transfer(source, partitions.archive_path(),
+                                    first_day, cutoff - 1)
+                for source, first_day in first_days.items())
+
+    for name in partitions.partitions(last_day=cutoff - 1):
+        if name == partitions.ARCHIVE:
+            continue
+        if partitions.partition_days(name)[1] < cutoff:
+            partitions.drop(name)
+        else:
+            (Partition.update(first_day=cutoff)
+             .where(Partition.name == name).execute())
+    Setting.delete().where(Setting.name == 'archiving').execute()
+    for source in first_days:
+        if os.path.exists(source.database):
+            partitions.compact(source)
+    archive = partitions.writable_archive()
+    try:
+        # The archive doesn't change until the next cutoff, so its query
+        # planner statistics stay accurate.
+        archive.execute_sql('ANALYZE')
+        partitions.compact(archive)
+    finally:
+        archive.close()
+    return moved
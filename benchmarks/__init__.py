@@ -0,0 +1,22 @@
+"""
+Performance benchmarks for the work log.
+
+    python -m benchmarks.generate --rows 1000000 big.db
+    python -m benchmarks.run --rows 10000 --output before.json
+    python -m benchmarks.run --rows 10000 --output after.json
+    python -m benchmarks.compare before.json after.json
+    python -m benchmarks.startup
+    python -m benchmarks.snapshot --rows 1000000
+
+'generate' fills a database with a synthetic work log.  'run' builds (or
+reuses) one of the standard sizes, times each search path, paging and
+adding tasks, and writes the timings as JSON.  'compare' lines up two
+result files and fails when a timing got slower than the threshold.
+'startup' times launching the menu and commands in fresh processes.
+'snapshot' times duration statistics through the ORM and through a NumPy
+column snapshot.
+"""
+
+# The standard sizes: small enough to run often, and as large as a long
+# lived team log is likely to get.
+SIZES = [10000, 1000000, 10000000]
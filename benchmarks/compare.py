@@ -0,0 +1,60 @@
+"""
+Compares two benchmark result files and fails if anything got slower.
+
+    python -m benchmarks.compare before.json after.json --threshold 1.25
+"""
+import argparse
+import json
+import sys
+
+
+# Medians this much slower count as a regression...
+THRESHOLD = 1.25
+
+# ...unless they changed by less than this many milliseconds, which is
+# timer noise.
+NOISE_MS = 0.5
+
+
+def regressions(before, after, threshold=THRESHOLD, noise=NOISE_MS):
+    """
+    Yields (case, before median, after median, ratio, regressed) for each
+    case in both result sets.
+    """
+    for name in sorted(before['results'].keys() & after['results'].keys()):
+        old = before['results'][name]['median_ms']
+        new = after['results'][name]['median_ms']
+        ratio = new / old if old else float('inf')
+        yield name, old, new, ratio, ratio > threshold and new - old > noise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare two benchmark result files")
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help="slowdown ratio that fails (default: "
+                             "%(default)s)")
+    args = parser.parse_args(argv)
+    with open(args.before) as stream:
+        before = json.load(stream)
+    with open(args.after) as stream:
+        after = json.load(stream)
+    if before['meta']['rows'] != after['meta']['rows']:
+        print("Warning: comparing {} rows with {} rows.".format(
+            before['meta']['rows'], after['meta']['rows']), file=sys.stderr)
+
+    failed = False
+    print("{:<32} {:>12} {:>12} {:>8}".format(
+        'case', 'before ms', 'after ms', 'ratio'))
+    for name, old, new, ratio, regressed in regressions(
+            before, after, args.threshold):
+        failed = failed or regressed
+        print("{:<32} {:>12.3f} {:>12.3f} {:>7.2f}x{}".format(
+            name, old, new, ratio, '  SLOWER' if regressed else ''))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
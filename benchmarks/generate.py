@@ -0,0 +1,189 @@
+"""
+Synthetic work logs for benchmarking.
+
+The data is shaped like a real team's log rather than uniform noise,
+because that is what decides how selective each index is:
+
+* A few employees log most tasks.  Employees are picked from a Zipf
+  distribution, so the busiest has hundreds of times the tasks of the
+  quietest.
+* Durations cluster on round numbers of minutes.
+* Notes vary from empty to several paragraphs, with a skewed vocabulary,
+  so some keywords match a large share of tasks.  Some notes cite a case
+  number that only a few other tasks share.
+* Tasks are created in order over several years, on weekdays during
+  working hours.
+
+The same seed always produces the same log.
+"""
+import argparse
+import datetime
+import itertools
+import os
+import random
+import sys
+import time
+
+from task import DATABASE, Task, configure
+import importer
+import migrations
+
+
+FIRST_NAMES = ['Alice', 'Bob', 'Carmen', 'Dmitri', 'Emeka', 'Fatima',
+               'George', 'Hiro', 'Ingrid', 'Jamal', 'Keiko', 'Luis', 'Maya',
+               'Nikolai', 'Olga', 'Priya', 'Quinn', 'Rosa', 'Sven', 'Tariq',
+               'Uma', 'Victor', 'Wen', 'Ximena', 'Yusuf', 'Zara']
+
+LAST_NAMES = ['Anderson', 'Brown', 'Chen', 'Dubois', 'Evans', 'Fischer',
+              'Garcia', 'Haddad', 'Ivanov', 'Jensen', 'Kowalski', 'Lopez',
+              'Mbeki', 'Nakamura', 'Okafor', 'Patel', 'Quispe', 'Rossi',
+              'Schmidt', 'Tanaka', 'Usman', 'Varga', 'Williams', 'Xu',
+              'Yilmaz', 'Zhang']
+
+VERBS = ['Fix', 'Review', 'Write', 'Update', 'Plan', 'Deploy', 'Test',
+         'Refactor', 'Document', 'Investigate', 'Migrate', 'Design',
+         'Meet about', 'Triage', 'Prototype', 'Benchmark']
+
+NOUNS = ['invoice export', 'login page', 'search index', 'build pipeline',
+         'customer report', 'billing service', 'release notes',
+         'database backup', 'onboarding guide', 'mobile app', 'API docs',
+         'payment gateway', 'dashboard', 'email templates', 'test suite',
+         'inventory sync', 'audit log', 'staging server', 'roadmap',
+         'support tickets']
+
+COMMON_WORDS = ['the', 'and', 'to', 'with', 'for', 'on', 'after', 'before',
+                'team', 'customer', 'issue', 'change', 'review', 'meeting',
+                'bug', 'deploy', 'update', 'data', 'report', 'fix']
+
+# Durations people actually log, in minutes, and how often.
+DURATIONS = [5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 240, 480]
+DURATION_WEIGHTS = [4, 6, 12, 5, 16, 8, 14, 6, 8, 4, 3, 2]
+
+FIRST_DAY = datetime.datetime(2019, 1, 1)
+
+# Share of tasks citing a case number, and tasks per case number.
+CASE_RATE = 0.2
+TASKS_PER_CASE = 4
+
+
+def zipf_weights(count, exponent=1.1):
+    """Cumulative weights for picking item n with weight 1 / n^exponent."""
+    return list(itertools.accumulate(1 / rank ** exponent
+                                     for rank in range(1, count + 1)))
+
+
+def employee_names(count, rng):
+    """Returns 'count' distinct employee names."""
+    names = ['{} {}'.format(first, last)
+             for first in FIRST_NAMES for last in LAST_NAMES]
+    rng.shuffle(names)
+    if count > len(names):
+        names += ['{} {}'.format(names[number % len(names)],
+                                 number // len(names) + 1)
+                  for number in range(len(names), count)]
+    return names[:count]
+
+
+def vocabulary(rng, size=5000):
+    """
+    Returns made-up words for notes, after the common words, so keyword
+    searches have both frequent and rare terms.
+    """
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vo', 'zi', 'sh', 'en',
+                 'ar', 'po', 'qu', 'ex', 'dr', 'bl', 'or', 'in', 'st', 'um']
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(syllables)
+                          for _ in range(rng.randint(2, 4))))
+    return COMMON_WORDS + sorted(words)
+
+
+def sentences(rng, count=5000):
+    """Returns a pool of sentences to build notes from."""
+    words = vocabulary(rng)
+    weights = zipf_weights(len(words))
+    pool = []
+    for _ in range(count):
+        chosen = rng.choices(words, cum_weights=weights,
+                             k=rng.randint(6, 20))
+        pool.append(' '.join(chosen).capitalize() + '.')
+    return pool
+
+
+def timestamps(rows, years):
+    """
+    Yields 'rows' creation times in order, spread evenly over the working
+    hours of the weekdays in 'years' years.
+    """
+    workdays = [day for day in range(int(years * 365.25))
+                if (FIRST_DAY + datetime.timedelta(days=day)).weekday() < 5]
+    for number in range(rows):
+        slot = number * len(workdays) / rows
+        day = int(slot)
+        seconds = (8 + (slot - day) * 10) * 3600
+        yield FIRST_DAY + datetime.timedelta(days=workdays[day],
+                                             seconds=seconds)
+
+
+def work_log(rows, seed=0, years=5):
+    """
+    Yields 'rows' synthetic tasks as rows ready for importer.insert_rows().
+    """
+    rng = random.Random(seed)
+    employees = employee_names(max(20, min(50000, rows // 200)), rng)
+    employee_weights = zipf_weights(len(employees))
+    pool = sentences(rng)
+    cases = max(1, int(rows * CASE_RATE / TASKS_PER_CASE))
+    created_at = Task.created_at.db_value
+    # A generator of its own, so the tasks are the same as before tasks
+    # had uuids.
+    uuids = random.Random(seed)
+    for when in timestamps(rows, years):
+        # Mostly a line or two, sometimes nothing, now and then pages.
+        length = min(200, int(rng.lognormvariate(0.7, 1.0)))
+        notes = ' '.join(rng.choice(pool) for _ in range(length))
+        if rng.random() < CASE_RATE:
+            notes += ' See case{}.'.format(rng.randrange(cases))
+        yield (
+            rng.choices(employees, cum_weights=employee_weights)[0],
+            (rng.randint(1, 600) if rng.random() < 0.05 else
+             rng.choices(DURATIONS, DURATION_WEIGHTS)[0]),
+            '{} {}'.format(rng.choice(VERBS), rng.choice(NOUNS)),
+            notes.strip(),
+            created_at(when),
+            '{:032x}'.format(uuids.getrandbits(128)),
+            0,
+        )
+
+
+def generate(path, rows, seed=0, years=5):
+    """
+    Creates a database at 'path' holding a synthetic work log of 'rows'
+    tasks.  Returns the seconds taken.
+    """
+    if os.path.exists(path):
+        raise ValueError("{} already exists.".format(path))
+    start = time.perf_counter()
+    configure(path)
+    migrations.migrate(DATABASE)
+    importer.insert_rows(work_log(rows, seed, years))
+    DATABASE.execute_sql('ANALYZE')
+    DATABASE.close()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic work log database")
+    parser.add_argument('path', help="database file to create")
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--years', type=int, default=5)
+    args = parser.parse_args(argv)
+    seconds = generate(args.path, args.rows, args.seed, args.years)
+    print("Generated {} tasks in {:.1f}s.".format(args.rows, seconds),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
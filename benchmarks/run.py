@@ -0,0 +1,294 @@
+"""
+Times every search path, paging through all tasks, and adding tasks, on a
+synthetic work log, and writes the timings as JSON.
+
+The menu functions themselves are timed, with input() answered from a
+script and the screen output discarded, so a timing covers what the user
+waits for: building the query, checking it found something, and fetching
+the first page of results.
+"""
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+import peewee
+
+from task import DATABASE, Employee, Task, configure
+from benchmarks import generate
+from paging import TaskPager, order_for
+import migrations
+import work_log_database
+
+
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'work_log_benchmarks')
+
+# Runs of each case, and the seconds after which a slow case stops early
+# once it has run at least MIN_RUNS times.
+REPEAT = 10
+MIN_RUNS = 3
+TIME_LIMIT = 10
+
+# Tasks added by the add_task case.
+ADDS = 200
+
+# Pages of 25 tasks viewed by the view_all_tasks case.
+PAGES = 10
+
+
+@contextlib.contextmanager
+def scripted(answers):
+    """
+    Answers input() prompts from 'answers' in turn and discards the
+    screen output while the menus run.
+    """
+    with open(os.devnull, 'w') as devnull, \
+            patch('builtins.input', side_effect=answers), \
+            patch('work_log_database.clear'), \
+            contextlib.redirect_stdout(devnull):
+        yield
+
+
+def first_page(tasks):
+    """Does what search_tasks() does with a search's results."""
+    if tasks.exists():
+        return TaskPager(tasks, order_for(tasks)).window
+    return []
+
+
+def search_case(menu_function, answers):
+    """Returns a function that runs a search menu and shows its results."""
+    def run():
+        with scripted(list(answers)):
+            return first_page(menu_function())
+    return run
+
+
+def view_all_tasks():
+    """Views the first PAGES pages of tasks, one task at a time."""
+    answers = ['n'] * (PAGES * 25 - 1) + ['b']
+    with scripted(answers):
+        work_log_database.view_all_tasks()
+
+
+def timings(func, repeat):
+    """
+    Calls 'func' once to warm the caches, then times up to 'repeat' more
+    calls.  Returns their durations in seconds.
+    """
+    func()
+    durations = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+        if (len(durations) >= MIN_RUNS and
+                time.perf_counter() - started > TIME_LIMIT):
+            break
+    return durations
+
+
+def summarize(durations):
+    """Summarizes durations in milliseconds."""
+    ordered = sorted(duration * 1000 for duration in durations)
+    return {
+        'runs': len(ordered),
+        'min_ms': round(ordered[0], 3),
+        'median_ms': round(statistics.median(ordered), 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1,
+                                    int(len(ordered) * 0.95))], 3),
+        'mean_ms': round(statistics.mean(ordered), 3),
+    }
+
+
+def rare_keyword(tasks):
+    """
+    Picks the case number cited by a task halfway through, which only a
+    few tasks share.
+    """
+    middle = (Task.select().where((Task.id >= tasks // 2) &
+                                  Task.notes.contains(' See case'))
+              .order_by(Task.id).get())
+    return middle.notes.rsplit(' ', 1)[1].rstrip('.')
+
+
+def misspell(name):
+    """Swaps two letters in the middle of a name, as a typo would."""
+    middle = len(name) // 2
+    return name[:middle - 1] + name[middle] + name[middle - 1] + \
+        name[middle + 1:]
+
+
+def cases():
+    """
+    Returns (name, function) pairs for each case, with search terms picked
+    from the data so they mean the same thing at every size.
+    """
+    tasks = Task.select().count()
+    busiest = (Employee.select().order_by(Employee.task_count.desc(),
+                                          Employee.name).get().name)
+    quietest = (Employee.select().where(Employee.task_count > 0)
+                .order_by(Employee.task_count, Employee.name).get().name)
+    middle = (Task.select().where(Task.id >= tasks // 2).order_by(Task.id)
+              .get().created_at)
+    day = middle.strftime('%m/%d/%Y')
+    week_end = (middle + datetime.timedelta(days=6)).strftime('%m/%d/%Y')
+    year_end = (middle + datetime.timedelta(days=364)).strftime('%m/%d/%Y')
+    rare = rare_keyword(tasks)
+    menu = work_log_database
+    return [
+        ('employee_by_entry.busiest',
+         search_case(menu.employee_by_entry, [busiest, '0'])),
+        ('employee_by_entry.quietest',
+         search_case(menu.employee_by_entry, [quietest, '0'])),
+        ('employee_by_entry.partial',
+         search_case(menu.employee_by_entry, [busiest.split()[0], '0'])),
+        ('employee_by_entry.typo',
+         search_case(menu.employee_by_entry, [misspell(quietest), '0'])),
+        ('list_of_employees',
+         search_case(menu.list_of_employees, ['0'])),
+        ('duration_search.common',
+         search_case(menu.duration_search, ['30'])),
+        ('duration_search.rare',
+         search_case(menu.duration_search, ['599'])),
+        ('keyword_search.common',
+         search_case(menu.keyword_search, ['customer'])),
+        ('keyword_search.rare',
+         search_case(menu.keyword_search, [rare])),
+        ('keyword_search.prefix',
+         search_case(menu.keyword_search, [rare[:-1] + '*'])),
+        ('date_search',
+         search_case(menu.date_search, [day])),
+        ('date_range_search.week',
+         search_case(menu.date_range_search, [day, week_end])),
+        ('date_range_search.year',
+         search_case(menu.date_range_search, [day, year_end])),
+        ('view_all_tasks.{}_pages'.format(PAGES), view_all_tasks),
+    ]
+
+
+def add_tasks(count=ADDS):
+    """
+    Adds 'count' tasks through the add task menu, then deletes them so the
+    data is unchanged.  Returns the durations of each add.
+    """
+    last_id = Task.select(peewee.fn.MAX(Task.id)).scalar()
+    answers = itertools.chain.from_iterable(
+        ['Benchmark Person', '30', 'Benchmark task {}'.format(number),
+         'Added by the benchmark', '']
+        for number in range(count))
+    durations = []
+    with scripted(answers):
+        for _ in range(count):
+            start = time.perf_counter()
+            work_log_database.add_task()
+            durations.append(time.perf_counter() - start)
+    Task.delete().where(Task.id > last_id).execute()
+    Employee.delete().where(Employee.name == 'Benchmark Person').execute()
+    return durations
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def database_for(rows, seed, data_dir):
+    """
+    Returns the path of the synthetic database with 'rows' tasks, creating
+    it if it isn't in 'data_dir' yet.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, 'work_log_{}_{}.db'.format(rows, seed))
+    if not os.path.exists(path):
+        partial = path + '.partial'
+        for leftover in [partial, partial + '-wal', partial + '-shm']:
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        print("Generating {} tasks...".format(rows), file=sys.stderr)
+        generate.generate(partial, rows, seed)
+        os.rename(partial, path)
+    return path
+
+
+def run(path, repeat=REPEAT, only=None):
+    """Runs the cases against the database at 'path'."""
+    configure(path)
+    migrations.migrate(DATABASE)
+    results = {}
+    for name, func in cases():
+        if only and only not in name:
+            continue
+        print("  {}".format(name), file=sys.stderr)
+        results[name] = summarize(timings(func, repeat))
+    if not only or only in 'add_task':
+        print("  add_task", file=sys.stderr)
+        durations = add_tasks()
+        results['add_task'] = dict(summarize(durations), ops_per_sec=round(
+            len(durations) / sum(durations), 1))
+    DATABASE.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the work log's searches, paging and adds")
+    parser.add_argument('--rows', type=int, default=10000,
+                        help="size of the synthetic work log "
+                             "(default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database',
+                        help="time an existing database instead")
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help="where generated databases are kept for reuse "
+                             "(default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help="timed runs of each case (default: %(default)s)")
+    parser.add_argument('--only', help="only cases whose name contains this")
+    parser.add_argument('-o', '--output', default='-',
+                        help="JSON file to write, or - for stdout")
+    args = parser.parse_args(argv)
+
+    path = args.database or database_for(args.rows, args.seed, args.data_dir)
+    results = run(path, args.repeat, args.only)
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'rows': Task.select().count(),
+            'seed': None if args.database else args.seed,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'peewee': peewee.__version__,
+            'machine': platform.platform(),
+        },
+        'results': results,
+    }
+    DATABASE.close()
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as stream:
+            json.dump(report, stream, indent=2)
+            stream.write('\n')
+
+
+if __name__ == '__main__':
+    main()
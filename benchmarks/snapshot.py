@@ -0,0 +1,105 @@
+"""
+Times duration statistics over a synthetic work log through the ORM and
+through a NumPy column snapshot.
+
+    python -m benchmarks.snapshot --rows 1000000
+
+Each way filters the tasks of the last three years that took half an
+hour or more, and totals, averages and takes the median of their
+minutes.  The snapshot is timed both including and after loading it,
+and refreshing it after a hundred edits is timed too.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+from task import DATABASE, Task, configure
+from benchmarks import generate
+import migrations
+import partitions
+import snapshot
+
+
+MIN_DURATION = 30
+YEARS = 3
+EDITS = 100
+
+
+def orm_statistics(start_date):
+    """Filters and adds up the tasks as model objects, in Python."""
+    durations = sorted(
+        task.duration
+        for part in partitions.each(
+            lambda database: list(Task.select().bind(database)))
+        for task in part
+        if task.created_at.date() >= start_date and
+        task.duration >= MIN_DURATION)
+    return (len(durations), sum(durations),
+            sum(durations) / len(durations),
+            durations[len(durations) // 2])
+
+
+def snapshot_statistics(tasks, start_date):
+    """Filters and adds up the tasks in a snapshot's columns."""
+    return tasks.summary(tasks.select(start_date=start_date,
+                                      min_duration=MIN_DURATION))
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+def run(start_date):
+    """Returns the milliseconds each way takes on the open work log."""
+    results = {'orm_ms': timed(lambda: orm_statistics(start_date))}
+    loaded = []
+    results['snapshot_load_ms'] = timed(
+        lambda: loaded.append(snapshot.Snapshot.load()))
+    tasks = loaded[0]
+    results['snapshot_query_ms'] = timed(
+        lambda: snapshot_statistics(tasks, start_date))
+    ids = [task_id for task_id, in Task.select(Task.id)
+           .order_by(Task.id.desc()).limit(EDITS).tuples()]
+    Task.update(duration=Task.duration + 1).where(Task.id.in_(ids)).execute()
+    results['snapshot_refresh_ms'] = timed(tasks.refresh)
+    results['speedup_with_load'] = round(
+        results['orm_ms'] / (results['snapshot_load_ms'] +
+                             results['snapshot_query_ms']), 1)
+    results['speedup_loaded'] = round(
+        results['orm_ms'] / results['snapshot_query_ms'], 1)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time duration statistics through the ORM and NumPy")
+    parser.add_argument('--rows', type=int, default=100000,
+                        help="size of the synthetic work log "
+                             "(default: %(default)s)")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'work_log.db')
+        generate.generate(path, args.rows)
+        configure(path)
+        migrations.migrate(DATABASE)
+        start_date = (datetime.date.today() -
+                      datetime.timedelta(days=365 * YEARS))
+        try:
+            results = run(start_date)
+        finally:
+            partitions.close()
+            DATABASE.close()
+    json.dump({'rows': args.rows, 'results': results}, sys.stdout,
+              indent=2)
+    print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Times how long the work log takes to start: from launching the process
+to the main menu waiting for input, and to a command finishing.
+
+    python -m benchmarks.startup --runs 20
+
+Each run is a fresh Python process on a small synthetic work log, as when
+the tool is launched from a script.  Exits with status 1 when the median
+time to the first menu is over the target.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import generate
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'work_log_database.py')
+
+# Milliseconds from launch to the first menu.
+TARGET_MS = 50
+
+RUNS = 20
+
+# Commands timed from launch to exit, besides the menu.
+COMMANDS = {
+    'report': ['report', '--period', 'month'],
+    'export_keyword': ['export', '--keyword', 'customer'],
+}
+
+
+def first_menu(directory):
+    """
+    Launches the menu on the work log in 'directory' and returns the
+    seconds until it asks for a choice.  Then quits.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, SCRIPT], cwd=directory, stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    output = b''
+    while not output.endswith(b'> '):
+        chunk = os.read(process.stdout.fileno(), 4096)
+        if not chunk:
+            raise RuntimeError("The menu exited before asking for input.")
+        output += chunk
+    elapsed = time.perf_counter() - start
+    process.communicate(b'q\n')
+    return elapsed
+
+
+def command(directory, arguments):
+    """Returns the seconds a command takes to run in 'directory'."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, SCRIPT] + arguments, cwd=directory,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   check=True)
+    return time.perf_counter() - start
+
+
+def summarize(durations):
+    ordered = sorted(duration * 1000 for duration in durations)
+    return {
+        'runs': len(ordered),
+        'min_ms': round(ordered[0], 3),
+        'median_ms': round(statistics.median(ordered), 3),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+
+def run(directory, runs=RUNS):
+    """Times each kind of launch 'runs' times after one warm up run."""
+    results = {}
+    cases = [('first_menu', lambda: first_menu(directory))] + [
+        (name, lambda arguments=arguments: command(directory, arguments))
+        for name, arguments in sorted(COMMANDS.items())]
+    for name, func in cases:
+        func()
+        results[name] = summarize([func() for _ in range(runs)])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the work log's startup")
+    parser.add_argument('--runs', type=int, default=RUNS,
+                        help="launches timed per case (default: %(default)s)")
+    parser.add_argument('--rows', type=int, default=1000,
+                        help="size of the synthetic work log "
+                             "(default: %(default)s)")
+    parser.add_argument('--target', type=float, default=TARGET_MS,
+                        help="most milliseconds to the first menu "
+                             "(default: %(default)s)")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as directory:
+        generate.generate(os.path.join(directory, 'work_log.db'), args.rows)
+        results = run(directory, args.runs)
+    json.dump({'target_ms': args.target, 'results': results}, sys.stdout,
+              indent=2)
+    print()
+    return 0 if results['first_menu']['median_ms'] <= args.target else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+The change log as a stream of JSON lines, for programs that keep their
+own copy of the work log and want only what changed since they last
+looked.
+
+Triggers record every task added, edited or deleted in the task_change
+table, with a sequence number that only ever goes up.  Each change is
+written as one line: its seq, op, task id and uuid, and for inserts and
+updates the fields set, such as
+
+    {"seq": 7, "op": "update", "task_id": 3,
+     "uuid": "0c5e...", "fields": {"duration": 45}}
+
+A reader saves the seq of the last line it handled and asks for the
+changes after it next time.
+
+Each partition and archive file keeps its own change log, numbered on
+its own, so when the work log has several files each line also names
+its 'log', and carries a 'cursor' covering every file to resume from.
+A task moved between files shows up as a delete from one log and an
+insert into the other, keeping its uuid, so readers of such a work log
+should key tasks by uuid.
+"""
+import json
+import time
+
+from task import DATABASE, Task, TaskChange
+import partitions
+
+
+# Name of the main file's log in a cursor.
+MAIN = 'main'
+
+# Changes read from a file at a time.
+BATCH_SIZE = 1000
+
+# Task ids or uuids looked up per query.
+CHUNK = 500
+
+# Seconds between looks for new changes when following the log.
+POLL_INTERVAL = 1.0
+
+
+def logs():
+    """Returns (name, database) for each file of the work log, main last."""
+    return ([(name, partitions.database(name))
+             for name in partitions.partitions()] + [(MAIN, DATABASE)])
+
+
+def last_change(database):
+    """Returns the seq of the latest change to 'database', or 0."""
+    return (TaskChange.select(TaskChange.seq)
+            .order_by(TaskChange.seq.desc())
+            .limit(1).bind(database).scalar()) or 0
+
+
+def chunks(items):
+    """
+    Yields the items in lists of at most CHUNK, few enough to look up
+    with one IN.
+    """
+    items = list(items)
+    for start in range(0, len(items), CHUNK):
+        yield items[start:start + CHUNK]
+
+
+def parse_cursor(text):
+    """
+    Returns a dict of log name to last seq read from a cursor: a seq of
+    the main file's log, or 'name:seq' pairs joined by commas.  Raises
+    ValueError if the text is neither.
+    """
+    try:
+        if ':' not in text:
+            return {MAIN: int(text)}
+        cursor = {}
+        for pair in text.split(','):
+            name, seq = pair.split(':')
+            cursor[name.strip()] = int(seq)
+        return cursor
+    except ValueError:
+        raise ValueError("{!r} isn't a change log position.".format(text))
+
+
+def format_cursor(cursor):
+    return ','.join('{}:{}'.format(name, seq)
+                    for name, seq in sorted(cursor.items()))
+
+
+def change(row):
+    """Makes the JSON object for a (seq, task id, op, uuid, fields) row."""
+    seq, task_id, op, uuid, fields = row
+    found = {'seq': seq, 'op': op, 'task_id': task_id}
+    if uuid is not None:
+        found['uuid'] = uuid
+    if fields is not None:
+        fields = json.loads(fields)
+        if fields.get('created_at') is not None:
+            fields['created_at'] = str(
+                Task.created_at.python_value(fields['created_at']))
+        found['fields'] = fields
+    return found
+
+
+def read(database, since, limit=BATCH_SIZE):
+    """Returns up to 'limit' change objects after seq 'since'."""
+    return [change(row) for row in
+            TaskChange.select(TaskChange.seq, TaskChange.task_id,
+                              TaskChange.op, TaskChange.uuid,
+                              TaskChange.fields)
+            .where(TaskChange.seq > since)
+            .order_by(TaskChange.seq)
+            .limit(limit).bind(database).tuples()]
+
+
+def tail(stream, since=None, follow=False, interval=POLL_INTERVAL):
+    """
+    Writes the changes after 'since', a cursor as parse_cursor() returns
+    it, to an open text stream as JSON lines, log by log, and returns how
+    many were written.  When 'follow', keeps looking for new changes every
+    'interval' seconds instead of returning.
+    """
+    cursor = dict(since or {})
+    written = 0
+    while True:
+        found = logs()
+        several = len(found) > 1
+        read_any = False
+        for name, database in found:
+            while True:
+                changes = read(database, cursor.get(name, 0))
+                for line in changes:
+                    cursor[name] = line['seq']
+                    if several:
+                        line['log'] = name
+                        line['cursor'] = format_cursor(cursor)
+                    stream.write(json.dumps(line))
+                    stream.write("\n")
+                written += len(changes)
+                read_any = read_any or bool(changes)
+                if len(changes) < BATCH_SIZE:
+                    break
+        stream.flush()
+        if not follow:
+            return written
+        if not read_any:
+            time.sleep(interval)
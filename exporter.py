@@ -0,0 +1,97 @@
+"""
+Streaming export of tasks to CSV or JSONL, optionally gzip compressed.
+
+Rows are read with a plain tuple cursor and written as they arrive, so
+memory use stays flat no matter how many tasks are exported.  The
+columns match what the importer reads, so an export can be re-imported.
+"""
+import csv
+import gzip
+import io
+import json
+import sys
+
+from task import Employee, Task
+
+
+COLUMNS = [Task.id, Employee.name.alias('employee'), Task.duration,
+           Task.title, Task.notes, Task.created_at]
+
+NAMES = ['id', 'employee', 'duration', 'title', 'notes', 'created_at']
+
+
+def write_csv(rows, stream):
+    writer = csv.writer(stream)
+    writer.writerow(NAMES)
+    for row in rows:
+        writer.writerow(row)
+
+
+def write_jsonl(rows, stream):
+    for row in rows:
+        stream.write(json.dumps(dict(zip(NAMES, row)), default=str))
+        stream.write("\n")
+
+
+WRITERS = {
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+}
+
+
+def task_rows(tasks):
+    """
+    Returns an iterator over the COLUMNS of each task in a task query, as
+    tuples read straight from the cursor.
+    """
+    tasks = (tasks.select(*COLUMNS)
+             .switch(Task)
+             .join(Employee, on=(Task.employee == Employee.id)))
+    return tasks.tuples().iterator()
+
+
+def export_tasks(tasks, stream, file_format):
+    """
+    Writes the tasks from a task query to an open text stream.
+    Returns the number of tasks written.
+    """
+    rows = CountingIterator(task_rows(tasks))
+    WRITERS[file_format](rows, stream)
+    return rows.count
+
+
+class CountingIterator:
+    """Wraps an iterator and counts the items taken from it."""
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self.iterator)
+        self.count += 1
+        return item
+
+
+def export_file(tasks, path, file_format, compress=None):
+    """
+    Exports the tasks from a task query to 'path', or to standard output
+    when 'path' is '-'.  Output is gzip compressed when 'compress' is
+    true, or when it is None and the path ends in '.gz'.
+    Returns the number of tasks written.
+    """
+    if compress is None:
+        compress = path.endswith('.gz')
+    if path == '-':
+        if not compress:
+            return export_tasks(tasks, sys.stdout, file_format)
+        with gzip.GzipFile(fileobj=sys.stdout.buffer, mode='wb') as raw:
+            with io.TextIOWrapper(raw, encoding='utf-8',
+                                  newline='') as stream:
+                return export_tasks(tasks, stream, file_format)
+    opener = gzip.open if compress else open
+    with opener(path, 'wt', newline='', encoding='utf-8') as stream:
+        return export_tasks(tasks, stream, file_format)
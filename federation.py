@@ -0,0 +1,314 @@
+"""
+Federated search: the same search run across several work log files at
+once, such as one file per team.
+
+Each file is searched in a worker process from a pool, so searching
+many files uses every core rather than taking turns on one.  A worker
+opens its file, and any partition or archive files, read only: the
+main file with query_only, since partition and archive paths are named
+after it, and the others with SQLite's mode=ro, so they are never
+created or migrated either.  It then runs the search function on it as
+the menus would, and returns one page of results as plain tuples.  The
+pages of all the files are merged by creation time, so the pager steps
+through every file's tasks in one date order, reading a page from each
+file at a time.  Ties are broken by file and then id, since ids repeat
+across files.
+
+Federated results are read only.  Each task is shown with the file it
+came from, which is where to edit it.
+"""
+import concurrent.futures
+import glob
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+
+from startup import (LazyModule, on_teardown, partition_path,
+                     schema_is_current)
+from task import DATABASE, Employee, Task
+import migrations
+import partitions
+import search
+
+planner = LazyModule('planner')
+
+
+# Worker processes searching files, or None for one per core.
+WORKERS = None
+
+# Connection settings for the files searched.  query_only keeps a
+# search from ever writing to another team's work log, whose partition
+# and archive files are also opened with mode=ro.
+PRAGMAS = [
+    ('query_only', 1),
+    ('cache_size', -16 * 1024),
+    ('busy_timeout', 5000),
+]
+
+# Tasks read from each file at a time when iterating over every result.
+PAGE_ROWS = 500
+
+NOT_FOUND = "No work log found at {}."
+OUT_OF_DATE = ("The work log at {} has an older schema.  Open it with the "
+               "work log once to upgrade it.")
+
+POOL = None
+LOCK = threading.Lock()
+
+
+def expand(patterns):
+    """
+    Returns the absolute paths of the work log files named or matched by
+    the glob 'patterns', in order and without repeats.  Partition and
+    archive files of a matched work log are left out, since searching
+    the work log reads them.
+    """
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            found = sorted(glob.glob(pattern))
+        else:
+            found = [pattern]
+        for path in found:
+            path = os.path.abspath(path)
+            if not os.path.isfile(path):
+                raise ValueError(NOT_FOUND.format(path))
+            if not schema_is_current(path):
+                raise ValueError(OUT_OF_DATE.format(path))
+            if path not in paths:
+                paths.append(path)
+    return [path for path in paths
+            if not any(belongs_to(path, other) for other in paths)]
+
+
+def belongs_to(path, other):
+    """Tells whether 'path' is a partition or archive file of 'other'."""
+    name = os.path.basename(path)[len(os.path.basename(
+        os.path.splitext(other)[0])) + 1:]
+    name = os.path.splitext(name)[0]
+    return (path != other and bool(name) and '.' not in name and
+            partition_path(other, name) == path)
+
+
+def pool():
+    """Returns the worker pool, starting it on first use."""
+    global POOL
+    with LOCK:
+        if POOL is None:
+            # Fresh processes, since SQLite connections and the partition
+            # thread pool can't be carried across a fork.
+            POOL = concurrent.futures.ProcessPoolExecutor(
+                WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return POOL
+
+
+@on_teardown
+def close():
+    """Stops the worker pool."""
+    global POOL
+    with LOCK:
+        if POOL is not None:
+            POOL.shutdown()
+            POOL = None
+
+
+def use(path):
+    """Points this worker's DATABASE at the work log at 'path'."""
+    if DATABASE.database == path and not DATABASE.is_closed():
+        return
+    partitions.close()
+    DATABASE.close()
+    DATABASE.init(path, pragmas=PRAGMAS)
+    partitions.open_read_only(PRAGMAS)
+    if migrations.schema_version(DATABASE) != migrations.SCHEMA_VERSION:
+        raise ValueError(OUT_OF_DATE.format(path))
+
+
+def run_search(function, args):
+    """Returns the tasks search.function(*args) finds in DATABASE."""
+    if function == 'combined_search':
+        tasks, _, _ = planner.combined_search(*args)
+        return tasks
+    return getattr(search, function)(*args)
+
+
+def seek(path, position, forward):
+    """
+    Builds the condition selecting the tasks in the file at 'path' that
+    come after (or before) 'position', a (created_at, path, id) tuple,
+    in federated order.
+    """
+    created_at, source, task_id = position
+    if path == source:
+        if forward:
+            return ((Task.created_at > created_at) |
+                    ((Task.created_at == created_at) & (Task.id > task_id)))
+        return ((Task.created_at < created_at) |
+                ((Task.created_at == created_at) & (Task.id < task_id)))
+    if forward:
+        if path > source:
+            return Task.created_at >= created_at
+        return Task.created_at > created_at
+    if path < source:
+        return Task.created_at <= created_at
+    return Task.created_at < created_at
+
+
+def search_page(path, function, args, position, forward, limit):
+    """
+    Runs a search on the work log at 'path' and returns up to 'limit' of
+    the tasks it finds past 'position', or from the start when that is
+    None.  Tasks are (created_at, path, id, employee, duration, title,
+    notes) tuples in federated order, or reverse order if not 'forward'.
+    """
+    use(path)
+    tasks = run_search(function, args)
+    if isinstance(tasks, partitions.PartitionedQuery):
+        tasks = tasks.reverse(not forward)
+    if position is not None:
+        tasks = tasks.where(seek(path, position, forward))
+    order = [Task.created_at, Task.id]
+    if not forward:
+        order = [expression.desc() for expression in order]
+    rows = (tasks.select(Task.created_at, Task.id, Employee.name,
+                         Task.duration, Task.title, Task.notes)
+            .switch(Task)
+            .join(Employee, on=(Task.employee == Employee.id))
+            .order_by(*order)
+            .limit(limit)
+            .tuples())
+    return [(row[0], path) + row[1:] for row in rows]
+
+
+def call(path, function, args=()):
+    """Runs one of FUNCTIONS on the work log at 'path'."""
+    use(path)
+    return FUNCTIONS[function](*args)
+
+
+FUNCTIONS = {
+    'employee_candidates': search.employee_candidates,
+    'employees_with_tasks': search.employees_with_tasks,
+    'task_count': partitions.task_count,
+}
+
+
+class FederatedSearch:
+    """
+    A search run on each of several work log files, read a page at a
+    time in date order across all of them.
+    """
+
+    def __init__(self, paths, function, args=()):
+        self.paths = paths
+        self.function = function
+        self.args = args
+
+    def page(self, after=None, forward=True, limit=None):
+        """
+        Returns up to 'limit' tasks following the task 'after', or from
+        the start when it is None.  When not 'forward', the tasks before
+        'after' are returned, nearest first.
+        """
+        position = None
+        if after is not None:
+            position = (after.created_at, after.source, after.id)
+        futures = [pool().submit(search_page, path, self.function,
+                                 self.args, position, forward, limit)
+                   for path in self.paths]
+        merged = heapq.merge(*[future.result() for future in futures],
+                             key=lambda row: row[:3], reverse=not forward)
+        return [self.task(row) for row in itertools.islice(merged, limit)]
+
+    def exists(self):
+        """Tells whether any file has a task the search finds."""
+        return bool(self.page(limit=1))
+
+    def __iter__(self):
+        after = None
+        while True:
+            tasks = self.page(after, limit=PAGE_ROWS)
+            yield from tasks
+            if len(tasks) < PAGE_ROWS:
+                return
+            after = tasks[-1]
+
+    @staticmethod
+    def task(row):
+        """Makes a Task from a search_page() row, with its source file."""
+        created_at, source, task_id, employee, duration, title, notes = row
+        task = Task(id=task_id, duration=duration, title=title,
+                    notes=notes, created_at=created_at)
+        task.employee = Employee(name=employee)
+        task.source = source
+        return task
+
+
+class Federation:
+    """
+    The searches of the search module, run on several work log files at
+    once.  Searches returning tasks return FederatedSearches; the others
+    combine what each file returns.
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def tasks(self, function, *args):
+        return FederatedSearch(self.paths, function, args)
+
+    def each(self, function, *args):
+        """Runs call() on every file in the pool, returning the results."""
+        return list(pool().map(call, self.paths,
+                               itertools.repeat(function),
+                               itertools.repeat(args)))
+
+    def all_tasks(self):
+        return self.tasks('all_tasks')
+
+    def tasks_by_employee(self, employee):
+        return self.tasks('tasks_by_employee', employee)
+
+    def tasks_by_duration(self, duration):
+        return self.tasks('tasks_by_duration', duration)
+
+    def tasks_by_keyword(self, keyword):
+        return self.tasks('tasks_by_keyword', keyword)
+
+    def tasks_on_date(self, date):
+        return self.tasks('tasks_on_date', date)
+
+    def tasks_in_range(self, start_date, end_date):
+        return self.tasks('tasks_in_range', start_date, end_date)
+
+    def combined_search(self, criteria):
+        """
+        Returns the tasks matching planner 'criteria'.  Each file plans
+        the search for itself.
+        """
+        return self.tasks('combined_search', criteria)
+
+    def task_count(self):
+        return sum(self.each('task_count'))
+
+    def employees_with_tasks(self):
+        """Returns (name, task count) for each employee with tasks."""
+        counts = {}
+        for found in self.each('employees_with_tasks'):
+            for name, count in found:
+                counts[name] = counts.get(name, 0) + count
+        return sorted(counts.items())
+
+    def employee_candidates(self, text, limit=search.CANDIDATE_LIMIT):
+        """
+        Returns up to 'limit' names matching 'text' in any file, names
+        starting with it first, then shortest first.
+        """
+        names = set()
+        for found in self.each('employee_candidates', text, limit):
+            names.update(found)
+        text = text.lower()
+        return sorted(names, key=lambda name: (
+            not name.lower().startswith(text), len(name), name))[:limit]
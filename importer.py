@@ -0,0 +1,232 @@
+"""
+Non-interactive bulk import of tasks from CSV or JSONL files.
+
+Rows are streamed from the file, validated with the same rules as the
+interactive prompts, and written in batches inside large transactions.
+Rows that fail validation are skipped and reported with their line
+number.
+"""
+import csv
+import datetime
+import gzip
+import itertools
+import json
+import os
+import sys
+
+from task import (Employee, Task, DATABASE, day_number, new_uuid,
+                  now_micros, retry_on_busy)
+import partitions
+import validation
+
+
+# Rows handed to each executemany() call.
+BATCH_SIZE = 1000
+
+# Rows per transaction.  Each commit pays for an fsync, so commit rarely.
+TRANSACTION_SIZE = 50000
+
+FIELDS = [Task.employee, Task.duration, Task.title, Task.notes,
+          Task.created_at, Task.uuid, Task.updated_at]
+
+FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.json': 'jsonl',
+}
+
+
+def detect_format(path):
+    """
+    Guesses the file format from the file extension, ignoring a trailing
+    '.gz'.
+    """
+    root, extension = os.path.splitext(path.lower())
+    if extension == '.gz':
+        extension = os.path.splitext(root)[1]
+    if extension not in FORMATS:
+        raise ValueError("Can't tell the format of {!r}; "
+                         "use --format csv or --format jsonl.".format(path))
+    return FORMATS[extension]
+
+
+def read_csv(stream):
+    """Yields (line number, record) pairs from a CSV file with a header."""
+    reader = csv.DictReader(stream)
+    for record in reader:
+        yield reader.line_num, record
+
+
+def read_jsonl(stream):
+    """
+    Yields (line number, record) pairs from a file with one JSON object
+    per line.  Lines that aren't valid JSON are yielded as the error.
+    """
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as error:
+            yield line_number, error
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def clean_record(record, now, archived_through=None):
+    """
+    Validates one imported record and returns it as a row tuple of
+    database values in FIELDS order.  Raises ValueError describing the
+    first problem found.  Records dated on or before the day number
+    'archived_through' are rejected, since those days are archived.
+    """
+    if isinstance(record, Exception):
+        raise ValueError("Invalid JSON: {}".format(record))
+    if not isinstance(record, dict):
+        raise ValueError("Expected an object with task fields.")
+    for name in ['employee', 'duration', 'title']:
+        if record.get(name) is None:
+            raise ValueError("Missing {}.".format(name))
+    row = (
+        validation.clean_employee(str(record['employee'])),
+        validation.clean_duration(record['duration']),
+        validation.clean_title(str(record['title'])),
+        str(record.get('notes') or ''),
+    )
+    created_at = record.get('created_at')
+    created_at = validation.clean_date(created_at) if created_at else now
+    if created_at is not None:
+        partitions.check_day(day_number(created_at), archived_through)
+    return row + (Task.created_at.db_value(created_at), new_uuid(),
+                  now_micros())
+
+
+def chunked(iterable, size):
+    """Yields lists of up to 'size' items from 'iterable'."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def resolve_employees(rows, employee_ids):
+    """
+    Replaces the employee name in each row with the employee's id,
+    creating employees that don't exist yet.  'employee_ids' caches the
+    name to id mapping across calls.
+    """
+    missing = {row[0] for row in rows} - employee_ids.keys()
+    for names in chunked(missing, BATCH_SIZE):
+        (Employee.insert_many([(name,) for name in names],
+                              fields=[Employee.name])
+         .on_conflict_ignore()
+         .execute())
+        employee_ids.update(Employee.select(Employee.name, Employee.id)
+                            .where(Employee.name.in_(names))
+                            .tuples())
+    return [(employee_ids[row[0]],) + row[1:] for row in rows]
+
+
+@retry_on_busy
+def write_rows(sql, rows, employee_ids, batch_size):
+    """
+    Inserts one transaction of rows with the INSERT statement 'sql',
+    which takes the task id first, and returns the number written.  Ids
+    are left to SQLite unless the work log reserves them.  New employee
+    ids only reach the 'employee_ids' cache once the transaction commits,
+    so a retry after a rollback doesn't use ids that were never saved.
+    """
+    ids = dict(employee_ids)
+    with DATABASE.atomic(lock_type='IMMEDIATE'):
+        rows = resolve_employees(rows, ids)
+        first_id = partitions.reserve_ids(len(rows))
+        task_ids = (itertools.repeat(None) if first_id is None
+                    else itertools.count(first_id))
+        rows = [(task_id,) + row for task_id, row in zip(task_ids, rows)]
+        cursor = DATABASE.cursor()
+        for batch in chunked(rows, batch_size):
+            cursor.executemany(sql, batch)
+    employee_ids.update(ids)
+    return len(rows)
+
+
+def valid_rows(records, reject):
+    """
+    Yields the cleaned row for each valid record, calling
+    reject(line_number, error) for every invalid one.
+    """
+    now = datetime.datetime.now()
+    archived_through = partitions.archived_through()
+    for line_number, record in records:
+        try:
+            yield clean_record(record, now, archived_through)
+        except ValueError as error:
+            reject(line_number, error)
+
+
+def insert_rows(rows, batch_size=BATCH_SIZE,
+                transaction_size=TRANSACTION_SIZE):
+    """
+    Inserts an iterable of cleaned rows, as returned by clean_record(), in
+    large transactions.  Returns the number of rows inserted.
+
+    In a partitioned work log the rows are then moved into their
+    partitions.
+    """
+    # Peewee's per-value SQL generation costs more than SQLite's insert,
+    # so build the single-row INSERT from insert_many once and let the
+    # driver bind each batch with executemany.
+    sql, _ = Task.insert_many([[None] * (len(FIELDS) + 1)],
+                              fields=[Task.id] + FIELDS).sql()
+    employee_ids = {}
+    inserted = 0
+    for transaction_rows in chunked(rows, transaction_size):
+        inserted += write_rows(sql, transaction_rows, employee_ids,
+                               batch_size)
+    partitions.distribute()
+    return inserted
+
+
+def import_tasks(stream, file_format, rejects=None,
+                 batch_size=BATCH_SIZE,
+                 transaction_size=TRANSACTION_SIZE):
+    """
+    Imports tasks from an open CSV or JSONL stream.
+
+    Rejected rows are written to 'rejects' as "line N: reason" when it is
+    given.  Returns a (imported, rejected) pair of row counts.
+    """
+    rejected = 0
+
+    def reject(line_number, error):
+        nonlocal rejected
+        rejected += 1
+        if rejects is not None:
+            rejects.write("line {}: {}\n".format(line_number, error))
+
+    rows = valid_rows(READERS[file_format](stream), reject)
+    imported = insert_rows(rows, batch_size, transaction_size)
+    return imported, rejected
+
+
+def import_file(path, file_format=None, rejects=None):
+    """
+    Imports tasks from the CSV or JSONL file at 'path', or from standard
+    input when 'path' is '-'.  Files ending in '.gz' are decompressed.
+    Returns a (imported, rejected) pair.
+    """
+    if path == '-':
+        return import_tasks(sys.stdin, file_format or 'jsonl', rejects)
+    file_format = file_format or detect_format(path)
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', newline='', encoding='utf-8') as stream:
+        return import_tasks(stream, file_format, rejects)
@@ -0,0 +1,277 @@
+"""
+Query instrumentation: which statements a screen runs, and how long they
+take.
+
+While enabled, every statement DATABASE executes is timed from execute()
+until its last row has been read, and recorded with its row count and the
+menu function that ran it.  Statements can be written to a log one JSON
+object per line, statements slower than a threshold are logged with
+their EXPLAIN QUERY PLAN, and latencies are collected into a histogram
+per menu function that can be printed at exit or on demand.
+
+Instrumentation works by wrapping the database's execute_sql() on the
+instance, so while it is disabled nothing is wrapped and queries cost
+exactly what they did before.
+"""
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from task import DATABASE
+
+
+logger = logging.getLogger('work_log.queries')
+
+# Upper bounds in milliseconds of the latency histogram buckets.
+BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000,
+           2500, 5000, float('inf')]
+
+# Files whose functions are reported as the caller of a statement.
+CALLER_FILES = {'work_log_database.py', 'api.py'}
+
+# The running QueryMonitor, or None while instrumentation is off.
+MONITOR = None
+
+
+def calling_function(frame):
+    """
+    Returns the name of the innermost menu or API function on the stack
+    above 'frame', or '-' when a statement didn't come from one.
+    """
+    while frame is not None:
+        code = frame.f_code
+        if os.path.basename(code.co_filename) in CALLER_FILES:
+            return code.co_name
+        frame = frame.f_back
+    return '-'
+
+
+def explain(database, sql, params):
+    """
+    Returns the query plan of a statement on 'database' as indented
+    lines.  The plan is read past any instrumentation, so it isn't
+    itself logged.
+    """
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return "(no plan for this kind of statement)"
+    cursor = type(database).execute_sql(
+        database, 'EXPLAIN QUERY PLAN ' + sql, params)
+    parents = {}
+    lines = []
+    for node, parent, _, detail in cursor.fetchall():
+        depth = parents.get(parent, -1) + 1
+        parents[node] = depth
+        lines.append('  ' * (depth + 1) + detail)
+    return '\n'.join(lines)
+
+
+class Histogram:
+    """Counts latencies in BUCKETS and keeps their total."""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.slowest = 0.0
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def add(self, milliseconds):
+        self.counts[bisect.bisect_left(BUCKETS, milliseconds)] += 1
+        self.total += milliseconds
+        self.slowest = max(self.slowest, milliseconds)
+
+    def percentile(self, fraction):
+        """
+        An upper bound on the given percentile: the top of the bucket it
+        falls in, or the slowest time if that is lower.
+        """
+        wanted = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return min(bound, self.slowest)
+        return 0.0
+
+
+class TimedCursor:
+    """
+    Wraps a DB-API cursor to count the rows read from it and report the
+    statement once the last row is read or the cursor is closed.
+    """
+
+    def __init__(self, cursor, monitor, sql, params, caller, started,
+                 elapsed):
+        self._cursor = cursor
+        self._monitor = monitor
+        self._statement = (sql, params, caller, started)
+        self._elapsed = elapsed
+        self._rows = 0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._elapsed += time.perf_counter() - start
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(size or self._cursor.arraysize)
+        self._elapsed += time.perf_counter() - start
+        self._rows += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._elapsed += time.perf_counter() - start
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+    def __del__(self):
+        self._finish()
+
+    def _finish(self):
+        if self._statement is not None:
+            sql, params, caller, started = self._statement
+            self._statement = None
+            rows = self._rows
+            if self._cursor.description is None:
+                rows = max(self._cursor.rowcount, 0)
+            self._monitor.record(sql, params, caller, started,
+                                 self._elapsed * 1000, rows)
+
+
+class QueryMonitor:
+    """
+    Records the statements run through a database's execute_sql().
+
+    'log' is a text stream that gets every statement as a JSON line.
+    Statements taking at least 'slow_ms' milliseconds are logged to the
+    'work_log.queries' logger with their query plan.
+    """
+
+    def __init__(self, database=DATABASE, log=None, slow_ms=None):
+        self.database = database
+        self.log = log
+        self.slow_ms = slow_ms
+        self.histograms = {}
+        # Reentrant, since the on-demand report can interrupt record().
+        self.lock = threading.RLock()
+
+    def install(self):
+        execute_sql = type(self.database).execute_sql
+        database = self.database
+        monitor = self
+
+        def timed_execute_sql(sql, params=None, commit=None):
+            caller = calling_function(sys._getframe(1))
+            started = time.time()
+            start = time.perf_counter()
+            cursor = execute_sql(database, sql, params)
+            return TimedCursor(cursor, monitor, sql, params, caller, started,
+                               time.perf_counter() - start)
+
+        database.execute_sql = timed_execute_sql
+
+    def uninstall(self):
+        self.database.__dict__.pop('execute_sql', None)
+
+    def record(self, sql, params, caller, started, milliseconds, rows):
+        with self.lock:
+            for name in [caller, '(all)']:
+                self.histograms.setdefault(name, Histogram()).add(
+                    milliseconds)
+            if self.log is not None:
+                self.log.write(json.dumps({
+                    'time': round(started, 6),
+                    'caller': caller,
+                    'ms': round(milliseconds, 3),
+                    'rows': rows,
+                    'sql': sql,
+                    'params': list(params or ()),
+                }, default=str) + '\n')
+        if self.slow_ms is not None and milliseconds >= self.slow_ms:
+            logger.warning(
+                "Slow query: %.1f ms, %d rows, from %s\n%s\nparams: %r\n%s",
+                milliseconds, rows, caller, sql, params,
+                self.explain(sql, params))
+
+    def explain(self, sql, params):
+        """Returns the query plan of a statement as indented lines."""
+        return explain(self.database, sql, params)
+
+    def report(self, stream=sys.stderr):
+        """Writes the latency histogram of each caller to 'stream'."""
+        with self.lock:
+            histograms = sorted(self.histograms.items(),
+                                key=lambda item: -item[1].total)
+        stream.write("{:<24} {:>8} {:>10} {:>9} {:>9} {:>9}\n".format(
+            'caller', 'queries', 'total ms', 'p50 ms', 'p99 ms', 'max ms'))
+        for name, histogram in histograms:
+            stream.write("{:<24} {:>8} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.1f}\n"
+                         .format(name, histogram.count, histogram.total,
+                                 histogram.percentile(0.5),
+                                 histogram.percentile(0.99),
+                                 histogram.slowest))
+        for name, histogram in histograms:
+            stream.write("\n{}\n".format(name))
+            lower = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                if count:
+                    stream.write("  {:>7} - {:<7} {:>7} {}\n".format(
+                        bucket_label(lower), bucket_label(bound), count,
+                        '#' * max(1, 40 * count // histogram.count)))
+                lower = bound
+
+
+def bucket_label(milliseconds):
+    if milliseconds == float('inf'):
+        return 'inf'
+    return '{:g}'.format(milliseconds)
+
+
+def enable(database=DATABASE, log=None, slow_ms=None):
+    """Starts instrumenting 'database' and returns the monitor."""
+    global MONITOR
+    disable()
+    MONITOR = QueryMonitor(database, log, slow_ms)
+    MONITOR.install()
+    return MONITOR
+
+
+def disable():
+    """Stops instrumenting, leaving execute_sql() as it was."""
+    global MONITOR
+    if MONITOR is not None:
+        MONITOR.uninstall()
+        MONITOR = None
@@ -0,0 +1,164 @@
+"""
+Load test for the JSON API.  Reports requests per second and latency
+percentiles for adding, reading, searching and paging tasks.
+
+Without --url a server is started on a new database in a temporary
+directory and stopped afterwards:
+
+    python load_test.py --connections 16 --pipeline 4 --requests 4000
+    python load_test.py --url http://127.0.0.1:8080
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+
+WORDS = ['flux', 'capacitor', 'hoverboard', 'plutonium', 'delorean',
+         'clock', 'tower', 'lightning', 'almanac', 'skateboard']
+
+
+async def read_response(reader):
+    """Reads one response, returning its status and body."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding') == 'chunked':
+        body = []
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).strip(), 16)
+            chunk = await reader.readexactly(size + 2)
+            if not size:
+                break
+            body.append(chunk[:-2])
+        return status, b''.join(body)
+    length = int(headers.get('content-length', 0))
+    return status, await reader.readexactly(length)
+
+
+def request_bytes(method, path, body=None):
+    data = b'' if body is None else json.dumps(body).encode()
+    return ('{} {} HTTP/1.1\r\nHost: localhost\r\n'
+            'Content-Length: {}\r\n\r\n'.format(method, path, len(data))
+            .encode() + data)
+
+
+async def connection(host, port, requests, pipeline, latencies, errors):
+    """
+    Sends the requests from one connection, keeping up to 'pipeline'
+    in flight, and records the latency of each.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    sent = asyncio.Queue(pipeline)
+
+    async def send():
+        for request in requests:
+            await sent.put(time.perf_counter())
+            writer.write(request)
+            await writer.drain()
+        await sent.put(None)
+
+    sender = asyncio.ensure_future(send())
+    while True:
+        start = await sent.get()
+        if start is None:
+            break
+        status, _ = await read_response(reader)
+        latencies.append(time.perf_counter() - start)
+        if status >= 400:
+            errors.append(status)
+    await sender
+    writer.close()
+
+
+async def run_phase(host, port, requests, connections, pipeline):
+    """Spreads requests across connections and returns the results."""
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        connection(host, port, requests[number::connections], pipeline,
+                   latencies, errors)
+        for number in range(connections)])
+    return time.perf_counter() - start, sorted(latencies), errors
+
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def phases(count):
+    """Builds the requests for each phase of the test."""
+    def words():
+        return ' '.join(random.sample(WORDS, 3))
+
+    yield 'add', [request_bytes('POST', '/tasks', {
+        'employee': 'Employee {}'.format(random.randrange(100)),
+        'duration': random.randint(1, 480),
+        'title': words().capitalize(),
+        'notes': words()}) for _ in range(count)]
+    yield 'read', [request_bytes('GET', '/tasks/{}'.format(
+        random.randint(1, count))) for _ in range(count)]
+    yield 'keyword', [request_bytes('GET', '/tasks?limit=25&keyword={}'.format(
+        random.choice(WORDS))) for _ in range(count)]
+    yield 'page', [request_bytes('GET', '/tasks?limit=100&after={}'.format(
+        random.randint(1, count))) for _ in range(count)]
+
+
+def start_server(directory):
+    """Starts a server on a new database and returns (process, url)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(here, 'work_log_database.py'),
+         '--database', os.path.join(directory, 'load.db'),
+         'serve', '--port', '0'],
+        stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    return process, line.split()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the JSON API")
+    parser.add_argument('--url', help="server to test (default: start one)")
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--pipeline', type=int, default=4,
+                        help="requests in flight on each connection")
+    parser.add_argument('--requests', type=int, default=4000,
+                        help="requests in each phase")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        process = None
+        url = args.url
+        if url is None:
+            process, url = start_server(directory)
+        address = urllib.parse.urlsplit(url)
+        try:
+            print("{:<8} {:>9} {:>9} {:>9} {:>7}".format(
+                'phase', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+            for name, requests in phases(args.requests):
+                elapsed, latencies, errors = asyncio.run(run_phase(
+                    address.hostname, address.port, requests,
+                    args.connections, args.pipeline))
+                print("{:<8} {:>9.0f} {:>9.1f} {:>9.1f} {:>7}".format(
+                    name, len(requests) / elapsed,
+                    percentile(latencies, 0.5) * 1000,
+                    percentile(latencies, 0.99) * 1000, len(errors)))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,593 @@
+"""
+Versioned schema migrations for the work log database.
+
+The schema version is stored in SQLite's ``PRAGMA user_version``.  Each
+entry in MIGRATIONS upgrades the schema by one version, so an existing
+work_log.db is brought up to date in place by running every step past
+its current version.
+
+The launch reads SCHEMA_VERSION from here without loading peewee, so
+this module imports nothing at load time.
+"""
+
+
+def add_search_indexes(database):
+    """
+    Creates the original task table if this is a new database, and adds
+    the indexes used by the employee, duration and date searches.
+    """
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "task" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"employee" VARCHAR(60) NOT NULL, '
+        '"duration" INTEGER NOT NULL, '
+        '"title" VARCHAR(140) NOT NULL, '
+        '"notes" TEXT NOT NULL, '
+        '"created_at" DATETIME NOT NULL)')
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "task_employee" ON "task" ("employee")')
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "task_duration" ON "task" ("duration")')
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "task_created_at" '
+        'ON "task" ("created_at")')
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "task_employee_created_at" '
+        'ON "task" ("employee", "created_at")')
+
+
+FULL_TEXT_TRIGGERS = [
+    'CREATE TRIGGER IF NOT EXISTS "task_fts_insert" '
+    'AFTER INSERT ON "task" BEGIN '
+    'INSERT INTO "task_fts" ("rowid", "title", "notes") '
+    'VALUES (new."id", new."title", new."notes"); END',
+    'CREATE TRIGGER IF NOT EXISTS "task_fts_delete" '
+    'AFTER DELETE ON "task" BEGIN '
+    'INSERT INTO "task_fts" ("task_fts", "rowid", "title", "notes") '
+    'VALUES (\'delete\', old."id", old."title", old."notes"); END',
+    'CREATE TRIGGER IF NOT EXISTS "task_fts_update" '
+    'AFTER UPDATE OF "title", "notes" ON "task" BEGIN '
+    'INSERT INTO "task_fts" ("task_fts", "rowid", "title", "notes") '
+    'VALUES (\'delete\', old."id", old."title", old."notes"); '
+    'INSERT INTO "task_fts" ("rowid", "title", "notes") '
+    'VALUES (new."id", new."title", new."notes"); END',
+]
+
+
+def add_full_text_index(database):
+    """
+    Adds an FTS5 index over task titles and notes, the triggers that keep
+    it in sync with the task table, and backfills it from existing tasks.
+    """
+    database.execute_sql(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS "task_fts" USING fts5('
+        '"title", "notes", content="task", content_rowid="id")')
+    for statement in FULL_TEXT_TRIGGERS:
+        database.execute_sql(statement)
+    database.execute_sql(
+        'INSERT INTO "task_fts" ("task_fts") VALUES (\'rebuild\')')
+
+
+def add_task_counters(database):
+    """
+    Adds tables holding the total and per-employee task counts, the
+    triggers that keep them current, and backfills them from existing
+    tasks.
+    """
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "task_stats" ('
+        '"name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"value" INTEGER NOT NULL)')
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "employee_stats" ('
+        '"employee" VARCHAR(60) NOT NULL PRIMARY KEY, '
+        '"task_count" INTEGER NOT NULL)')
+    database.execute_sql(
+        'INSERT OR REPLACE INTO "task_stats" ("name", "value") '
+        'SELECT \'tasks\', COUNT(*) FROM "task"')
+    database.execute_sql('DELETE FROM "employee_stats"')
+    database.execute_sql(
+        'INSERT INTO "employee_stats" ("employee", "task_count") '
+        'SELECT "employee", COUNT(*) FROM "task" GROUP BY "employee"')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "task_stats_insert" '
+        'AFTER INSERT ON "task" BEGIN '
+        'UPDATE "task_stats" SET "value" = "value" + 1 '
+        'WHERE "name" = \'tasks\'; '
+        'INSERT OR IGNORE INTO "employee_stats" ("employee", "task_count") '
+        'VALUES (new."employee", 0); '
+        'UPDATE "employee_stats" SET "task_count" = "task_count" + 1 '
+        'WHERE "employee" = new."employee"; END')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "task_stats_delete" '
+        'AFTER DELETE ON "task" BEGIN '
+        'UPDATE "task_stats" SET "value" = "value" - 1 '
+        'WHERE "name" = \'tasks\'; '
+        'UPDATE "employee_stats" SET "task_count" = "task_count" - 1 '
+        'WHERE "employee" = old."employee"; '
+        'DELETE FROM "employee_stats" '
+        'WHERE "employee" = old."employee" AND "task_count" <= 0; END')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "task_stats_update" '
+        'AFTER UPDATE OF "employee" ON "task" '
+        'WHEN old."employee" != new."employee" BEGIN '
+        'UPDATE "employee_stats" SET "task_count" = "task_count" - 1 '
+        'WHERE "employee" = old."employee"; '
+        'DELETE FROM "employee_stats" '
+        'WHERE "employee" = old."employee" AND "task_count" <= 0; '
+        'INSERT OR IGNORE INTO "employee_stats" ("employee", "task_count") '
+        'VALUES (new."employee", 0); '
+        'UPDATE "employee_stats" SET "task_count" = "task_count" + 1 '
+        'WHERE "employee" = new."employee"; END')
+
+
+COUNTER_TRIGGERS = [
+    'CREATE TRIGGER "task_stats_insert" '
+    'AFTER INSERT ON "task" BEGIN '
+    'UPDATE "task_stats" SET "value" = "value" + 1 '
+    'WHERE "name" = \'tasks\'; '
+    'UPDATE "employee" SET "task_count" = "task_count" + 1 '
+    'WHERE "id" = new."employee_id"; END',
+    'CREATE TRIGGER "task_stats_delete" '
+    'AFTER DELETE ON "task" BEGIN '
+    'UPDATE "task_stats" SET "value" = "value" - 1 '
+    'WHERE "name" = \'tasks\'; '
+    'UPDATE "employee" SET "task_count" = "task_count" - 1 '
+    'WHERE "id" = old."employee_id"; END',
+    'CREATE TRIGGER "task_stats_update" '
+    'AFTER UPDATE OF "employee_id" ON "task" '
+    'WHEN old."employee_id" != new."employee_id" BEGIN '
+    'UPDATE "employee" SET "task_count" = "task_count" - 1 '
+    'WHERE "id" = old."employee_id"; '
+    'UPDATE "employee" SET "task_count" = "task_count" + 1 '
+    'WHERE "id" = new."employee_id"; END',
+]
+
+
+def normalize_employees(database):
+    """
+    Moves employee names into an employee table and replaces the task's
+    employee name with an indexed employee_id foreign key.
+
+    Each distinct name becomes one employee, whose task_count replaces
+    the employee_stats table.  SQLite can't change a column in place, so
+    the task table is rebuilt, keeping task ids, and its indexes and
+    triggers are recreated.
+    """
+    database.execute_sql(
+        'CREATE TABLE "employee" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"name" VARCHAR(60) NOT NULL, '
+        '"task_count" INTEGER NOT NULL DEFAULT 0)')
+    database.execute_sql(
+        'CREATE UNIQUE INDEX "employee_name" ON "employee" ("name")')
+    database.execute_sql(
+        'INSERT INTO "employee" ("name", "task_count") '
+        'SELECT "employee", COUNT(*) FROM "task" GROUP BY "employee"')
+    database.execute_sql(
+        'CREATE TABLE "task_new" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"employee_id" INTEGER NOT NULL '
+        'REFERENCES "employee" ("id"), '
+        '"duration" INTEGER NOT NULL, '
+        '"title" VARCHAR(140) NOT NULL, '
+        '"notes" TEXT NOT NULL, '
+        '"created_at" DATETIME NOT NULL)')
+    database.execute_sql(
+        'INSERT INTO "task_new" ("id", "employee_id", "duration", "title", '
+        '"notes", "created_at") '
+        'SELECT "task"."id", "employee"."id", "duration", "title", '
+        '"notes", "created_at" FROM "task" '
+        'JOIN "employee" ON "employee"."name" = "task"."employee"')
+    database.execute_sql('DROP TABLE "task"')
+    database.execute_sql('DROP TABLE "employee_stats"')
+    database.execute_sql('ALTER TABLE "task_new" RENAME TO "task"')
+    database.execute_sql(
+        'CREATE INDEX "task_employee_id" ON "task" ("employee_id")')
+    database.execute_sql(
+        'CREATE INDEX "task_duration" ON "task" ("duration")')
+    database.execute_sql(
+        'CREATE INDEX "task_created_at" ON "task" ("created_at")')
+    database.execute_sql(
+        'CREATE INDEX "task_employee_id_created_at" '
+        'ON "task" ("employee_id", "created_at")')
+    for statement in FULL_TEXT_TRIGGERS:
+        database.execute_sql(statement)
+    for statement in COUNTER_TRIGGERS:
+        database.execute_sql(statement)
+
+
+def add_employee_name_index(database):
+    """
+    Adds an FTS5 trigram index over employee names, a vocabulary table
+    with the number of names containing each trigram, the triggers that
+    keep the index in sync with the employee table, and backfills it.
+    """
+    database.execute_sql(
+        'CREATE VIRTUAL TABLE "employee_fts" USING fts5('
+        '"name", content="employee", content_rowid="id", '
+        'tokenize="trigram")')
+    database.execute_sql(
+        'CREATE VIRTUAL TABLE "employee_fts_vocab" USING fts5vocab('
+        '"employee_fts", "row")')
+    database.execute_sql(
+        'CREATE TRIGGER "employee_fts_insert" '
+        'AFTER INSERT ON "employee" BEGIN '
+        'INSERT INTO "employee_fts" ("rowid", "name") '
+        'VALUES (new."id", new."name"); END')
+    database.execute_sql(
+        'CREATE TRIGGER "employee_fts_delete" '
+        'AFTER DELETE ON "employee" BEGIN '
+        'INSERT INTO "employee_fts" ("employee_fts", "rowid", "name") '
+        'VALUES (\'delete\', old."id", old."name"); END')
+    database.execute_sql(
+        'CREATE TRIGGER "employee_fts_update" '
+        'AFTER UPDATE OF "name" ON "employee" BEGIN '
+        'INSERT INTO "employee_fts" ("employee_fts", "rowid", "name") '
+        'VALUES (\'delete\', old."id", old."name"); '
+        'INSERT INTO "employee_fts" ("rowid", "name") '
+        'VALUES (new."id", new."name"); END')
+    database.execute_sql(
+        'INSERT INTO "employee_fts" ("employee_fts") VALUES (\'rebuild\')')
+
+
+def store_dates_as_epoch(database):
+    """
+    Stores created_at as an integer count of microseconds since the
+    epoch, and adds a stored 'day' column, the floor of created_at in
+    days, with its own index.
+
+    Naive datetimes are converted as if they were UTC, which is also how
+    strftime('%s') reads the old text values, so times keep their wall
+    clock value whatever the local time zone.  The task table is rebuilt,
+    keeping task ids, and its indexes and triggers are recreated.
+    """
+    database.execute_sql(
+        'CREATE TABLE "task_new" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"employee_id" INTEGER NOT NULL '
+        'REFERENCES "employee" ("id"), '
+        '"duration" INTEGER NOT NULL, '
+        '"title" VARCHAR(140) NOT NULL, '
+        '"notes" TEXT NOT NULL, '
+        '"created_at" INTEGER NOT NULL, '
+        '"day" INTEGER GENERATED ALWAYS AS ('
+        '"created_at" / 86400000000 - ("created_at" % 86400000000 < 0)'
+        ') STORED)')
+    database.execute_sql(
+        'INSERT INTO "task_new" ("id", "employee_id", "duration", "title", '
+        '"notes", "created_at") '
+        'SELECT "id", "employee_id", "duration", "title", "notes", '
+        'CAST(strftime(\'%s\', "created_at") AS INTEGER) * 1000000 + '
+        'CASE WHEN length("created_at") > 19 '
+        'THEN CAST(substr("created_at" || \'000000\', 21, 6) AS INTEGER) '
+        'ELSE 0 END '
+        'FROM "task"')
+    database.execute_sql('DROP TABLE "task"')
+    database.execute_sql('ALTER TABLE "task_new" RENAME TO "task"')
+    database.execute_sql(
+        'CREATE INDEX "task_employee_id" ON "task" ("employee_id")')
+    database.execute_sql(
+        'CREATE INDEX "task_duration" ON "task" ("duration")')
+    database.execute_sql(
+        'CREATE INDEX "task_created_at" ON "task" ("created_at")')
+    database.execute_sql('CREATE INDEX "task_day" ON "task" ("day")')
+    database.execute_sql(
+        'CREATE INDEX "task_employee_id_created_at" '
+        'ON "task" ("employee_id", "created_at")')
+    for statement in FULL_TEXT_TRIGGERS + COUNTER_TRIGGERS:
+        database.execute_sql(statement)
+
+
+# Period start days for a task's day, as SQL expressions over 'row'.
+# Weeks start on Monday; day 0, 1970-01-01, was a Thursday.
+ROLLUP_PERIODS = [
+    ('day', '{row}."day"'),
+    ('week', '{row}."day" - (({row}."day" + 3) % 7 + 7) % 7'),
+    ('month', 'CAST(julianday({row}."day" * 86400, \'unixepoch\', '
+              '\'start of month\') - 2440587.5 AS INTEGER)'),
+]
+
+
+def rollup_upsert(row, sign):
+    """
+    Returns SQL adding ('+') or removing ('-') the task 'row' (new or
+    old) from every duration rollup period.
+    """
+    values = ', '.join(
+        '(\'{}\', {row}."employee_id", {}, {sign}{row}."duration", {sign}1)'
+        .format(period, start.format(row=row), row=row, sign=sign)
+        for period, start in ROLLUP_PERIODS)
+    return (
+        'INSERT INTO "duration_rollup" ("period", "employee_id", '
+        '"start_day", "minutes", "tasks") VALUES {} '
+        'ON CONFLICT ("employee_id", "period", "start_day") DO UPDATE SET '
+        '"minutes" = "minutes" + excluded."minutes", '
+        '"tasks" = "tasks" + excluded."tasks"; '.format(values))
+
+
+ROLLUP_CLEANUP = (
+    'DELETE FROM "duration_rollup" WHERE "tasks" <= 0 AND ({}); '.format(
+        ' OR '.join(
+            '("employee_id" = old."employee_id" AND "period" = \'{}\' '
+            'AND "start_day" = {})'.format(period, start.format(row='old'))
+            for period, start in ROLLUP_PERIODS)))
+
+
+def add_duration_rollups(database):
+    """
+    Adds the duration_rollup table of total minutes and tasks per
+    employee per day, week and month, the triggers that keep it current
+    as tasks are added, edited and deleted, and backfills it.
+    """
+    database.execute_sql(
+        'CREATE TABLE "duration_rollup" ('
+        '"period" VARCHAR(5) NOT NULL, '
+        '"employee_id" INTEGER NOT NULL REFERENCES "employee" ("id"), '
+        '"start_day" INTEGER NOT NULL, '
+        '"minutes" INTEGER NOT NULL, '
+        '"tasks" INTEGER NOT NULL, '
+        'PRIMARY KEY ("employee_id", "period", "start_day"))')
+    database.execute_sql(
+        'CREATE INDEX "durationrollup_period_start_day" '
+        'ON "duration_rollup" ("period", "start_day")')
+    for period, start in ROLLUP_PERIODS:
+        database.execute_sql(
+            'INSERT INTO "duration_rollup" ("period", "employee_id", '
+            '"start_day", "minutes", "tasks") '
+            'SELECT \'{period}\', "employee_id", {start}, '
+            'SUM("duration"), COUNT(*) FROM "task" '
+            'GROUP BY "employee_id", {start}'
+            .format(period=period, start=start.format(row='"task"')))
+    database.execute_sql(
+        'CREATE TRIGGER "duration_rollup_insert" '
+        'AFTER INSERT ON "task" BEGIN {} END'
+        .format(rollup_upsert('new', '')))
+    database.execute_sql(
+        'CREATE TRIGGER "duration_rollup_delete" '
+        'AFTER DELETE ON "task" BEGIN {}{} END'
+        .format(rollup_upsert('old', '-'), ROLLUP_CLEANUP))
+    database.execute_sql(
+        'CREATE TRIGGER "duration_rollup_update" '
+        'AFTER UPDATE OF "employee_id", "duration", "created_at" ON "task" '
+        'BEGIN {}{}{} END'
+        .format(rollup_upsert('old', '-'), ROLLUP_CLEANUP,
+                rollup_upsert('new', '')))
+
+
+def add_partition_catalog(database):
+    """
+    Adds the setting table, which records whether the work log is
+    partitioned and by what period, and the partition table listing the
+    partition files and the days each holds.
+    """
+    database.execute_sql(
+        'CREATE TABLE "setting" ('
+        '"name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"value" TEXT NOT NULL)')
+    database.execute_sql(
+        'CREATE TABLE "partition" ('
+        '"name" VARCHAR(7) NOT NULL PRIMARY KEY, '
+        '"first_day" INTEGER NOT NULL, '
+        '"last_day" INTEGER NOT NULL)')
+
+
+CHANGE_TRIGGERS = [
+    'CREATE TRIGGER "task_change_insert" '
+    'AFTER INSERT ON "task" BEGIN '
+    'INSERT INTO "task_change" ("task_id", "op") '
+    'VALUES (new."id", \'insert\'); END',
+    'CREATE TRIGGER "task_change_update" '
+    'AFTER UPDATE ON "task" BEGIN '
+    'INSERT INTO "task_change" ("task_id", "op") '
+    'VALUES (new."id", \'update\'); END',
+    'CREATE TRIGGER "task_change_delete" '
+    'AFTER DELETE ON "task" BEGIN '
+    'INSERT INTO "task_change" ("task_id", "op") '
+    'VALUES (old."id", \'delete\'); END',
+]
+
+
+def add_change_log(database):
+    """
+    Adds the task_change table, which records the id of every task added,
+    edited or deleted in the order it happened, and the triggers that
+    fill it.  AUTOINCREMENT keeps sequence numbers from ever being reused,
+    so a reader can ask for the changes after the last one it saw.
+    """
+    database.execute_sql(
+        'CREATE TABLE "task_change" ('
+        '"seq" INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, '
+        '"task_id" INTEGER NOT NULL, '
+        '"op" VARCHAR(6) NOT NULL)')
+    for statement in CHANGE_TRIGGERS:
+        database.execute_sql(statement)
+
+
+# Task fields recorded in the change log, as (name, column, new value).
+# The employee is recorded by name, since ids differ between files.
+CHANGED_FIELDS = [
+    ('employee', 'employee_id',
+     '(SELECT "name" FROM "employee" WHERE "id" = new."employee_id")'),
+    ('duration', 'duration', 'new."duration"'),
+    ('title', 'title', 'new."title"'),
+    ('notes', 'notes', 'new."notes"'),
+    ('created_at', 'created_at', 'new."created_at"'),
+]
+
+CHANGED = 'new."{0}" IS NOT old."{0}"'
+
+# Whether an update changed any of CHANGED_FIELDS.
+ANY_CHANGED = ' OR '.join(CHANGED.format(column)
+                          for _, column, _ in CHANGED_FIELDS)
+
+# A JSON object of every field of a new task.
+INSERTED_FIELDS = 'json_object({})'.format(
+    ', '.join("'{}', {}".format(name, value)
+              for name, _, value in CHANGED_FIELDS))
+
+# A JSON object of the fields an update changed, selected FROM this.
+UPDATED_FIELDS = ' UNION ALL '.join(
+    'SELECT \'{}\' AS "name", {} AS "value" WHERE {}'.format(
+        name, value, CHANGED.format(column))
+    for name, column, value in CHANGED_FIELDS)
+
+FIELD_CHANGE_TRIGGERS = [
+    'CREATE TRIGGER "task_change_insert" '
+    'AFTER INSERT ON "task" BEGIN '
+    'INSERT INTO "task_change" ("task_id", "op", "fields") '
+    'VALUES (new."id", \'insert\', {}); END'.format(INSERTED_FIELDS),
+    'CREATE TRIGGER "task_change_update" '
+    'AFTER UPDATE ON "task" WHEN {} BEGIN '
+    'INSERT INTO "task_change" ("task_id", "op", "fields") '
+    'SELECT new."id", \'update\', json_group_object("name", "value") '
+    'FROM ({}); END'.format(ANY_CHANGED, UPDATED_FIELDS),
+    'CREATE TRIGGER "task_change_delete" '
+    'AFTER DELETE ON "task" BEGIN '
+    'INSERT INTO "task_change" ("task_id", "op") '
+    'VALUES (old."id", \'delete\'); END',
+]
+
+
+def record_changed_fields(database):
+    """
+    Adds the fields column to the change log, and replaces its triggers
+    with ones filling it: a JSON object of every field of an added task,
+    and of the fields an edit changed.  Edits changing nothing are no
+    longer logged.  Changes logged before this step have no fields.
+    """
+    database.execute_sql('ALTER TABLE "task_change" ADD COLUMN "fields" TEXT')
+    for op in ['insert', 'update', 'delete']:
+        database.execute_sql('DROP TRIGGER "task_change_{}"'.format(op))
+    for statement in FIELD_CHANGE_TRIGGERS:
+        database.execute_sql(statement)
+
+
+# The current time in microseconds since the epoch, UTC.
+NOW = 'CAST((julianday(\'now\') - 2440587.5) * 86400000000 AS INTEGER)'
+
+NEW_UUID = 'lower(hex(randomblob(16)))'
+
+# Namespace of the uuids given to tasks added before syncing.
+BACKFILL_NAMESPACE = '7d1c4a52-3f0e-4b8e-9a61-2c5d8e0f4b17'
+
+
+def backfilled_uuid(task_id, created_at):
+    """
+    Returns the uuid of a task added before the work log had uuids.  It
+    is made from the task's id and creation time, so copies of one file
+    upgraded apart still agree on it, even if a task's other fields were
+    edited in one of them first.
+    """
+    import uuid
+    return uuid.uuid5(uuid.UUID(BACKFILL_NAMESPACE),
+                      '{}:{}'.format(task_id, created_at)).hex
+
+
+SYNC_TRIGGERS = [
+    # Inserts normally give both, but tasks added by other programs
+    # still need them.
+    'CREATE TRIGGER "task_sync_insert" '
+    'AFTER INSERT ON "task" '
+    'WHEN new."uuid" IS NULL OR new."updated_at" IS NULL BEGIN '
+    'UPDATE "task" SET "uuid" = ifnull("uuid", {}), '
+    '"updated_at" = ifnull("updated_at", {}) '
+    'WHERE "id" = new."id"; END'.format(NEW_UUID, NOW),
+    # Edits that set updated_at themselves, as syncing does, keep it.
+    'CREATE TRIGGER "task_sync_update" '
+    'AFTER UPDATE OF {} ON "task" '
+    'WHEN new."updated_at" IS old."updated_at" AND ({}) BEGIN '
+    'UPDATE "task" SET "updated_at" = {} WHERE "id" = new."id"; END'.format(
+        ', '.join('"{}"'.format(column) for _, column, _ in CHANGED_FIELDS),
+        ANY_CHANGED, NOW),
+]
+
+SYNC_CHANGE_TRIGGERS = [
+    'CREATE TRIGGER "task_change_insert" '
+    'AFTER INSERT ON "task" BEGIN '
+    'INSERT INTO "task_change" ("task_id", "op", "fields", "uuid", "at") '
+    'VALUES (new."id", \'insert\', {}, new."uuid", {}); END'.format(
+        INSERTED_FIELDS, NOW),
+    'CREATE TRIGGER "task_change_update" '
+    'AFTER UPDATE ON "task" WHEN {} BEGIN '
+    'INSERT INTO "task_change" ("task_id", "op", "fields", "uuid", "at") '
+    'SELECT new."id", \'update\', json_group_object("name", "value"), '
+    'new."uuid", {} FROM ({}); END'.format(ANY_CHANGED, NOW, UPDATED_FIELDS),
+    'CREATE TRIGGER "task_change_delete" '
+    'AFTER DELETE ON "task" BEGIN '
+    'INSERT INTO "task_change" ("task_id", "op", "uuid", "at") '
+    'VALUES (old."id", \'delete\', old."uuid", {}); END'.format(NOW),
+]
+
+
+def add_sync_columns(database):
+    """
+    Gives every task a uuid identifying it in every work log it is synced
+    to, and an updated_at time in microseconds since the epoch, UTC, kept
+    current by triggers.  The change log records each change's task uuid
+    and time, and the sync_peer table the last change of each other work
+    log synced with.  The work log gets a replica_id of its own.  Tasks
+    already added get the uuid backfilled_uuid() makes and an updated_at
+    of 0, so any edit made since wins over them.  Their created_at is
+    local time stored as UTC, so it can't be compared with edit times.
+    """
+    database.execute_sql('ALTER TABLE "task" ADD COLUMN "uuid" TEXT')
+    database.execute_sql(
+        'ALTER TABLE "task" ADD COLUMN "updated_at" INTEGER')
+    database.connection().create_function(
+        'backfilled_uuid', 2, backfilled_uuid, deterministic=True)
+    database.execute_sql(
+        'UPDATE "task" SET "uuid" = backfilled_uuid("id", "created_at"), '
+        '"updated_at" = 0')
+    database.execute_sql(
+        'CREATE UNIQUE INDEX "task_uuid" ON "task" ("uuid")')
+    database.execute_sql('ALTER TABLE "task_change" ADD COLUMN "uuid" TEXT')
+    database.execute_sql('ALTER TABLE "task_change" ADD COLUMN "at" INTEGER')
+    for op in ['insert', 'update', 'delete']:
+        database.execute_sql('DROP TRIGGER "task_change_{}"'.format(op))
+    for statement in SYNC_CHANGE_TRIGGERS + SYNC_TRIGGERS:
+        database.execute_sql(statement)
+    database.execute_sql(
+        'CREATE TABLE "sync_peer" ('
+        '"replica_id" TEXT NOT NULL PRIMARY KEY, '
+        '"seen" INTEGER NOT NULL)')
+    database.execute_sql(
+        'INSERT INTO "setting" ("name", "value") '
+        'VALUES (\'replica_id\', {})'.format(NEW_UUID))
+
+
+MIGRATIONS = [
+    add_search_indexes,
+    add_full_text_index,
+    add_task_counters,
+    normalize_employees,
+    add_employee_name_index,
+    store_dates_as_epoch,
+    add_duration_rollups,
+    add_partition_catalog,
+    add_change_log,
+    record_changed_fields,
+    add_sync_columns,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(database):
+    """Returns the schema version recorded in the database file."""
+    return database.execute_sql('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(database):
+    """
+    Runs every migration newer than the database's schema version.
+
+    Each step runs in its own transaction together with the version bump,
+    so an interrupted upgrade resumes from the last completed step.
+    """
+    version = schema_version(database)
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        with database.atomic():
+            step(database)
+            database.execute_sql('PRAGMA user_version = {}'.format(number))
+    return schema_version(database)
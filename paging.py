@@ -0,0 +1,169 @@
+"""
+Keyset pagination over task queries, shared by the menus and the API.
+
+Each page seeks past the sort keys of the last task shown, so a page
+costs the same however far into the results it is.  Searches are paged
+by date, newest first, since the latest tasks are the ones most looked
+for, and in a partitioned or archived work log the first page then
+comes from the newest file alone.  Keyword searches are paged best
+match first instead.
+"""
+from federation import FederatedSearch
+from partitions import PartitionedQuery
+from task import Task
+import search
+import search_cache
+
+
+# Sort keys used to page through search results, as (attribute, expression)
+# pairs.  The last key must be unique so every task has a distinct position.
+DATE_ORDER = (('created_at', Task.created_at), ('id', Task.id))
+RANKED_ORDER = (('rank', search.TASK_RANK), ('id', Task.id))
+
+PAGE_SIZE = 25
+
+
+def order_for(tasks):
+    """
+    Returns the sort keys for a search: best match first when the query
+    selects a keyword 'rank', otherwise by date, newest first.  A blank
+    keyword search has no rank to sort by, and ranks from different
+    partitions can't be compared.  Federated searches are always merged
+    by date.
+    """
+    if isinstance(tasks, (PartitionedQuery, FederatedSearch)):
+        return DATE_ORDER
+    aliases = [getattr(column, '_alias', None) for column in tasks._returning]
+    return RANKED_ORDER if 'rank' in aliases else DATE_ORDER
+
+
+def newest_first(keys):
+    """Tells whether 'keys' sort by date, which is shown newest first."""
+    return keys[0][0] == 'created_at'
+
+
+def seek(keys, task, forward):
+    """
+    Builds the condition selecting tasks that sort after (or before) the
+    given task by 'keys'.
+    """
+    condition = None
+    for name, expression in reversed(keys):
+        value = getattr(task, name)
+        if forward:
+            step = expression > value
+        else:
+            step = expression < value
+        if condition is not None:
+            step = step | ((expression == value) & condition)
+        condition = step
+    return condition
+
+
+def page_query(tasks, keys, after=None, forward=True, limit=None):
+    """
+    Orders a task query by 'keys', newest first for dates, or the reverse
+    when 'forward' is False, starting just past the task 'after' if one
+    is given.
+    """
+    if newest_first(keys):
+        forward = not forward
+    if isinstance(tasks, PartitionedQuery):
+        # Partitions hold disjoint date ranges, oldest first, so tasks in
+        # date order are read by taking the partitions in turn.  Newest
+        # first, the first page comes from the newest, and the archive is
+        # only read once the pages reach it.
+        tasks = tasks.reverse(not forward)
+    if after is not None:
+        tasks = tasks.where(seek(keys, after, forward))
+    expressions = [expression for _, expression in keys]
+    if not forward:
+        expressions = [expression.desc() for expression in expressions]
+    return tasks.order_by(*expressions).limit(limit)
+
+
+class TaskPager:
+    """
+    Keyset pagination over a query of tasks.
+
+    Tasks are fetched one window of 'page_size' rows at a time by seeking
+    past the sort keys of the first or last task in the current window,
+    so memory use doesn't depend on how many tasks the query matches.
+    Windows come from the search cache when it holds them.
+    """
+
+    def __init__(self, tasks, keys=DATE_ORDER, page_size=PAGE_SIZE):
+        self.tasks = tasks
+        self.keys = keys
+        self.page_size = page_size
+        self.window = []
+        self.position = 0
+        self.more_before = False
+        self.more_after = False
+        self.first()
+
+    @property
+    def current(self):
+        """The task at the current position, or None if there are none."""
+        if not self.window:
+            return None
+        return self.window[self.position]
+
+    @property
+    def has_next(self):
+        return self.position < len(self.window) - 1 or self.more_after
+
+    @property
+    def has_previous(self):
+        return self.position > 0 or self.more_before
+
+    def first(self):
+        """Moves to the first task."""
+        self.window, self.more_after = self.fetch(None, forward=True)
+        self.position = 0
+        self.more_before = False
+
+    def next(self):
+        """Moves to the next task, fetching the next window if needed."""
+        if self.position < len(self.window) - 1:
+            self.position += 1
+        elif self.more_after:
+            self.window, self.more_after = self.fetch(self.window[-1],
+                                                      forward=True)
+            self.position = 0
+            self.more_before = True
+
+    def previous(self):
+        """Moves to the previous task, fetching the previous window if
+        needed."""
+        if self.position > 0:
+            self.position -= 1
+        elif self.more_before:
+            self.window, self.more_before = self.fetch(self.window[0],
+                                                       forward=False)
+            self.position = len(self.window) - 1
+            self.more_after = True
+
+    def fetch(self, after, forward):
+        """
+        Fetches the window of tasks after (or before, when 'forward' is
+        False) the task 'after', or from the start of the results when
+        'after' is None.
+
+        Returns the window in display order and whether more tasks exist
+        beyond it.
+        """
+        if isinstance(self.tasks, FederatedSearch):
+            # Other work logs change without this process seeing it, so
+            # their pages aren't cached.
+            window = self.tasks.page(
+                after, forward != newest_first(self.keys),
+                self.page_size + 1)
+        else:
+            window = search_cache.rows(page_query(
+                self.tasks, self.keys, after, forward, self.page_size + 1))
+        more = len(window) > self.page_size
+        window = window[:self.page_size]
+        if not forward:
+            window.reverse()
+        return window, more
@@ -0,0 +1,728 @@
+"""
+Time partitioned storage: a work log split into one database file per
+year or month.
+
+Partitioning is optional.  Once a work log is partitioned, every task is
+stored in the file for the period it was created in, next to the main
+database file: work_log.2024.db holds the tasks of 2024.  Each partition
+file has the complete work log schema, with its own employees, full-text
+index, counters and rollups, so any task query runs against a partition
+unchanged.  The main file keeps the list of partitions and hands out
+task ids, so ids stay unique across partitions.
+
+Task queries are routed to the partitions that can hold their results,
+skipping those outside a date range when the query has one.  Pages of
+results are read from the partitions in parallel on a thread pool, and
+since partitions hold disjoint date ranges, results merge by date by
+taking the partitions in date order.
+
+An archived work log is handled the same way, whether it is partitioned
+or not: the archive file holds every task created up to a cutoff day and
+is listed among the partitions, so searches only open it when they reach
+back past the cutoff.  See archive.py.
+"""
+import concurrent.futures
+import datetime
+import itertools
+import os
+import threading
+import urllib.parse
+
+from peewee import SqliteDatabase
+
+from startup import on_teardown, partition_path
+from task import (DATABASE, EPOCH, PROFILES, Employee, Partition, Setting,
+                  Task, TaskStats, day_number, new_uuid, now_micros,
+                  retry_on_busy)
+import task
+import migrations
+
+
+# Partition periods, with the strftime format of their partition names.
+PERIODS = {
+    'year': '%Y',
+    'month': '%Y-%m',
+}
+
+# Name of the partition file holding archived tasks.
+ARCHIVE = 'archive'
+
+ARCHIVED_TASK = "Task {} is archived and can't be changed."
+
+# The archive is read only.  It is written to by attaching it to another
+# connection, which doesn't apply these settings.
+ARCHIVE_PRAGMAS = [
+    ('query_only', 1),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('busy_timeout', 5000),
+]
+
+# Threads reading partitions at once.
+WORKERS = 4
+
+# Open partition databases by path, and the thread pool reading them.
+DATABASES = {}
+POOL = None
+LOCK = threading.Lock()
+
+# Connection settings for opening partition files read only, or None to
+# open them for writing.  See open_read_only().
+READ_ONLY = None
+
+# The catalog as each thread last read it, and the state of the thread's
+# connection to the main database when it did.
+CATALOG = threading.local()
+
+
+def catalog():
+    """
+    Returns the partition period, or None, a (name, first day, last day)
+    row for each partition, ordered by last day, and whether archiving
+    was left unfinished.
+
+    Every search is routed by the catalog, so each thread keeps the copy
+    it last read until its connection has changed rows or SQLite's
+    data_version shows another connection has committed.
+    """
+    connection = DATABASE.connection()
+    state = (connection, connection.total_changes,
+             connection.execute('PRAGMA data_version').fetchone()[0])
+    if getattr(CATALOG, 'state', None) != state:
+        CATALOG.value = (
+            Setting.value_of('partition_period'),
+            list(Partition.select(Partition.name, Partition.first_day,
+                                  Partition.last_day)
+                 .order_by(Partition.last_day).tuples()),
+            Setting.value_of('archiving') is not None)
+        CATALOG.state = state
+    return CATALOG.value
+
+
+def period():
+    """Returns 'year' or 'month' if the work log is partitioned, or None."""
+    return catalog()[0]
+
+
+def partition_name(date, by):
+    """
+    Returns the name of the partition holding tasks created on 'date' in a
+    work log partitioned by 'by'.
+    """
+    return date.strftime(PERIODS[by])
+
+
+def partition_days(name):
+    """Returns the first and last day, since the epoch, of a partition."""
+    year, _, month = name.partition('-')
+    if month:
+        first = datetime.date(int(year), int(month), 1)
+        following = (first + datetime.timedelta(days=31)).replace(day=1)
+    else:
+        first = datetime.date(int(year), 1, 1)
+        following = first.replace(year=first.year + 1)
+    return day_number(first), day_number(following) - 1
+
+
+def database(name):
+    """
+    Returns the database of the partition called 'name', creating and
+    migrating its file the first time it is opened.
+    """
+    path = partition_path(DATABASE.database, name)
+    with LOCK:
+        if path not in DATABASES:
+            if READ_ONLY is not None:
+                partition = SqliteDatabase(
+                    'file:{}?mode=ro'.format(
+                        urllib.parse.quote(path.replace(os.sep, '/'))),
+                    uri=True, pragmas=READ_ONLY)
+            elif name == ARCHIVE:
+                writable_archive().close()
+                partition = SqliteDatabase(path, pragmas=ARCHIVE_PRAGMAS)
+            else:
+                partition = SqliteDatabase(path,
+                                           pragmas=PROFILES[task.PROFILE])
+                migrations.migrate(partition)
+            DATABASES[path] = partition
+        return DATABASES[path]
+
+
+def open_read_only(pragmas):
+    """
+    Has partition and archive files opened read only with 'pragmas' until
+    close(), so they are never created, migrated or written to.
+    """
+    global READ_ONLY
+    with LOCK:
+        READ_ONLY = pragmas
+
+
+def archive_path():
+    """Returns the path of the archive file."""
+    return partition_path(DATABASE.database, ARCHIVE)
+
+
+def writable_archive():
+    """
+    Returns a connection that can write to the archive file, creating and
+    migrating the file if needed.  The archive uses a rollback journal,
+    so reading it never needs to write a WAL index.
+    """
+    archive = SqliteDatabase(archive_path(), pragmas=[
+        ('journal_mode', 'delete'),
+        ('busy_timeout', 5000),
+    ])
+    migrations.migrate(archive)
+    return archive
+
+
+def partitions(first_day=None, last_day=None):
+    """
+    Returns the names of the partitions overlapping the days from
+    'first_day' through 'last_day', oldest first.  The archive counts as
+    a partition ending on its cutoff day.
+    """
+    return [name for name, first, last in catalog()[1]
+            if (first_day is None or last >= first_day) and
+            (last_day is None or first <= last_day)]
+
+
+def archived_through():
+    """Returns the last archived day, or None if nothing is archived."""
+    for name, _, last in catalog()[1]:
+        if name == ARCHIVE:
+            return last
+    return None
+
+
+def archiving():
+    """
+    Tells whether archiving was left unfinished, so tasks before the
+    cutoff may still be in the files they were moving out of.
+    """
+    return catalog()[2]
+
+
+def databases(first_day=None, last_day=None):
+    """
+    Returns the databases that can hold tasks created from 'first_day'
+    through 'last_day', oldest first: the partitions overlapping those
+    days, and the main database unless the work log is partitioned or
+    the days are all archived.
+    """
+    found = [database(name) for name in partitions(first_day, last_day)]
+    if period() is None and (not found or last_day is None or
+                             last_day > archived_through() or archiving()):
+        found.append(DATABASE)
+    return found
+
+
+def each(func, first_day=None, last_day=None):
+    """
+    Calls func(database) for each database holding tasks from the days
+    given, in parallel.  Returns the results in date order.
+    """
+    return run_parallel(func, databases(first_day, last_day))
+
+
+def run_parallel(func, items):
+    """Calls func(item) for each item on the thread pool, in order."""
+    global POOL
+    if len(items) < 2:
+        return [func(item) for item in items]
+    with LOCK:
+        if POOL is None:
+            POOL = concurrent.futures.ThreadPoolExecutor(
+                WORKERS, thread_name_prefix='partition')
+    return list(POOL.map(func, items))
+
+
+@on_teardown
+def close():
+    """
+    Closes the partition databases and stops the thread pool.  Partition
+    files are opened for writing again from then on.
+    """
+    global POOL, READ_ONLY
+    with LOCK:
+        READ_ONLY = None
+        if POOL is not None:
+            POOL.shutdown()
+            POOL = None
+        for partition in DATABASES.values():
+            partition.close()
+        DATABASES.clear()
+
+
+def drop(name):
+    """Forgets the empty partition called 'name' and deletes its file."""
+    path = partition_path(DATABASE.database, name)
+    with LOCK:
+        partition = DATABASES.pop(path, None)
+        if partition is not None:
+            partition.close()
+    Partition.delete().where(Partition.name == name).execute()
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def route(tasks, first_day=None, last_day=None):
+    """
+    Returns a task query unchanged if only the main database can hold
+    its results, or else a PartitionedQuery running it on each database
+    holding tasks from 'first_day' through 'last_day'.
+    """
+    found = databases(first_day, last_day)
+    if found == [DATABASE]:
+        return tasks
+    return PartitionedQuery([(partition, tasks) for partition in found])
+
+
+def with_employees(partition, rows):
+    """
+    Sets the employee of each task in 'rows' read from a partition, since
+    loading it on first use would read the main database instead.  Rows
+    that aren't tasks are returned as they are.
+    """
+    tasks = [row for row in rows
+             if isinstance(row, Task) and row.employee_id is not None]
+    if tasks:
+        ids = list({row.employee_id for row in tasks})
+        employees = {employee.id: employee for employee in
+                     Employee.select().where(Employee.id.in_(ids))
+                     .bind(partition)}
+        for row in tasks:
+            row.employee = employees[row.employee_id]
+    return rows
+
+
+def read(part):
+    """Reads the rows of a (partition, query) pair."""
+    partition, query = part
+    return with_employees(partition, list(query.clone().bind(partition)))
+
+
+class PartitionedQuery:
+    """
+    A task query run on each of several partitions, oldest partition
+    first.
+
+    Query building methods, such as where(), join() and order_by(), apply
+    to the query for every partition and return a new PartitionedQuery.
+    Iterating streams the partitions one at a time in date order, or in
+    reverse date order after reverse().  A query with a limit reads the
+    first partition, and the others in parallel only when it has fewer
+    than 'limit' rows.
+    """
+
+    # Tasks read from a partition at a time while streaming.
+    CHUNK_SIZE = 500
+
+    def __init__(self, parts, reversed_order=False, limit=None):
+        self.parts = parts
+        self.reversed_order = reversed_order
+        self._limit = limit
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def build(*args, **kwargs):
+            return self.map(
+                lambda query: getattr(query, name)(*args, **kwargs))
+        return build
+
+    def map(self, func):
+        """Returns a copy with func applied to the query of every part."""
+        return PartitionedQuery(
+            [(partition, func(query)) for partition, query in self.parts],
+            self.reversed_order, self._limit)
+
+    def limit(self, limit=None):
+        query = self.map(lambda query: query.limit(limit))
+        query._limit = limit
+        return query
+
+    def reverse(self, reversed_order=True):
+        """Returns a copy reading the newest partition first."""
+        return PartitionedQuery(self.parts, reversed_order, self._limit)
+
+    def ordered_parts(self):
+        return self.parts[::-1] if self.reversed_order else self.parts
+
+    def __iter__(self):
+        if self._limit is not None:
+            return iter(self.execute())
+        return self.iterator()
+
+    def execute(self):
+        """
+        Returns the first rows.  The first part is read on its own, since
+        it usually fills a page, and the rest in parallel only if not.
+        """
+        parts = self.ordered_parts()
+        if not parts:
+            return []
+        rows = read(parts[0])
+        if len(rows) < self._limit:
+            rows = itertools.chain(rows, *run_parallel(read, parts[1:]))
+        return list(itertools.islice(rows, self._limit))
+
+    def iterator(self):
+        """Streams the rows of each part in turn."""
+        if self._limit is not None:
+            yield from self.execute()
+            return
+        for partition, query in self.ordered_parts():
+            rows = query.clone().bind(partition).iterator()
+            while True:
+                chunk = list(itertools.islice(rows, self.CHUNK_SIZE))
+                if not chunk:
+                    break
+                yield from with_employees(partition, chunk)
+
+    def exists(self):
+        return any(run_parallel(
+            lambda part: part[1].clone().bind(part[0]).exists(),
+            self.parts))
+
+    def count(self):
+        return sum(run_parallel(
+            lambda part: part[1].clone().bind(part[0]).count(),
+            self.parts))
+
+    def get(self):
+        """Returns the first row in reading order, like Select.get()."""
+        for rows in run_parallel(read, [(partition, query.limit(1))
+                                        for partition, query
+                                        in self.ordered_parts()]):
+            if rows:
+                return rows[0]
+        raise Task.DoesNotExist
+
+
+def task_count():
+    """Returns the number of tasks in the work log, across partitions."""
+    return sum(each(lambda database: (
+        TaskStats.select(TaskStats.value).where(TaskStats.name == 'tasks')
+        .bind(database).scalar() or 0)))
+
+
+def open_partition(name):
+    """
+    Returns the database of the partition called 'name', adding it to
+    the list of partitions if it is new.
+    """
+    partition = database(name)
+    first_day, last_day = partition_days(name)
+    (Partition.insert(name=name, first_day=first_day, last_day=last_day)
+     .on_conflict_ignore().execute())
+    return partition
+
+
+def reserve_ids(count):
+    """
+    Reserves 'count' consecutive task ids in the main database and
+    returns the first, or returns None if SQLite can number new tasks
+    itself.  Call it in the transaction inserting the tasks.
+
+    SQLite numbers a task one past the highest id in its table, so once
+    tasks have moved out to other files their ids could be handed out
+    again.  Partitioned and archived work logs number tasks from the
+    last_task_id counter instead.
+    """
+    rows = DATABASE.execute_sql(
+        'UPDATE "task_stats" SET "value" = max("value", '
+        '(SELECT ifnull(max("id"), 0) FROM "task")) + ? '
+        'WHERE "name" = \'last_task_id\' RETURNING "value"',
+        (count,)).fetchall()
+    return rows[0][0] - count + 1 if rows else None
+
+
+@retry_on_busy
+def next_task_id():
+    """Hands out the next unused task id from the main database."""
+    with DATABASE.atomic(lock_type='IMMEDIATE'):
+        return reserve_ids(1)
+
+
+def check_day(day, through):
+    """
+    Raises ValueError if 'day' is archived, given the last archived day
+    'through', which is None when nothing is archived.
+    """
+    if through is not None and day <= through:
+        raise ValueError(
+            "Tasks before {} are archived, so none can be dated before it."
+            .format(EPOCH + datetime.timedelta(days=through + 1)))
+
+
+def check_date(created_at):
+    """Raises ValueError if tasks created at 'created_at' are archived."""
+    check_day(day_number(created_at), archived_through())
+
+
+def check_not_archived(task_id):
+    """Raises ValueError if the task with 'task_id' is archived."""
+    if (archived_through() is not None and
+            Task.select().where(Task.id == task_id)
+            .bind(database(ARCHIVE)).exists()):
+        raise ValueError(ARCHIVED_TASK.format(task_id))
+
+
+def employee_id(partition, name):
+    """Returns the id of the named employee in a partition, adding them."""
+    (Employee.insert(name=name).on_conflict_ignore()
+     .bind(partition).execute())
+    return (Employee.select(Employee.id).where(Employee.name == name)
+            .bind(partition).scalar())
+
+
+@retry_on_busy
+def insert_task(partition, task_id, employee, fields):
+    with partition.atomic(lock_type='IMMEDIATE'):
+        (Task.insert(id=task_id, employee=employee_id(partition, employee),
+                     **fields)
+         .bind(partition).execute())
+
+
+@retry_on_busy
+def update_in_place(partition, task_id, update):
+    with partition.atomic(lock_type='IMMEDIATE'):
+        update = dict(update)
+        if 'employee' in update:
+            update['employee'] = employee_id(partition, update['employee'])
+        return (Task.update(**update).where(Task.id == task_id)
+                .bind(partition).execute())
+
+
+@retry_on_busy
+def delete_from(partition, task_id):
+    with partition.atomic(lock_type='IMMEDIATE'):
+        return (Task.delete().where(Task.id == task_id)
+                .bind(partition).execute())
+
+
+@retry_on_busy
+def move_task(source, target, task_id, employee, fields):
+    """
+    Moves the task with 'task_id' from the partition 'source' into the
+    partition 'target', for the named employee and with new 'fields'.
+    The target file is attached so the delete and the insert commit
+    together, and the task is never in both files or neither.  Returns
+    the number of tasks moved.
+    """
+    fields = dict(fields, updated_at=now_micros())
+    columns = ', '.join('"{}"'.format(name) for name in fields)
+    values = [Task._meta.fields[name].db_value(value)
+              for name, value in fields.items()]
+    source.execute_sql('ATTACH DATABASE ? AS "moving"', (target.database,))
+    try:
+        with source.atomic(lock_type='IMMEDIATE'):
+            moved = source.execute_sql(
+                'DELETE FROM "main"."task" WHERE "id" = ?',
+                (task_id,)).rowcount
+            if moved:
+                source.execute_sql(
+                    'INSERT OR IGNORE INTO "moving"."employee" ("name") '
+                    'VALUES (?)', (employee,))
+                source.execute_sql(
+                    'INSERT INTO "moving"."task" ("id", "employee_id", {}) '
+                    'SELECT ?, "id", {} FROM "moving"."employee" '
+                    'WHERE "name" = ?'.format(
+                        columns, ', '.join('?' * len(values))),
+                    [task_id] + values + [employee])
+    finally:
+        source.execute_sql('DETACH DATABASE "moving"')
+    return moved
+
+
+@retry_on_busy
+def update_matching(partition, ids, update):
+    """
+    Updates the tasks of a partition whose ids 'ids' selects, in one
+    statement, and returns how many were updated.
+    """
+    with partition.atomic(lock_type='IMMEDIATE'):
+        update = dict(update)
+        if 'employee' in update:
+            update['employee'] = employee_id(partition, update['employee'])
+        return (Task.update(**update).where(Task.id.in_(ids))
+                .bind(partition).execute())
+
+
+@retry_on_busy
+def delete_matching(partition, ids):
+    """
+    Deletes the tasks of a partition whose ids 'ids' selects, in one
+    statement, and returns how many were deleted.
+    """
+    with partition.atomic(lock_type='IMMEDIATE'):
+        return (Task.delete().where(Task.id.in_(ids))
+                .bind(partition).execute())
+
+
+def find(task_id):
+    """
+    Returns the partition holding the task with 'task_id' and the task,
+    or (None, None) if there is no such task.
+    """
+    databases = [database(name) for name in partitions()]
+    found = run_parallel(lambda partition: read(
+        (partition, Task.select().where(Task.id == task_id))), databases)
+    for partition, rows in zip(databases, found):
+        if rows:
+            return partition, rows[0]
+    return None, None
+
+
+def add_task(employee, duration, title, notes, created_at=None):
+    """
+    Creates a task in the partition for the period it was created in and
+    returns it.
+    """
+    if created_at is None:
+        created_at = datetime.datetime.now()
+    partition = open_partition(partition_name(created_at, period()))
+    task_id = next_task_id()
+    fields = {'duration': duration, 'title': title, 'notes': notes,
+              'created_at': created_at, 'uuid': new_uuid(),
+              'updated_at': now_micros()}
+    insert_task(partition, task_id, employee, fields)
+    return Task(id=task_id, employee=Employee(name=employee), **fields)
+
+
+def update_task(task_id, update):
+    """
+    Updates a task from a dict of field names to new values, moving it to
+    another partition if its new date belongs to one.  Returns the number
+    of tasks updated.
+    """
+    partition, current = find(task_id)
+    if current is None:
+        return 0
+    if partition.database == archive_path():
+        raise ValueError(ARCHIVED_TASK.format(task_id))
+    update = dict(update)
+    created_at = update.get('created_at', current.created_at)
+    target = open_partition(partition_name(created_at, period()))
+    if target is partition:
+        return update_in_place(partition, task_id, update)
+    fields = {'duration': current.duration, 'title': current.title,
+              'notes': current.notes, 'created_at': created_at,
+              'uuid': current.uuid}
+    fields.update((name, value) for name, value in update.items()
+                  if name != 'employee')
+    return move_task(partition, target, task_id,
+                     update.get('employee', current.employee.name), fields)
+
+
+def delete_task(task_id):
+    """Deletes a task.  Returns the number of tasks deleted."""
+    partition, current = find(task_id)
+    if current is None:
+        return 0
+    if partition.database == archive_path():
+        raise ValueError(ARCHIVED_TASK.format(task_id))
+    return delete_from(partition, task_id)
+
+
+def partition_by(by):
+    """
+    Partitions the work log by 'by', 'year' or 'month', moving every task
+    into its partition file and shrinking the main file.  Returns the
+    number of tasks moved.
+    """
+    current = period()
+    if current is not None and current != by:
+        raise ValueError("The work log is already partitioned by {}."
+                         .format(current))
+    with DATABASE.atomic(lock_type='IMMEDIATE'):
+        (Setting.insert(name='partition_period', value=by)
+         .on_conflict_ignore().execute())
+        (TaskStats.insert(name='last_task_id', value=0)
+         .on_conflict_ignore().execute())
+    moved = distribute()
+    if moved:
+        compact(DATABASE)
+    return moved
+
+
+def compact(database):
+    """
+    Gives back the space of tasks moved out of 'database': merges its
+    full-text index, which otherwise keeps a marker for every deleted
+    task, and vacuums the file.
+    """
+    database.execute_sql(
+        'INSERT INTO "task_fts" ("task_fts") VALUES (\'optimize\')')
+    database.execute_sql('VACUUM')
+
+
+def distribute():
+    """
+    Moves the tasks in the main database of a partitioned work log into
+    their partitions.  Bulk imports write to the main database, with ids
+    from reserve_ids(), and then call this.  Returns the number of tasks
+    moved.
+    """
+    by = period()
+    if by is None:
+        return 0
+    names = [name for name, in DATABASE.execute_sql(
+        'SELECT DISTINCT strftime(?, "day" * 86400, \'unixepoch\') '
+        'FROM "task"', (PERIODS[by],))]
+    return sum(move(name) for name in names)
+
+
+def move(name):
+    """
+    Moves the main database's tasks created in the period of partition
+    'name' into it.
+    """
+    first_day, last_day = partition_days(name)
+    return transfer(DATABASE, open_partition(name).database, first_day,
+                    last_day)
+
+
+@retry_on_busy
+def transfer(source, path, first_day, last_day):
+    """
+    Moves the tasks created from 'first_day' through 'last_day' out of
+    the database 'source' into the database file at 'path', with their
+    ids, by attaching the file so the whole move is done by SQLite.  When
+    'source' is the main database, its last_task_id is kept past the ids
+    moved.  Returns the number of tasks moved.
+    """
+    source.execute_sql('ATTACH DATABASE ? AS "moving"', (path,))
+    try:
+        with source.atomic(lock_type='IMMEDIATE'):
+            days = (first_day, last_day)
+            source.execute_sql(
+                'INSERT OR IGNORE INTO "moving"."employee" ("name") '
+                'SELECT DISTINCT e."name" FROM "main"."task" t '
+                'JOIN "main"."employee" e ON e."id" = t."employee_id" '
+                'WHERE t."day" BETWEEN ? AND ?', days)
+            moved = source.execute_sql(
+                'INSERT INTO "moving"."task" ("id", "employee_id", '
+                '"duration", "title", "notes", "created_at", "uuid", '
+                '"updated_at") '
+                'SELECT t."id", m."id", t."duration", t."title", '
+                't."notes", t."created_at", t."uuid", t."updated_at" '
+                'FROM "main"."task" t '
+                'JOIN "main"."employee" e ON e."id" = t."employee_id" '
+                'JOIN "moving"."employee" m ON m."name" = e."name" '
+                'WHERE t."day" BETWEEN ? AND ? ORDER BY t."created_at"',
+                days).rowcount
+            source.execute_sql(
+                'UPDATE "main"."task_stats" SET "value" = max("value", '
+                '(SELECT max("id") FROM "main"."task" '
+                'WHERE "day" BETWEEN ? AND ?)) '
+                'WHERE "name" = \'last_task_id\'', days)
+            source.execute_sql(
+                'DELETE FROM "main"."task" WHERE "day" BETWEEN ? AND ?',
+                days)
+    finally:
+        source.execute_sql('DETACH DATABASE "moving"')
+    return moved
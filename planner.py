@@ -0,0 +1,294 @@
+"""
+Combined searches on any mix of employee, duration range, keyword and
+date range, planned around the criterion that matches the fewest tasks.
+
+SQLite finds a query's rows through one index and checks the rest of its
+conditions row by row.  With no statistics to go on it can choose badly,
+such as walking the duration index over most of the log to find one
+employee's few hundred tasks.  plan() estimates how many tasks each
+criterion matches: employee counts and rollups where the triggers keep
+them, and otherwise index entries counted up to SAMPLE_LIMIT.  The query
+built for a plan leaves only the chosen criterion usable by an index.
+The other columns are written as +column, which SQLite can't look up,
+and a keyword that doesn't lead is checked against the set of full-text
+matches.  describe() shows the estimates, the choice, and SQLite's query
+plan for the first page of results.
+"""
+import collections
+import datetime
+
+from peewee import fn
+
+from task import (DATABASE, DurationRollup, Employee, Task, TaskIndex,
+                  Unindexed, day_number)
+import instrumentation
+import paging
+import partitions
+import search
+
+
+# Most index entries counted when estimating a criterion's matches.
+SAMPLE_LIMIT = 10000
+
+# Criteria in the order they're preferred when estimates tie: date order
+# is the order results are shown in, so the date indexes sort for free.
+DRIVERS = ['employee_date', 'employee', 'date', 'keyword', 'duration']
+
+DESCRIPTIONS = {
+    'employee_date': "employee and date index",
+    'employee': "employee index",
+    'date': "date index",
+    'keyword': "full-text index",
+    'duration': "duration index",
+}
+
+
+class Criteria(collections.namedtuple('Criteria', [
+        'employee', 'min_duration', 'max_duration', 'keyword',
+        'start_date', 'end_date'])):
+    """
+    What a combined search looks for.  Criteria left as None match every
+    task, and the date and duration ranges may be given either way round.
+    """
+    __slots__ = ()
+
+    def __new__(cls, employee=None, min_duration=None, max_duration=None,
+                keyword=None, start_date=None, end_date=None):
+        if start_date is not None and end_date is not None:
+            start_date, end_date = sorted([start_date, end_date])
+        if min_duration is not None and max_duration is not None:
+            min_duration, max_duration = sorted([min_duration,
+                                                 max_duration])
+        return super().__new__(cls, employee, min_duration, max_duration,
+                               keyword, start_date, end_date)
+
+    @property
+    def full_text(self):
+        """The keyword as an FTS5 query, or '' when there isn't one."""
+        return search.full_text_query(self.keyword or '')
+
+    @property
+    def days(self):
+        """The first and last day searched, either of which may be None."""
+        return (None if self.start_date is None
+                else day_number(self.start_date),
+                None if self.end_date is None
+                else day_number(self.end_date))
+
+    def given(self):
+        """Returns the names of the criteria given, as in DRIVERS."""
+        names = []
+        has_dates = self.start_date is not None or self.end_date is not None
+        if self.employee is not None:
+            names.append('employee')
+            if has_dates:
+                names.append('employee_date')
+        if has_dates:
+            names.append('date')
+        if self.full_text:
+            names.append('keyword')
+        if self.min_duration is not None or self.max_duration is not None:
+            names.append('duration')
+        return names
+
+
+Plan = collections.namedtuple('Plan', 'driver estimates sampled')
+Plan.__doc__ = """
+The criterion chosen to find a combined search's tasks, with the
+estimated matches of each criterion given.  'sampled' names the
+estimates that reached SAMPLE_LIMIT in some database, so are at least
+what they say.
+"""
+
+
+# Date order for plans led by an index that doesn't give it.  Otherwise
+# SQLite may walk the created_at index to avoid sorting, and check every
+# task against the criteria on the way.
+SORTED_DATE_ORDER = (('created_at', Unindexed(Task.created_at)),
+                     ('id', Task.id))
+
+
+def employee_id(name):
+    return Employee.select(Employee.id).where(Employee.name == name)
+
+
+def between(column, low, high):
+    """Returns the condition low <= column <= high, either bound optional."""
+    if low is None:
+        return column <= high
+    if high is None:
+        return column >= low
+    return column.between(low, high)
+
+
+def condition(name, criteria, indexed=True):
+    """
+    Returns the condition for the criterion 'name', with its column
+    written so SQLite can use an index for it only if 'indexed'.  The
+    keyword is handled by search_query().
+    """
+    def column(field):
+        return field if indexed else Unindexed(field)
+    if name == 'employee':
+        return column(Task.employee) == employee_id(criteria.employee)
+    if name == 'date':
+        return between(column(Task.day), *criteria.days)
+    if name == 'duration':
+        return between(column(Task.duration), criteria.min_duration,
+                       criteria.max_duration)
+    # The employee and created_at index, so bounded by times.
+    start, end = [None if date is None else
+                  datetime.datetime.combine(date, datetime.time())
+                  for date in [criteria.start_date, criteria.end_date]]
+    found = column(Task.employee) == employee_id(criteria.employee)
+    if start is not None:
+        found &= column(Task.created_at) >= start
+    if end is not None:
+        found &= column(Task.created_at) < end + datetime.timedelta(days=1)
+    return found
+
+
+def estimate(name, criteria, database, limit=SAMPLE_LIMIT):
+    """
+    Returns how many tasks in 'database' match the criterion 'name', and
+    whether counting stopped at 'limit'.
+    """
+    if name == 'employee':
+        count = (Employee.select(Employee.task_count)
+                 .where(Employee.name == criteria.employee)
+                 .bind(database).scalar()) or 0
+        return count, False
+    if name == 'employee_date':
+        first_day, last_day = criteria.days
+        query = (DurationRollup.select(fn.SUM(DurationRollup.tasks))
+                 .join(Employee)
+                 .where(Employee.name == criteria.employee,
+                        DurationRollup.period == 'day'))
+        if first_day is not None:
+            query = query.where(DurationRollup.start_day >= first_day)
+        if last_day is not None:
+            query = query.where(DurationRollup.start_day <= last_day)
+        return query.bind(database).scalar() or 0, False
+    if name == 'keyword':
+        query = (TaskIndex.select(TaskIndex.rowid)
+                 .where(TaskIndex.match(criteria.full_text)))
+    else:
+        query = Task.select(Task.id).where(condition(name, criteria))
+    count = query.limit(limit).bind(database).count()
+    return count, count >= limit
+
+
+def estimates(criteria, names, limit=SAMPLE_LIMIT):
+    """
+    Returns the estimated matches of each of the criteria 'names' in
+    every database the search reads, and the names whose count stopped
+    at 'limit' in some database.
+    """
+    counts = collections.OrderedDict((name, 0) for name in names)
+    sampled = set()
+    for found in partitions.each(
+            lambda database: [estimate(name, criteria, database, limit)
+                              for name in names],
+            *criteria.days):
+        for name, (count, reached_limit) in zip(names, found):
+            counts[name] += count
+            if reached_limit:
+                sampled.add(name)
+    return counts, sampled
+
+
+def plan(criteria):
+    """
+    Estimates the matches of each criterion given and returns a Plan led
+    by the one with the fewest.
+    """
+    names = criteria.given()
+    if not names:
+        return Plan(None, collections.OrderedDict(), frozenset())
+    counts, sampled = estimates(criteria, names)
+    exact = [counts[name] for name in names if name not in sampled]
+    if sampled and exact and min(exact) > SAMPLE_LIMIT:
+        # The sampled criteria might still match fewer tasks than the
+        # best of the others, so count them as far as that one.
+        recounted, sampled = estimates(
+            criteria, [name for name in names if name in sampled],
+            min(exact) + 1)
+        counts.update(recounted)
+    driver = min(names, key=lambda name: (counts[name], DRIVERS.index(name)))
+    return Plan(driver, counts, frozenset(sampled))
+
+
+def search_query(criteria, chosen):
+    """
+    Returns the query of tasks matching every criterion, found through
+    the index of the criterion 'chosen'.  When that's the keyword, the
+    best matches come first, as in a keyword search.
+    """
+    if chosen == 'keyword':
+        query = (Task.select(Task, search.TASK_RANK.alias('rank'))
+                 .join(TaskIndex, on=(Task.id == TaskIndex.rowid))
+                 .where(TaskIndex.match(criteria.full_text))
+                 .order_by(search.TASK_RANK))
+    else:
+        query = Task.select()
+    names = criteria.given()
+    if chosen == 'employee_date':
+        names = [name for name in names if name not in ('employee', 'date')]
+    for name in names:
+        if name == 'keyword':
+            if chosen != 'keyword':
+                query = query.where(Unindexed(Task.id).in_(
+                    TaskIndex.select(TaskIndex.rowid)
+                    .where(TaskIndex.match(criteria.full_text))))
+        elif name != 'employee_date' or chosen == name:
+            query = query.where(condition(name, criteria, name == chosen))
+    return partitions.route(query, *criteria.days)
+
+
+def order_for(tasks, chosen):
+    """Returns the sort keys to page through a combined search by."""
+    keys = paging.order_for(tasks)
+    if keys == paging.DATE_ORDER and chosen.driver in ('keyword',
+                                                       'duration'):
+        return SORTED_DATE_ORDER
+    return keys
+
+
+def combined_search(criteria):
+    """
+    Plans a search on 'criteria' and returns its tasks, the sort keys to
+    page through them by, and the plan.  With no criteria given every
+    task is returned.
+    """
+    chosen = plan(criteria)
+    if chosen.driver is None:
+        tasks = search.all_tasks()
+    else:
+        tasks = search_query(criteria, chosen.driver)
+    return tasks, order_for(tasks, chosen), chosen
+
+
+def describe(chosen, tasks, keys):
+    """
+    Yields lines describing a plan: each criterion's estimated matches,
+    the index chosen, and SQLite's query plan for the first page of the
+    tasks found with it, sorted by 'keys'.
+    """
+    if chosen.driver is None:
+        yield "No criteria given: reading every task by date."
+    for name, count in chosen.estimates.items():
+        yield "  {:<24} {}{} tasks".format(
+            DESCRIPTIONS[name], count, '+' if name in chosen.sampled else '')
+    if chosen.driver is not None:
+        yield "Using the {}.".format(DESCRIPTIONS[chosen.driver])
+    page = paging.page_query(tasks, keys, limit=paging.PAGE_SIZE + 1)
+    if isinstance(page, partitions.PartitionedQuery):
+        parts = page.ordered_parts()
+    else:
+        parts = [(DATABASE, page)]
+    if parts:
+        database, query = parts[0]
+        yield "SQLite plan{}:".format(
+            " (first of {} files)".format(len(parts))
+            if len(parts) > 1 else "")
+        yield instrumentation.explain(database, *query.sql())
@@ -0,0 +1,84 @@
+"""
+Duration reports: total minutes per employee per day, week or month.
+
+Reports are read from the duration_rollup table, which triggers keep up
+to date as tasks change, so their cost depends on the number of periods
+reported rather than the number of tasks.
+"""
+import csv
+import datetime
+import heapq
+import itertools
+
+from task import DurationRollup, Employee, EPOCH, day_number
+import partitions
+
+
+PERIODS = ['day', 'week', 'month']
+
+
+def period_start(period, date):
+    """
+    Returns the first day, in days since the epoch, of the day, week or
+    month containing 'date'.  Weeks start on Monday.
+    """
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    if period == 'week':
+        date -= datetime.timedelta(days=date.weekday())
+    elif period == 'month':
+        date = date.replace(day=1)
+    return day_number(date)
+
+
+def duration_report(period, start_date=None, end_date=None, employee=None):
+    """
+    Yields (employee name, period start date, minutes, tasks) for each
+    employee and period with tasks, ordered by employee then date.
+
+    Periods overlapping the range from 'start_date' to 'end_date' are
+    included whole.  'employee' limits the report to one employee.  In a
+    partitioned work log, periods spanning two partitions are added up
+    from both.
+    """
+    query = (DurationRollup
+             .select(Employee.name, DurationRollup.start_day,
+                     DurationRollup.minutes, DurationRollup.tasks)
+             .join(Employee)
+             .where(DurationRollup.period == period)
+             .order_by(Employee.name, DurationRollup.start_day))
+    first_day = last_day = None
+    if start_date is not None:
+        first_day = period_start(period, start_date)
+        query = query.where(DurationRollup.start_day >= first_day)
+    if end_date is not None:
+        query = query.where(DurationRollup.start_day <= day_number(end_date))
+        # The last period can run on for up to a month past the end date.
+        last_day = day_number(end_date) + 30
+    if employee is not None:
+        query = query.where(Employee.name == employee)
+    parts = partitions.each(
+        lambda database: list(query.clone().bind(database).tuples()),
+        first_day, last_day)
+    for (name, start_day), rows in itertools.groupby(
+            heapq.merge(*parts), key=lambda row: row[:2]):
+        rows = list(rows)
+        yield (name, EPOCH + datetime.timedelta(days=start_day),
+               sum(row[2] for row in rows), sum(row[3] for row in rows))
+
+
+def format_report(rows):
+    """Yields the lines of a text table for duration report rows."""
+    yield "{:<30} {:<10} {:>8} {:>6}".format(
+        "Employee", "Starting", "Minutes", "Tasks")
+    for name, start, minutes, tasks in rows:
+        yield "{:<30} {:<10} {:>8} {:>6}".format(
+            name[:30], start.strftime("%m/%d/%Y"), minutes, tasks)
+
+
+def write_csv(rows, stream):
+    """Writes duration report rows to a stream as CSV."""
+    writer = csv.writer(stream)
+    writer.writerow(['employee', 'start', 'minutes', 'tasks'])
+    for name, start, minutes, tasks in rows:
+        writer.writerow([name, start.isoformat(), minutes, tasks])
@@ -0,0 +1,222 @@
+"""
+Queries behind the work log searches.
+
+Each function takes already validated criteria and returns a query of
+tasks, so the same searches can drive the interactive menus and the
+command line.  In a partitioned work log the query is routed to the
+partitions that can hold its results.
+"""
+import collections
+import re
+
+from task import (Employee, EmployeeIndex, EmployeeTrigram, Task,
+                  TaskIndex, day_number)
+import partitions
+
+
+# bm25 score for keyword searches, weighting title matches over notes.
+# Lower scores are better matches.
+TASK_RANK = TaskIndex.bm25(10.0, 1.0)
+
+# Most employee names offered for one lookup.
+CANDIDATE_LIMIT = 20
+
+# Share of the search text's trigrams a name must contain to be offered
+# as a fuzzy match.
+FUZZY_THRESHOLD = 0.5
+
+# Number of the search text's rarest trigrams used to find fuzzy match
+# candidates.  Common trigrams match too many names to be worth reading.
+FUZZY_SEEDS = 4
+
+
+def all_tasks():
+    """Returns every task."""
+    return partitions.route(Task.select())
+
+
+def task_with_id(task_id):
+    """Returns the task with 'task_id', if there is one."""
+    return partitions.route(Task.select().where(Task.id == task_id))
+
+
+def tasks_by_employee(employee):
+    """Returns the tasks completed by the named employee."""
+    employee_id = (Employee.select(Employee.id)
+                   .where(Employee.name == employee))
+    return partitions.route(Task.select().where(Task.employee == employee_id))
+
+
+def employees_with_tasks():
+    """Returns (name, task count) for each employee with tasks, by name."""
+    counts = collections.Counter()
+    for found in partitions.each(lambda database: list(
+            Employee.select(Employee.name, Employee.task_count)
+            .where(Employee.task_count > 0)
+            .tuples().bind(database))):
+        for name, count in found:
+            counts[name] += count
+    return sorted(counts.items())
+
+
+def employee_candidates(text, limit=CANDIDATE_LIMIT):
+    """
+    Returns up to 'limit' names of employees with tasks that match
+    'text', best matches first.
+
+    Names containing the text are returned first, with names starting
+    with it ahead of the rest, then shortest first.  When no name
+    contains the text, names similar to it are returned instead, so
+    small typos still find the intended employee.
+    """
+    names = set()
+    for found in partitions.each(
+            lambda database: matching_employees(text, limit, database)):
+        names.update(found)
+    if not names:
+        return similar_employees(text, limit)
+    text = text.lower()
+    return sorted(names, key=lambda name: (
+        not name.lower().startswith(text), len(name), name))[:limit]
+
+
+def matching_employees(text, limit, database):
+    """
+    Returns up to 'limit' names of employees with tasks in 'database'
+    that contain 'text'.
+    """
+    if len(text) < 3:
+        # The trigram index can't match fewer than three characters.
+        query = (Employee.select(Employee.name)
+                 .where(Employee.name ** "%{}%".format(text),
+                        Employee.task_count > 0))
+    else:
+        query = (Employee.select(Employee.name)
+                 .join(EmployeeIndex,
+                       on=(Employee.id == EmployeeIndex.rowid))
+                 .where(EmployeeIndex.match(quote_trigram(text)),
+                        Employee.task_count > 0))
+    return [name for name, in query.limit(limit).tuples().bind(database)]
+
+
+def similar_employees(text, limit=CANDIDATE_LIMIT):
+    """
+    Returns names of employees with tasks that contain at least
+    FUZZY_THRESHOLD of the trigrams in 'text', most similar first.
+    """
+    wanted = trigrams(text)
+    if not wanted:
+        return []
+    scored = {}
+    for candidates in partitions.each(
+            lambda database: fuzzy_candidates(wanted, limit, database)):
+        for name in candidates:
+            found = trigrams(name)
+            shared = len(wanted & found)
+            if shared >= FUZZY_THRESHOLD * len(wanted):
+                scored[name] = (-shared, len(found), name)
+    return [name for _, _, name in sorted(scored.values())[:limit]]
+
+
+def fuzzy_candidates(wanted, limit, database):
+    """
+    Returns names of employees with tasks in 'database' that might
+    contain most of the trigrams in 'wanted'.
+
+    Candidates are the names containing the rarest of the trigrams that
+    occur in any name.  A typo only changes the trigrams around it, so
+    the rest still find the intended name, and rare trigrams keep the
+    number of names read small.
+    """
+    seeds = [term for term, in (EmployeeTrigram.select(EmployeeTrigram.term)
+                                .where(EmployeeTrigram.term.in_(
+                                    list(wanted)))
+                                .order_by(EmployeeTrigram.doc)
+                                .limit(FUZZY_SEEDS)
+                                .tuples()
+                                .bind(database))]
+    if not seeds:
+        return []
+    query = ' OR '.join(quote_trigram(seed) for seed in seeds)
+    candidates = (Employee.select(Employee.name)
+                  .join(EmployeeIndex,
+                        on=(Employee.id == EmployeeIndex.rowid))
+                  .where(EmployeeIndex.match(query),
+                         Employee.task_count > 0)
+                  .order_by(EmployeeIndex.bm25())
+                  .limit(limit * 25)
+                  .tuples()
+                  .bind(database))
+    return [name for name, in candidates]
+
+
+def trigrams(text):
+    """Returns the set of lowercase three character substrings of text."""
+    text = text.lower()
+    return {text[index:index + 3] for index in range(len(text) - 2)}
+
+
+def quote_trigram(text):
+    """Quotes text as an FTS5 string for the trigram tokenizer."""
+    return '"{}"'.format(text.replace('"', '""'))
+
+
+def tasks_by_duration(duration):
+    """Returns the tasks that took exactly 'duration' minutes."""
+    return partitions.route(Task.select().where(Task.duration == duration))
+
+
+def tasks_by_keyword(keyword):
+    """
+    Returns the tasks whose title or notes match 'keyword', best matches
+    first.  The bm25 score of each task is selected as 'rank'.
+
+    bm25 scores depend on the rest of the tasks in the same file, so in a
+    partitioned work log the matches are paged through by date instead.
+    """
+    query = full_text_query(keyword)
+    if not query:
+        return all_tasks()
+    return partitions.route(Task.select(Task, TASK_RANK.alias('rank'))
+                            .join(TaskIndex, on=(Task.id == TaskIndex.rowid))
+                            .where(TaskIndex.match(query))
+                            .order_by(TASK_RANK))
+
+
+def full_text_query(keyword):
+    """
+    Converts user input into an FTS5 query string.
+
+    Each word must appear in the title or notes.  A word ending in '*'
+    matches as a prefix, and text wrapped in double quotes matches as a
+    phrase.  Everything else is quoted so user input can't produce an
+    FTS5 syntax error.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', keyword):
+        if phrase.strip():
+            terms.append('"{}"'.format(phrase))
+            continue
+        prefix = '*' if word.endswith('*') else ''
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append('"{}"{}'.format(word, prefix))
+    return ' '.join(terms)
+
+
+def tasks_on_date(date):
+    """Returns the tasks created on the day of 'date'."""
+    day = day_number(date)
+    return partitions.route(Task.select().where(Task.day == day), day, day)
+
+
+def tasks_in_range(start_date, end_date):
+    """
+    Returns the tasks created from the day of one date through the day
+    of the other, in either order.
+    """
+    start_day, end_day = sorted([day_number(start_date),
+                                 day_number(end_date)])
+    return partitions.route(
+        Task.select().where(Task.day.between(start_day, end_day)),
+        start_day, end_day)
@@ -0,0 +1,198 @@
+"""
+A least recently used cache of task search results for the menus.
+
+People repeat the same searches all day, and paging back and forth
+through results repeats the same page queries.  Each page of tasks the
+pager fetches, and each check of whether a search found anything, is
+cached under the SQL and parameters of its query.  The search functions
+build those from normalized criteria: employee names as chosen from the
+list, keywords converted to a full-text query, and dates as day numbers
+in order.  The cache keeps at most MAX_ENTRIES results and about
+MAX_BYTES of rows, dropping the least recently used first.
+
+Everything cached is dropped when the write generation changes.  The
+generation is a counter the task writes bump.  Each lookup also checks
+the rows its thread's connection to each database has changed, and
+SQLite's data_version, which changes whenever another connection
+commits, and bumps the counter if either moved.  So writes from other
+threads, other processes and bulk commands clear the cache too, while
+results cached by one thread are hits on every other.  A thread's
+first lookup on a connection counts as a write, since it can't tell
+what changed before.
+
+A hit runs no search query, but it does run PRAGMA data_version on each
+open file, since nothing in this process sees another process commit.
+That reads no pages and takes a few microseconds a file, against a
+millisecond or so for a page of tasks.
+"""
+import collections
+import sys
+import threading
+
+from peewee import Model
+
+from federation import FederatedSearch
+from task import DATABASE
+import partitions
+
+
+MAX_ENTRIES = 256
+MAX_BYTES = 16 * 1024 * 1024
+
+
+def footprint(value):
+    """Roughly the bytes a cached result holds on to."""
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(footprint(item) for item in value)
+    if isinstance(value, Model):
+        return (sys.getsizeof(value) + sys.getsizeof(value.__data__) +
+                sum(sys.getsizeof(field) for field in value.__data__.values()))
+    return sys.getsizeof(value)
+
+
+def query_key(query):
+    """
+    Returns a key for the results of a task query: the file, SQL and
+    parameters of each query it runs, in the order they're read.
+    """
+    if isinstance(query, partitions.PartitionedQuery):
+        parts = query.ordered_parts()
+    else:
+        parts = [(DATABASE, query)]
+    key = []
+    for partition, part in parts:
+        sql, params = part.sql()
+        key.append((partition.database, sql, tuple(params)))
+    return tuple(key)
+
+
+class SearchCache:
+    """
+    Caches results by key until the write generation changes, keeping at
+    most 'max_entries' results and about 'max_bytes' of them.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.writes = 0
+        self.generation = None
+        self.seen = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def bump(self):
+        """Counts a write, so results cached before it are dropped."""
+        with self.lock:
+            self.writes += 1
+
+    def current_generation(self):
+        """
+        Returns the write generation, first counting a write if this
+        thread's connection to any open database has changed rows, or
+        seen another connection commit, since its last lookup.  That
+        costs one PRAGMA round trip to each open file.
+        """
+        with partitions.LOCK:
+            databases = [DATABASE] + list(partitions.DATABASES.values())
+        states = getattr(self.seen, 'states', None)
+        if states is None:
+            states = self.seen.states = {}
+        changed = False
+        for database in databases:
+            connection = database.connection()
+            state = (connection, connection.total_changes,
+                     connection.execute('PRAGMA data_version').fetchone()[0])
+            if states.get(database.database) != state:
+                states[database.database] = state
+                changed = True
+        with self.lock:
+            if changed:
+                self.writes += 1
+            return self.writes
+
+    def get(self, key, compute):
+        """
+        Returns the result cached under 'key', or else calls compute() and
+        caches what it returns.
+        """
+        generation = self.current_generation()
+        with self.lock:
+            if generation != self.generation:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.size = 0
+                self.generation = generation
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        value = compute()
+        size = footprint(value)
+        with self.lock:
+            if self.generation == generation and size <= self.max_bytes:
+                self.entries[key] = (value, size)
+                self.size += size
+                while (len(self.entries) > self.max_entries or
+                       self.size > self.max_bytes):
+                    _, (_, dropped) = self.entries.popitem(last=False)
+                    self.size -= dropped
+                    self.evictions += 1
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.generation = None
+
+    def stats(self):
+        """Returns the cache's counters and size as a dict."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self.entries),
+                'bytes': self.size,
+            }
+
+    def report(self, stream=sys.stderr):
+        """Writes the cache's counters to 'stream'."""
+        stream.write(
+            "\nsearch cache: {hits} hits, {misses} misses ({hit_rate:.0%}), "
+            "{evictions} evicted, {invalidations} invalidated, "
+            "{entries} entries, {bytes} bytes\n".format(**self.stats()))
+
+
+CACHE = SearchCache()
+
+
+def load(query):
+    """Reads a task query into a list, with each task's employee."""
+    rows = list(query)
+    if not isinstance(query, partitions.PartitionedQuery):
+        partitions.with_employees(DATABASE, rows)
+    return rows
+
+
+def rows(query):
+    """Returns the rows of a task query, from the cache when it has them."""
+    return CACHE.get(('rows',) + query_key(query), lambda: load(query))
+
+
+def exists(query):
+    """Tells whether a task query has any rows, from the cache if it can."""
+    if isinstance(query, FederatedSearch):
+        return query.exists()
+    return CACHE.get(('exists',) + query_key(query), query.exists)
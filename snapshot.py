@@ -0,0 +1,239 @@
+"""
+A columnar snapshot of every task, for statistics over the whole log.
+
+Reading a million tasks through the ORM builds a million model objects,
+and adding them up in Python costs as much again.  A Snapshot instead
+reads the id, employee, duration and creation time of each task straight
+from the cursor into NumPy arrays, one per column, so filters are boolean
+masks and sums, means and percentiles run over whole columns at once.
+Employees are numbered across all the work log's files and their names
+kept once.  Titles and notes are left in the database and read only for
+the tasks asked for.
+
+refresh() brings a snapshot up to date by reading just the tasks the
+task_change log says were added, edited or deleted since it was taken.
+
+NumPy isn't a requirement of the work log: importing this module without
+it raises ImportError, which the stats command reports.
+"""
+import itertools
+
+import numpy
+
+from changes import chunks, last_change
+from task import DATABASE, Employee, Task, TaskChange, day_number
+import partitions
+
+
+# Microseconds in a day, for turning created_at into days since the epoch.
+DAY = 86400 * 10**6
+
+PERCENTILES = [50, 90, 99]
+
+COLUMNS = [Task.id, Task.employee, Task.duration, Task.created_at]
+
+
+def read_columns(database, query):
+    """
+    Runs a query selecting COLUMNS on 'database' and returns its rows as
+    a two dimensional int64 array, one row per task.
+    """
+    cursor = database.execute_sql(*query.bind(database).sql())
+    values = numpy.fromiter(itertools.chain.from_iterable(cursor),
+                            dtype=numpy.int64)
+    return values.reshape(-1, len(COLUMNS))
+
+
+class Snapshot:
+    """
+    The id, employee number, duration, day and creation time of every
+    task, in arrays of the same length and order.  'sources' holds the
+    index in 'paths' of the file each task was read from, and 'names'
+    the name of each employee number.
+    """
+
+    def __init__(self):
+        self.paths = []
+        self.seqs = []
+        self.names = []
+        self.numbers = {}
+        self.ids = numpy.empty(0, dtype=numpy.int64)
+        self.employees = numpy.empty(0, dtype=numpy.int32)
+        self.durations = numpy.empty(0, dtype=numpy.int64)
+        self.created = numpy.empty(0, dtype=numpy.int64)
+        self.days = numpy.empty(0, dtype=numpy.int32)
+        self.sources = numpy.empty(0, dtype=numpy.int16)
+
+    @classmethod
+    def load(cls):
+        """Reads every task in the work log into a new snapshot."""
+        snapshot = cls()
+        for database in partitions.databases():
+            snapshot.paths.append(database.database)
+            with database.atomic():
+                snapshot.seqs.append(last_change(database))
+                snapshot.append(database, read_columns(
+                    database, Task.select(*COLUMNS)))
+        return snapshot
+
+    def __len__(self):
+        return len(self.ids)
+
+    def employee_numbers(self, database):
+        """
+        Returns an array mapping the employee ids of 'database' to
+        snapshot employee numbers, numbering any new names.
+        """
+        rows = list(Employee.select(Employee.id, Employee.name)
+                    .bind(database).tuples())
+        numbers = numpy.full(max([0] + [id for id, _ in rows]) + 1, -1,
+                             dtype=numpy.int32)
+        for employee_id, name in rows:
+            if name not in self.numbers:
+                self.numbers[name] = len(self.names)
+                self.names.append(name)
+            numbers[employee_id] = self.numbers[name]
+        return numbers
+
+    def append(self, database, rows):
+        """Adds the tasks in 'rows', read by read_columns() from 'database'."""
+        numbers = self.employee_numbers(database)
+        created = rows[:, 3]
+        self.ids = numpy.concatenate([self.ids, rows[:, 0]])
+        self.employees = numpy.concatenate(
+            [self.employees, numbers[rows[:, 1]]])
+        self.durations = numpy.concatenate([self.durations, rows[:, 2]])
+        self.created = numpy.concatenate([self.created, created])
+        self.days = numpy.concatenate(
+            [self.days, (created // DAY).astype(numpy.int32)])
+        self.sources = numpy.concatenate([
+            self.sources,
+            numpy.full(len(rows), self.paths.index(database.database),
+                       dtype=numpy.int16)])
+
+    def keep(self, mask):
+        """Drops the tasks where 'mask' is False."""
+        for column in ['ids', 'employees', 'durations', 'created', 'days',
+                       'sources']:
+            setattr(self, column, getattr(self, column)[mask])
+
+    def refresh(self):
+        """
+        Brings the snapshot up to date with the tasks added, edited and
+        deleted since it was taken or last refreshed, and returns how
+        many tasks were read.  A task that moved between files is dropped
+        from the file it left and read from the one it moved to.  If the
+        work log's files changed, everything is read again.
+        """
+        databases = partitions.databases()
+        changes = []
+        if [database.database for database in databases] == self.paths:
+            for index, database in enumerate(databases):
+                with database.atomic():
+                    seq = last_change(database)
+                    if seq < self.seqs[index]:
+                        # The file was replaced, and its log started over.
+                        break
+                    changed = [
+                        task_id for task_id, in
+                        TaskChange.select(TaskChange.task_id).distinct()
+                        .where(TaskChange.seq > self.seqs[index])
+                        .bind(database).tuples()]
+                    rows = [read_columns(database, Task.select(*COLUMNS)
+                                         .where(Task.id.in_(chunk)))
+                            for chunk in chunks(changed)]
+                changes.append((database, seq, changed, rows))
+        if len(changes) < len(databases) or not self.paths:
+            self.__dict__.update(Snapshot.load().__dict__)
+            return len(self)
+        changed = numpy.array([task_id for _, _, ids, _ in changes
+                               for task_id in ids], dtype=numpy.int64)
+        self.keep(~numpy.isin(self.ids, changed))
+        read = 0
+        for index, (database, seq, _, rows) in enumerate(changes):
+            self.seqs[index] = seq
+            if rows:
+                rows = numpy.concatenate(rows)
+                self.append(database, rows)
+                read += len(rows)
+        return read
+
+    def select(self, employee=None, start_date=None, end_date=None,
+               min_duration=None, max_duration=None):
+        """
+        Returns a boolean mask of the tasks by 'employee', created from
+        'start_date' through 'end_date', that took from 'min_duration' to
+        'max_duration' minutes.  Criteria left as None match every task.
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        if employee is not None:
+            if employee not in self.numbers:
+                return numpy.zeros(len(self), dtype=bool)
+            mask &= self.employees == self.numbers[employee]
+        if start_date is not None:
+            mask &= self.days >= day_number(start_date)
+        if end_date is not None:
+            mask &= self.days <= day_number(end_date)
+        if min_duration is not None:
+            mask &= self.durations >= min_duration
+        if max_duration is not None:
+            mask &= self.durations <= max_duration
+        return mask
+
+    def summary(self, mask=None, percentiles=PERCENTILES):
+        """
+        Returns the number of tasks, total and mean minutes, and the
+        given duration percentiles of the tasks selected by 'mask', or of
+        every task.  The mean and percentiles are None with no tasks.
+        """
+        durations = self.durations if mask is None else self.durations[mask]
+        count = len(durations)
+        return {
+            'tasks': count,
+            'minutes': int(durations.sum()),
+            'mean': float(durations.mean()) if count else None,
+            'percentiles': dict(zip(percentiles, (
+                numpy.percentile(durations, percentiles).tolist()
+                if count else [None] * len(percentiles)))),
+        }
+
+    def by_employee(self, mask=None):
+        """
+        Yields (employee name, tasks, minutes) for each employee with
+        tasks selected by 'mask', or with any tasks, ordered by name.
+        """
+        employees = self.employees if mask is None else self.employees[mask]
+        durations = self.durations if mask is None else self.durations[mask]
+        tasks = numpy.bincount(employees, minlength=len(self.names))
+        minutes = numpy.bincount(employees, weights=durations,
+                                 minlength=len(self.names))
+        for number in sorted(numpy.flatnonzero(tasks),
+                             key=lambda number: self.names[number]):
+            yield (self.names[number], int(tasks[number]),
+                   int(minutes[number]))
+
+    def strings(self, field, mask):
+        """
+        Returns the 'field' (Task.title or Task.notes) of each task
+        selected by 'mask', in snapshot order, read from the database.
+        """
+        found = {}
+        sources = self.sources[mask]
+        ids = self.ids[mask]
+        for index in numpy.unique(sources):
+            path = self.paths[index]
+            database = (DATABASE if path == DATABASE.database
+                        else partitions.DATABASES[path])
+            for chunk in chunks(ids[sources == index].tolist()):
+                found.update(Task.select(Task.id, field)
+                             .where(Task.id.in_(chunk))
+                             .bind(database).tuples())
+        return [found.get(int(task_id)) for task_id in ids]
+
+    def titles(self, mask):
+        """Returns the titles of the tasks selected by 'mask'."""
+        return self.strings(Task.title, mask)
+
+    def notes(self, mask):
+        """Returns the notes of the tasks selected by 'mask'."""
+        return self.strings(Task.notes, mask)
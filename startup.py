@@ -0,0 +1,88 @@
+"""
+What the work log needs to show its first menu, without importing peewee.
+
+Importing peewee and the models takes longer than the rest of startup
+put together, and the main menu only needs to know whether the schema is
+current and whether there are any tasks.  Both are read here with the
+standard library's sqlite3, and the modules that need peewee stand in as
+LazyModules until a menu option or command first uses them.
+"""
+import importlib
+import os
+import sqlite3
+
+from migrations import SCHEMA_VERSION
+
+
+# The database file used when none is given on the command line.
+DATABASE_FILE = 'work_log.db'
+
+# Functions closing what the loaded modules opened.  Each module adds its
+# own as it loads, so ending the program imports nothing just to close it.
+CLOSERS = []
+
+
+class LazyModule:
+    """
+    Stands in for the module called 'name', importing it the first time
+    one of its attributes is used.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(importlib.import_module(self.name), attribute)
+
+
+def on_teardown(func):
+    """
+    Has teardown() call 'func' before the functions added earlier, and
+    returns it, so a module can decorate its close function.
+    """
+    CLOSERS.append(func)
+    return func
+
+
+def teardown():
+    """
+    Calls every function given to on_teardown(), latest first, so each
+    module is closed before the modules it uses.
+    """
+    for func in reversed(CLOSERS):
+        func()
+
+
+def partition_path(path, name):
+    """
+    Returns the path of the partition file called 'name' of the work log
+    at 'path': work_log.2024.db for the 2024 partition of work_log.db.
+    """
+    root, extension = os.path.splitext(path)
+    return '{}.{}{}'.format(root, name, extension or '.db')
+
+
+def read(path, sql):
+    """Runs one statement on the database at 'path' and returns its rows."""
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(sql).fetchall()
+    finally:
+        connection.close()
+
+
+def schema_is_current(path):
+    """Tells whether the database at 'path' needs no migrations."""
+    return read(path, 'PRAGMA user_version')[0][0] == SCHEMA_VERSION
+
+
+def task_count(path):
+    """
+    Returns the number of tasks in an up to date database at 'path',
+    including any partition files.
+    """
+    count = sum(value for value, in read(
+        path, "SELECT value FROM task_stats WHERE name = 'tasks'"))
+    for name, in read(path, 'SELECT name FROM partition'):
+        count += task_count(partition_path(path, name))
+    return count
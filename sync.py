@@ -0,0 +1,267 @@
+"""
+Two-way sync between two work log files, such as a laptop's copy used
+offline and the office's.
+
+Tasks are matched by uuid, since each file numbers its tasks itself.
+Every work log has a replica_id, and its sync_peer table records, for
+each work log it has synced with, the seq of the last change read from
+that log's change log.  A sync reads only the changes made on each side
+since then, so its cost follows the number of changes rather than the
+number of tasks.  The first sync between two files, or one after a file
+was replaced, also compares the updated_at of every task.
+
+For every task the changes name, the two files' copies are compared:
+
+- changed on one side only, that side's copy wins;
+- changed on both sides, a conflict, the copy edited or deleted last
+  wins, by updated_at or the time of the delete.  Ties go to an edit
+  over a delete, and then to the greater field values, so both files
+  settle on the same copy whichever of them runs the sync.
+
+The winner is written to the other file with its updated_at.  Reading
+and writing happen in one transaction on each file, and the positions
+saved are those after the sync's own writes, so the tasks it copied
+aren't read back as changes on the next sync.  A sync cut short saves
+nothing and is simply repeated.
+
+Partitioned and archived work logs can't be synced, since moving tasks
+between their files would look like deleting them.
+"""
+import collections
+import os
+
+from peewee import SqliteDatabase
+
+from changes import chunks, last_change
+from task import (DATABASE, PROFILES, Employee, Partition, Setting, Task,
+                  TaskChange, SyncPeer, Unindexed, new_uuid)
+import task
+import migrations
+import partitions
+
+
+PARTITIONED = "{} is partitioned or archived, so it can't be synced."
+
+Result = collections.namedtuple('Result', 'sent received conflicts')
+Result.__doc__ = """
+The number of tasks a sync wrote to the other file and to this one, and
+how many of them both files had changed.
+"""
+
+
+def replica_id(database):
+    """Returns the replica_id setting of 'database'."""
+    return (Setting.select(Setting.value)
+            .where(Setting.name == 'replica_id')
+            .bind(database).scalar())
+
+
+def check_syncable(database):
+    """Raises ValueError if 'database' is partitioned or archived."""
+    if (Setting.select().where(Setting.name == 'partition_period')
+            .bind(database).exists() or
+            Partition.select().bind(database).exists()):
+        raise ValueError(PARTITIONED.format(database.database))
+
+
+def seen(database, peer, last):
+    """
+    Returns the seq of the last change 'database' read from the log of
+    'peer', which now ends at seq 'last'.  Returns None if it never
+    synced with 'peer', or read past 'last', since then the peer's file
+    was replaced, such as from a backup.
+    """
+    since = (SyncPeer.select(SyncPeer.seen)
+             .where(SyncPeer.replica_id == peer)
+             .bind(database).scalar())
+    return since if since is not None and since <= last else None
+
+
+def changed(database, since):
+    """
+    Returns the uuids of the tasks changed in 'database' after seq
+    'since', with the time each deleted one was deleted.  Changes to a
+    task still there are found by its id, since a task added by another
+    program has its uuid filled in after its insert is logged.  When
+    'since' is None, only the tasks the whole log says were deleted are
+    returned, for differing() finds the rest.
+    """
+    changes = (TaskChange.select(TaskChange.task_id, TaskChange.op,
+                                 TaskChange.uuid, TaskChange.at)
+               .where(TaskChange.seq > (since or 0))
+               .order_by(TaskChange.seq))
+    if since is None:
+        changes = changes.where(TaskChange.op == 'delete')
+    ids = set()
+    deleted = {}
+    for task_id, op, uuid, at in changes.bind(database).tuples().iterator():
+        if op == 'delete':
+            if uuid is not None:
+                deleted[uuid] = at
+        else:
+            ids.add(task_id)
+    uuids = set(deleted)
+    for chunk in chunks(ids):
+        uuids.update(uuid for uuid, in Task.select(Task.uuid)
+                     .where(Task.id.in_(chunk))
+                     .bind(database).tuples())
+    return uuids, deleted
+
+
+def versions(database):
+    """
+    Returns a cursor over the (uuid, updated_at) of every task in uuid
+    order.  Sorting reads the table once, where the uuid index would
+    look up every task's row.
+    """
+    return database.execute_sql(*Task.select(Task.uuid, Task.updated_at)
+                                .order_by(Unindexed(Task.uuid))
+                                .bind(database).sql())
+
+
+def differing(database, other):
+    """
+    Yields the uuid of each task the two files don't hold the same
+    version of, going through both in uuid order together.
+    """
+    mine, theirs = versions(database), versions(other)
+    my_version, their_version = next(mine, None), next(theirs, None)
+    while my_version is not None or their_version is not None:
+        if their_version is None or (my_version is not None and
+                                     my_version[0] < their_version[0]):
+            yield my_version[0]
+            my_version = next(mine, None)
+        elif my_version is None or their_version[0] < my_version[0]:
+            yield their_version[0]
+            their_version = next(theirs, None)
+        else:
+            if my_version != their_version:
+                yield my_version[0]
+            my_version, their_version = next(mine, None), next(theirs, None)
+
+
+def copies(database, uuids, deleted):
+    """
+    Returns each of the tasks with 'uuids' in 'database' as a tuple of
+    (updated_at, is not deleted, employee, duration, title, notes,
+    created_at), the order conflicts are settled by.  Deleted tasks are
+    (time deleted, False) and tasks never in the file are left out.
+    """
+    found = {uuid: (at, False) for uuid, at in deleted.items()
+             if uuid in uuids}
+    for chunk in chunks(uuids):
+        for row in (Task.select(Task.uuid, Task.updated_at, Employee.name,
+                                Task.duration, Task.title, Task.notes,
+                                Task.created_at)
+                    .join(Employee)
+                    .where(Task.uuid.in_(chunk))
+                    .bind(database).tuples()):
+            found[row[0]] = (row[1], True) + row[2:]
+    return found
+
+
+def order(copy):
+    """Sorts the copies of a task both files changed, the winner last."""
+    # Deleted copies have no fields, so compare them as empty.
+    return copy[:2] + tuple('' if value is None else str(value)
+                            for value in copy[2:])
+
+
+def settled(copy, target):
+    """
+    Tells whether the copy of a task in one file, 'target', is already
+    'copy': the same, or both deleted or never there.
+    """
+    if copy is None or not copy[1]:
+        return target is None or not target[1]
+    return copy == target
+
+
+def write(database, uuid, copy):
+    """Makes the task with 'uuid' in 'database' the given copy."""
+    if not copy[1]:
+        return (Task.delete().where(Task.uuid == uuid)
+                .bind(database).execute())
+    updated_at, _, employee, duration, title, notes, created_at = copy
+    fields = {'employee': partitions.employee_id(database, employee),
+              'duration': duration, 'title': title, 'notes': notes,
+              'created_at': created_at, 'updated_at': updated_at}
+    if not (Task.update(**fields).where(Task.uuid == uuid)
+            .bind(database).execute()):
+        Task.insert(uuid=uuid, **fields).bind(database).execute()
+    return 1
+
+
+def open_peer(path):
+    """
+    Opens the work log at 'path', creating it if there is none, and
+    brings its schema up to date.  A copy of this work log's file is
+    given a replica_id of its own.
+    """
+    other = SqliteDatabase(path, pragmas=PROFILES[task.PROFILE])
+    migrations.migrate(other)
+    if replica_id(other) == replica_id(DATABASE):
+        (Setting.update(value=new_uuid())
+         .where(Setting.name == 'replica_id')
+         .bind(other).execute())
+    return other
+
+
+def sync(path):
+    """
+    Syncs the work log with the work log file at 'path' both ways, and
+    returns a Result.  Raises ValueError if either can't be synced.
+    """
+    if os.path.abspath(path) == os.path.abspath(DATABASE.database):
+        raise ValueError("A work log can't be synced with itself.")
+    check_syncable(DATABASE)
+    other = open_peer(path)
+    try:
+        check_syncable(other)
+        return exchange(other)
+    finally:
+        other.close()
+
+
+def exchange(other):
+    """Copies the tasks changed since the last sync between the files."""
+    sent = received = conflicts = 0
+    with DATABASE.atomic(lock_type='IMMEDIATE'), \
+            other.atomic(lock_type='IMMEDIATE'):
+        mine_id, their_id = replica_id(DATABASE), replica_id(other)
+        mine_since = seen(other, mine_id, last_change(DATABASE))
+        their_since = seen(DATABASE, their_id, last_change(other))
+        mine_changed, mine_deleted = changed(DATABASE, mine_since)
+        their_changed, their_deleted = changed(other, their_since)
+        if mine_since is None or their_since is None:
+            # Any task the files hold different versions of may have
+            # changed on either side.
+            different = set(differing(DATABASE, other))
+            mine_changed |= different
+            their_changed |= different
+        uuids = mine_changed | their_changed
+        mine = copies(DATABASE, uuids, mine_deleted)
+        theirs = copies(other, uuids, their_deleted)
+        for uuid in sorted(uuids):
+            my_copy, their_copy = mine.get(uuid), theirs.get(uuid)
+            if uuid not in their_changed:
+                copy = my_copy
+            elif uuid not in mine_changed:
+                copy = their_copy
+            elif my_copy is None or their_copy is None:
+                copy = my_copy or their_copy
+            else:
+                copy = max(my_copy, their_copy, key=order)
+                if not settled(my_copy, their_copy):
+                    conflicts += 1
+            if not settled(copy, my_copy):
+                received += write(DATABASE, uuid, copy)
+            if not settled(copy, their_copy):
+                sent += write(other, uuid, copy)
+        # Both files are locked, so every change past the positions read
+        # above was written by this sync.
+        for database, peer, log in [(DATABASE, their_id, other),
+                                    (other, mine_id, DATABASE)]:
+            (SyncPeer.insert(replica_id=peer, seen=last_change(log))
+             .on_conflict_replace().bind(database).execute())
+    return Result(sent, received, conflicts)
@@ -1,17 +1,296 @@
 import datetime
+import functools
+import random
+import time
+import uuid
 
 from peewee import *
+from peewee import WrappedNode
+from playhouse.sqlite_ext import FTS5Model, RowIDField, SearchField
 
+from startup import DATABASE_FILE, on_teardown
 
-DATABASE = SqliteDatabase('work_log.db')
+
+# Connection profiles, as PRAGMA settings applied to every connection.
+# 'wal' lets readers keep reading while someone writes, for a work log
+# shared by several people.  'rollback' keeps SQLite's default journal,
+# for file systems that can't share WAL memory such as network drives.
+PROFILES = {
+    'wal': [
+        ('journal_mode', 'wal'),
+        ('synchronous', 'normal'),
+        ('cache_size', -64 * 1024),
+        ('mmap_size', 256 * 1024 * 1024),
+        ('busy_timeout', 5000),
+    ],
+    'rollback': [
+        ('journal_mode', 'delete'),
+        ('synchronous', 'full'),
+        ('busy_timeout', 5000),
+    ],
+}
+
+DEFAULT_PROFILE = 'wal'
+
+DATABASE = SqliteDatabase(DATABASE_FILE, pragmas=PROFILES[DEFAULT_PROFILE])
+on_teardown(DATABASE.close)
+
+# The profile DATABASE was configured with, which partition files share.
+PROFILE = DEFAULT_PROFILE
+
+# Tries, and the first delay in seconds, for writes that find the
+# database locked even after waiting out busy_timeout.
+RETRY_ATTEMPTS = 5
+RETRY_DELAY = 0.05
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def configure(path=None, profile=DEFAULT_PROFILE):
+    """
+    Points DATABASE at the file at 'path', or keeps the current file,
+    using the named connection profile.
+    """
+    global PROFILE
+    PROFILE = profile
+    DATABASE.init(path or DATABASE.database, pragmas=PROFILES[profile])
+
+
+def is_busy(error):
+    """Tells whether an OperationalError means another writer holds a lock."""
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def retry_on_busy(func):
+    """
+    Retries 'func' with jittered exponential backoff while the database is
+    locked by another writer.  Calls inside an open transaction aren't
+    retried, since the transaction around them has to start over instead.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if (not is_busy(error) or DATABASE.in_transaction()
+                        or attempt == RETRY_ATTEMPTS - 1):
+                    raise
+            time.sleep(RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
+
+
+def new_uuid():
+    return uuid.uuid4().hex
+
+
+def now_micros():
+    """Returns the time in microseconds since the epoch, UTC."""
+    return time.time_ns() // 1000
+
+
+def day_number(date):
+    """Returns the number of days from the epoch to 'date'."""
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return (date - EPOCH).days
+
+
+class Unindexed(WrappedNode):
+    """
+    A column written as +column, which SQLite can't use an index for.
+    Values compared with it are still converted by the column's field.
+    """
+
+    def __sql__(self, ctx):
+        return ctx.literal('+').sql(self.node)
+
+
+class Employee(Model):
+    """
+    An employee who completes tasks.  task_count is maintained by
+    triggers created by the schema migrations.
+    """
+    name = CharField(max_length=60, unique=True)
+    task_count = IntegerField(default=0)
+
+    class Meta:
+        database = DATABASE
+
+    @classmethod
+    def named(cls, name):
+        """Returns the employee with the given name, creating them if
+        needed."""
+        employee, _ = cls.get_or_create(name=name)
+        return employee
 
 
 class Task(Model):
-    employee = CharField(max_length=60)
-    duration = IntegerField()
+    employee = ForeignKeyField(Employee, column_name='employee_id',
+                               backref='tasks')
+    duration = IntegerField(index=True)
     title = CharField(max_length=140)
     notes = TextField()
-    created_at = DateTimeField(default=datetime.datetime.now)
+    # Naive local times, stored as microseconds since the epoch as if they
+    # were UTC, so conversion never depends on the time zone.
+    created_at = TimestampField(resolution=10**6, utc=True,
+                                default=datetime.datetime.now, index=True)
+    # Days since the epoch of created_at.  A generated column that SQLite
+    # computes, so it is never written.
+    day = IntegerField(index=True)
+    # Identifies the task in every work log it is synced to.
+    uuid = CharField(max_length=32, unique=True, default=new_uuid)
+    # When the task was added or last edited, as now_micros().  Triggers
+    # keep it current on edits that don't set it.
+    updated_at = BigIntegerField(default=now_micros)
+
+    class Meta:
+        database = DATABASE
+        indexes = (
+            (('employee', 'created_at'), False),
+        )
+
+
+class DurationRollup(Model):
+    """
+    Total minutes and number of tasks per employee for each day, week
+    (starting on Monday) and month.  start_day is the first day of the
+    period in days since the epoch.  Maintained by triggers created by
+    the schema migrations.
+    """
+    employee = ForeignKeyField(Employee, column_name='employee_id')
+    period = CharField(max_length=5)
+    start_day = IntegerField()
+    minutes = IntegerField()
+    tasks = IntegerField()
+
+    class Meta:
+        database = DATABASE
+        table_name = 'duration_rollup'
+        primary_key = CompositeKey('employee', 'period', 'start_day')
+
+
+class TaskStats(Model):
+    """
+    Running totals over the task table, maintained by triggers created by
+    the schema migrations.  The 'tasks' row holds the total task count.
+    """
+    name = CharField(primary_key=True)
+    value = IntegerField(default=0)
+
+    class Meta:
+        database = DATABASE
+        table_name = 'task_stats'
+
+    @classmethod
+    def task_count(cls):
+        """Returns the total number of tasks without counting the table."""
+        return (cls.select(cls.value)
+                .where(cls.name == 'tasks')
+                .scalar()) or 0
+
+
+class TaskIndex(FTS5Model):
+    """
+    FTS5 full-text index over task titles and notes.
+
+    The table uses the task table as external content and is kept in sync
+    by triggers, both created by the schema migrations.
+    """
+    rowid = RowIDField()
+    title = SearchField()
+    notes = SearchField()
+
+    class Meta:
+        database = DATABASE
+        table_name = 'task_fts'
+
+
+class EmployeeIndex(FTS5Model):
+    """
+    FTS5 trigram index over employee names, used for substring and
+    typo-tolerant name lookups.  Kept in sync with the employee table by
+    triggers created by the schema migrations.
+    """
+    rowid = RowIDField()
+    name = SearchField()
+
+    class Meta:
+        database = DATABASE
+        table_name = 'employee_fts'
+
+
+class EmployeeTrigram(Model):
+    """
+    Read-only fts5vocab view of the employee name index, giving the
+    number of employee names that contain each trigram.
+    """
+    term = TextField(primary_key=True)
+    doc = IntegerField()
+    cnt = IntegerField()
+
+    class Meta:
+        database = DATABASE
+        table_name = 'employee_fts_vocab'
+
+
+class Setting(Model):
+    """A named setting stored with the work log."""
+    name = CharField(primary_key=True)
+    value = TextField()
+
+    class Meta:
+        database = DATABASE
+
+    @classmethod
+    def value_of(cls, name, default=None):
+        """Returns the value of the named setting, or 'default'."""
+        value = cls.select(cls.value).where(cls.name == name).scalar()
+        return default if value is None else value
+
+
+class Partition(Model):
+    """
+    A partition file of a partitioned work log, holding the tasks created
+    from first_day through last_day, in days since the epoch.
+    """
+    name = CharField(max_length=7, primary_key=True)
+    first_day = IntegerField()
+    last_day = IntegerField()
+
+    class Meta:
+        database = DATABASE
+
+
+class TaskChange(Model):
+    """
+    The change log: one row for each task added, edited or deleted, in
+    order of seq, written by triggers created by the schema migrations.
+    op is 'insert', 'update' or 'delete', and fields a JSON object of the
+    fields an insert or update set, with the employee by name.  at is
+    when the change was made, as now_micros().
+    """
+    seq = AutoField()
+    task_id = IntegerField()
+    op = CharField(max_length=6)
+    fields = TextField(null=True)
+    uuid = CharField(max_length=32, null=True)
+    at = BigIntegerField(null=True)
+
+    class Meta:
+        database = DATABASE
+        table_name = 'task_change'
+
+
+class SyncPeer(Model):
+    """
+    Another work log this one has synced with, by its replica_id setting,
+    and the seq of the last change in its change log synced from it.
+    """
+    replica_id = CharField(primary_key=True)
+    seen = IntegerField()
 
     class Meta:
         database = DATABASE
+        table_name = 'sync_peer'
@@ -1,10 +1,120 @@
+import asyncio
+import collections
 import datetime
+import glob
+import gzip
+import http.client
+import io
+import json
+import multiprocessing
 import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch
 
-from task import Task, DATABASE
+from peewee import OperationalError, SqliteDatabase
+
+from task import (DATABASE, PROFILES, DurationRollup, Employee, Task,
+                  TaskStats, configure)
+import api
+import archive
+from benchmarks import compare, generate
+from benchmarks import startup as startup_benchmark
+import changes
+import exporter
+import federation
+import group_commit
+import importer
+import instrumentation
+import migrations
+import paging
+import partitions
+import planner
+import reports
+import search
+import search_cache
+import startup
+import sync
+try:
+    import snapshot
+except ImportError:
+    snapshot = None
 import work_log_database
+import writes
+
+
+def setUpModule():
+    work_log_database.initialize()
+
+
+def write_tasks(path, employee, count):
+    """Adds 'count' tasks to the database at 'path' from its own process"""
+    configure(path)
+    for number in range(count):
+        writes.add_task(employee, number + 1, 'Task {}'.format(number), '')
+    DATABASE.close()
+
+
+def read_tasks(path, count):
+    """Runs 'count' keyword searches on the database at 'path'"""
+    configure(path)
+    for _ in range(count):
+        list(search.tasks_by_keyword('task'))
+        list(search.tasks_by_duration(1))
+    DATABASE.close()
+
+
+class WorkLogFileTests(unittest.TestCase):
+    """
+    Runs each test on a new work log file, 'path', in a temporary
+    directory, going back to work_log.db afterwards.  A group commit
+    writer left running is stopped first, so its queued writes land in
+    the test's file.
+    """
+
+    # Name of the work log file in the temporary directory.
+    file_name = 'work_log.db'
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, self.file_name)
+        self.use(self.path)
+
+    def tearDown(self):
+        writes.stop_group_commit()
+        partitions.close()
+        DATABASE.close()
+        configure('work_log.db')
+        self.directory.cleanup()
+
+    def use(self, path):
+        """Points DATABASE at the work log at 'path', upgrading it"""
+        partitions.close()
+        DATABASE.close()
+        configure(path)
+        migrations.migrate(DATABASE)
+
+    def add_tasks(self):
+        """Adds four tasks either side of New Year 2024 and returns them"""
+        return [
+            writes.add_task('Marty Mcfly', 30, 'Hoverboard', 'flux',
+                            datetime.datetime(2023, 12, 30, 9)),
+            writes.add_task('Doc Brown', 15, 'Flux capacitor', 'flux',
+                            datetime.datetime(2023, 12, 31, 9)),
+            writes.add_task('Marty Mcfly', 10, 'Guitar', 'Johnny B',
+                            datetime.datetime(2024, 1, 1, 9)),
+            writes.add_task('Marty Mcfly', 5, 'Almanac', 'flux',
+                            datetime.datetime(2024, 3, 2, 9)),
+        ]
+
+    def ids(self, tasks):
+        return [task.id for task in tasks]
 
 
 class TaskTests(unittest.TestCase):
@@ -18,12 +128,12 @@ class TaskTests(unittest.TestCase):
         title = "Test Task Title"
         notes = "Test Notes"
 
-        Task.create(employee=employee,
+        Task.create(employee=Employee.named(employee),
                     duration=duration,
                     title=title,
                     notes=notes)
         latest = Task.select().order_by(Task.id.desc()).get()
-        self.assertEqual(employee, latest.employee)
+        self.assertEqual(employee, latest.employee.name)
         self.assertEqual(duration, latest.duration)
         self.assertEqual(title, latest.title)
         self.assertEqual(notes, latest.notes)
@@ -50,7 +160,7 @@ class WorkLogTests(unittest.TestCase):
 
     def add_task(self, employee, duration, title, notes):
         Task.create(
-            employee=employee,
+            employee=Employee.named(employee),
             duration=duration,
             title=title,
             notes=notes,
@@ -68,9 +178,49 @@ class WorkLogTests(unittest.TestCase):
         work_log_database.initialize()
         self.assertTrue(os.path.isfile('work_log.db'))
 
+    def test_db_migrations(self):
+        """
+        Tests that initialize brings the schema up to the latest version
+        and creates the search indexes
+        """
+        DATABASE.close()
+        work_log_database.initialize()
+        self.assertEqual(migrations.schema_version(DATABASE),
+                         migrations.SCHEMA_VERSION)
+        indexes = [index.name for index in DATABASE.get_indexes('task')]
+        for name in ['task_employee_id', 'task_duration', 'task_created_at',
+                     'task_employee_id_created_at']:
+            self.assertIn(name, indexes)
+
     def test_db_teardown(self):
         work_log_database.teardown()
 
+    def test_task_counters(self):
+        """
+        Tests that the total and per-employee task counts follow inserts,
+        employee changes and deletes
+        """
+        self.delete_all_tasks()
+        self.assertEqual(0, TaskStats.task_count())
+        self.add_task(self.employee, self.duration, self.title, self.notes)
+        self.add_task(self.employee, self.duration, self.title, self.notes)
+        task = Task.create(employee=Employee.named(self.similar_employee),
+                           duration=self.duration,
+                           title=self.title,
+                           notes=self.notes)
+        self.assertEqual(3, TaskStats.task_count())
+        employee = Employee.named(self.employee)
+        similar_employee = Employee.named(self.similar_employee)
+        self.assertEqual((2, 1), (employee.task_count,
+                                  similar_employee.task_count))
+        Task.set_by_id(task.id, {'employee': employee})
+        self.assertEqual((3, 0), (Employee.named(self.employee).task_count,
+                                  Employee.named(
+                                      self.similar_employee).task_count))
+        self.delete_all_tasks()
+        self.assertEqual(0, TaskStats.task_count())
+        self.assertEqual(0, Employee.named(self.employee).task_count)
+
     @patch('builtins.input', side_effect=['v', '', 'q'])
     def test_view_empty_database(self, mock):
         """
@@ -101,7 +251,7 @@ class WorkLogTests(unittest.TestCase):
         ]
         work_log_database.add_task()
         latest = Task.select().order_by(Task.id.desc()).get()
-        self.assertEqual(self.employee, latest.employee)
+        self.assertEqual(self.employee, latest.employee.name)
         self.assertEqual(self.duration, latest.duration)
         self.assertEqual(self.title, latest.title)
         self.assertEqual(self.notes, latest.notes)
@@ -194,6 +344,24 @@ class WorkLogTests(unittest.TestCase):
         work_log_database.search_tasks()
         self.delete_all_tasks()
 
+    @patch('builtins.input', side_effect=[
+        'c', 'McTest', '20', '10', 'notes', '', 'x', '12/31/2999', '', 'b'])
+    def test_combined_search_menu(self, mock):
+        """
+        Tests the combined search asks for each criterion, skipping blank
+        ones, shows its plan and pages through what it finds
+        """
+        self.add_task(self.employee, self.duration, self.title, self.notes)
+        with patch('work_log_database.task_page_menu') as page_menu, \
+                patch('sys.stdout', new_callable=io.StringIO) as output:
+            work_log_database.search_tasks()
+        tasks, keys = page_menu.call_args[0]
+        self.assertEqual([self.title], [task.title for task in tasks])
+        self.assertIn("Using the employee and date index.",
+                      output.getvalue())
+        self.assertIn("SQLite plan:", output.getvalue())
+        self.delete_all_tasks()
+
     @patch('builtins.input', side_effect=['e', 'x', 'l', '0', 'b', 'b'])
     def test_employee_search_missing(self, mock):
         """
@@ -228,7 +396,7 @@ class WorkLogTests(unittest.TestCase):
             'b',
         ]
         Task.create(
-            employee=self.similar_employee,
+            employee=Employee.named(self.similar_employee),
             duration=self.duration,
             title=self.title,
             notes=self.notes,
@@ -246,6 +414,37 @@ class WorkLogTests(unittest.TestCase):
         work_log_database.employee_search()
         self.delete_all_tasks
 
+    @patch('builtins.input')
+    def test_employee_entry_typo(self, mock):
+        """
+        Tests that a misspelled employee name offers the closest names
+        """
+        self.add_task('Strickland', self.duration, self.title, self.notes)
+        self.add_task(self.employee, self.duration, self.title, self.notes)
+        mock.side_effect = ['e', 'Strikland', '0']
+        tasks = work_log_database.employee_search()
+        self.assertEqual(['Strickland'],
+                         [task.employee.name for task in tasks])
+        self.delete_all_tasks()
+
+    def test_employee_candidates(self):
+        """
+        Tests ranking of substring matches and skipping employees without
+        tasks
+        """
+        self.add_task('Marty Mcfly', self.duration, self.title, self.notes)
+        self.add_task('Marty Mcfly Sr', self.duration, self.title, self.notes)
+        self.add_task('Not Marty', self.duration, self.title, self.notes)
+        Employee.named('Marty Nobody')
+        self.assertEqual(['Marty Mcfly', 'Marty Mcfly Sr', 'Not Marty'],
+                         search.employee_candidates('marty'))
+        self.assertEqual(['Marty Mcfly Sr'],
+                         search.employee_candidates('Sr'))
+        self.assertEqual(['Marty Mcfly', 'Marty Mcfly Sr'],
+                         search.employee_candidates('Marty Mcfyl'))
+        self.assertEqual([], search.employee_candidates('defenestration'))
+        self.delete_all_tasks()
+
     @patch('builtins.input', side_effect=['-1', '0'])
     def test_employee_entry_invalid_index(self, mock):
         """
@@ -256,6 +455,45 @@ class WorkLogTests(unittest.TestCase):
         work_log_database.employee_from_selection(employees, '')
         self.delete_all_tasks()
 
+    @patch('builtins.input')
+    def test_keyword_search(self, mock):
+        """
+        Test keyword search ranks matches and supports prefix and phrase
+        queries
+        """
+        Task.create(employee=Employee.named('Marty Mcfly'),
+                    duration=88, title='Flux capacitor', notes='Power of Love')
+        Task.create(employee=Employee.named('Doc Brown'),
+                    duration=5, title='Lunch', notes='Power of flux')
+        mock.side_effect = ['flux']
+        tasks = work_log_database.keyword_search()
+        self.assertEqual(['Flux capacitor', 'Lunch'],
+                         [task.title for task in tasks])
+        mock.side_effect = ['capac*']
+        tasks = work_log_database.keyword_search()
+        self.assertEqual(['Flux capacitor'], [task.title for task in tasks])
+        mock.side_effect = ['"power of love"']
+        tasks = work_log_database.keyword_search()
+        self.assertEqual(['Flux capacitor'], [task.title for task in tasks])
+        self.delete_all_tasks()
+
+    @patch('builtins.input')
+    def test_keyword_search_index_sync(self, mock):
+        """
+        Test the full-text index follows task edits and deletes
+        """
+        task = Task.create(employee=Employee.named('Marty Mcfly'),
+                           duration=88, title='Back in Time',
+                           notes='Power of Love')
+        Task.set_by_id(task.id, {'title': 'Hoverboard'})
+        mock.side_effect = ['time']
+        self.assertEqual(0, len(work_log_database.keyword_search()))
+        mock.side_effect = ['hoverboard']
+        self.assertEqual(1, len(work_log_database.keyword_search()))
+        Task.delete_by_id(task.id)
+        mock.side_effect = ['hoverboard']
+        self.assertEqual(0, len(work_log_database.keyword_search()))
+
     @patch('builtins.input', return_value='10')
     def test_duration_search(self, mock):
         """
@@ -274,6 +512,28 @@ class WorkLogTests(unittest.TestCase):
         work_log_database.date_search()
         self.delete_all_tasks()
 
+    def test_date_search_whole_day(self):
+        """
+        Test that searching by date finds every task on that day, down to
+        the last microsecond, including days before the epoch
+        """
+        for created_at in [datetime.datetime(1955, 11, 5),
+                           datetime.datetime(1955, 11, 5, 23, 59, 59, 999999),
+                           datetime.datetime(1955, 11, 6),
+                           datetime.datetime(2015, 10, 21, 23, 59, 59, 5)]:
+            Task.create(employee=Employee.named(self.employee),
+                        duration=self.duration, title=self.title,
+                        notes=self.notes, created_at=created_at)
+        tasks = search.tasks_on_date(datetime.datetime(1955, 11, 5))
+        self.assertEqual(
+            [datetime.datetime(1955, 11, 5),
+             datetime.datetime(1955, 11, 5, 23, 59, 59, 999999)],
+            [task.created_at for task in tasks.order_by(Task.created_at)])
+        tasks = search.tasks_in_range(datetime.datetime(2015, 10, 21),
+                                      datetime.datetime(1955, 11, 6))
+        self.assertEqual(2, tasks.count())
+        self.delete_all_tasks()
+
     @patch('builtins.input', side_effect=['01/01/2018', '12/12/2018'])
     def test_date_range_search(self, mock):
         """
@@ -299,12 +559,12 @@ class WorkLogTests(unittest.TestCase):
         Also tests that a employee name can be edited.
         """
         Task.create(
-            employee='Marty Mcfly',
+            employee=Employee.named('Marty Mcfly'),
             duration=88,
             title='Back in Time',
             notes='Power of Love',
         )
-        tasks = Task.select().where(Task.employee == 'Marty Mcfly')
+        tasks = search.tasks_by_employee('Marty Mcfly')
         work_log_database.task_page_menu(tasks)
         self.delete_all_tasks()
 
@@ -314,12 +574,12 @@ class WorkLogTests(unittest.TestCase):
         Tests the task deletion menu
         """
         Task.create(
-            employee='Peter Parker',
+            employee=Employee.named('Peter Parker'),
             duration=8,
             title='Spiderman',
             notes='Amazing',
         )
-        tasks = Task.select().where(Task.employee == 'Peter Parker')
+        tasks = search.tasks_by_employee('Peter Parker')
         work_log_database.task_page_menu(tasks)
         self.delete_all_tasks()
 
@@ -329,39 +589,110 @@ class WorkLogTests(unittest.TestCase):
         Test task pagination
         """
         Task.create(
-            employee='Marty Mcfly',
+            employee=Employee.named('Marty Mcfly'),
             duration=88,
             title='Back in Time',
             notes='Power of Love',
         )
         Task.create(
-            employee='Marty Mcfly',
+            employee=Employee.named('Marty Mcfly'),
             duration=88,
             title='Back in Time',
             notes='Power of Love',
         )
         Task.create(
-            employee='Marty Mcfly',
+            employee=Employee.named('Marty Mcfly'),
             duration=88,
             title='Back in Time',
             notes='Power of Love',
         )
-        tasks = Task.select().where(Task.employee == 'Marty Mcfly')
+        tasks = search.tasks_by_employee('Marty Mcfly')
         work_log_database.task_page_menu(tasks)
         self.delete_all_tasks()
 
+    def test_task_pager_windows(self):
+        """
+        Test the keyset pager walks forward and back across windows
+        in date order
+        """
+        for day in [3, 1, 2, 5, 4]:
+            Task.create(
+                employee=Employee.named('Marty Mcfly'),
+                duration=88,
+                title='Day {}'.format(day),
+                notes='Power of Love',
+                created_at=datetime.datetime(2015, 10, day),
+            )
+        tasks = search.tasks_by_employee('Marty Mcfly')
+        pager = paging.TaskPager(tasks, page_size=2)
+        titles = [pager.current.title]
+        self.assertFalse(pager.has_previous)
+        while pager.has_next:
+            pager.next()
+            titles.append(pager.current.title)
+        self.assertEqual(['Day 5', 'Day 4', 'Day 3', 'Day 2', 'Day 1'],
+                         titles)
+        self.assertLessEqual(len(pager.window), 2)
+        while pager.has_previous:
+            pager.previous()
+            titles.append(pager.current.title)
+        self.assertEqual(titles[:5], list(reversed(titles[4:])))
+        self.delete_all_tasks()
+
+    @patch('builtins.input', side_effect=['flux'])
+    def test_task_pager_ranked(self, mock):
+        """
+        Test the pager keeps keyword search results in rank order
+        """
+        Task.create(employee=Employee.named('Doc Brown'),
+                    duration=5, title='Lunch', notes='Power of flux')
+        Task.create(employee=Employee.named('Marty Mcfly'),
+                    duration=88, title='Flux capacitor', notes='Power of Love')
+        tasks = work_log_database.keyword_search()
+        pager = paging.TaskPager(
+            tasks, paging.RANKED_ORDER, page_size=1)
+        self.assertEqual('Flux capacitor', pager.current.title)
+        pager.next()
+        self.assertEqual('Lunch', pager.current.title)
+        self.assertFalse(pager.has_next)
+        pager.previous()
+        self.assertEqual('Flux capacitor', pager.current.title)
+        self.delete_all_tasks()
+
+    @patch('builtins.input', side_effect=['  '])
+    def test_task_pager_blank_keyword(self, mock):
+        """
+        Test a blank keyword search pages through every task by date,
+        since it has no rank to sort by
+        """
+        Task.create(employee=Employee.named('Doc Brown'), duration=5,
+                    title='Lunch', notes='Power of flux',
+                    created_at=datetime.datetime(1985, 10, 25))
+        Task.create(employee=Employee.named('Marty Mcfly'), duration=88,
+                    title='Flux capacitor', notes='Power of Love',
+                    created_at=datetime.datetime(1985, 10, 26))
+        tasks = work_log_database.keyword_search()
+        keys = paging.order_for(tasks)
+        self.assertEqual(paging.DATE_ORDER, keys)
+        pager = paging.TaskPager(tasks, keys, page_size=1)
+        self.assertEqual('Flux capacitor', pager.current.title)
+        pager.next()
+        self.assertEqual('Lunch', pager.current.title)
+        self.assertFalse(pager.has_next)
+        self.delete_all_tasks()
+
     @patch('builtins.input', side_effect=['u', '30', ''])
     def test_edit_task_duration(self, mock):
         """
         Tests editing task duration
         """
         Task.create(
-            employee='Peter Parker',
+            employee=Employee.named('Peter Parker'),
             duration=8,
             title='Spiderman',
             notes='Amazing',
         )
-        tasks = Task.select().where(Task.employee == 'Peter Parker')
+        tasks = search.tasks_by_employee('Peter Parker')
         work_log_database.edit_task(tasks[0].id)
         self.delete_all_tasks()
 
@@ -371,12 +702,12 @@ class WorkLogTests(unittest.TestCase):
         Tests editing task title
         """
         Task.create(
-            employee='Peter Parker',
+            employee=Employee.named('Peter Parker'),
             duration=8,
             title='Spiderman',
             notes='Amazing',
         )
-        tasks = Task.select().where(Task.employee == 'Peter Parker')
+        tasks = search.tasks_by_employee('Peter Parker')
         work_log_database.edit_task(tasks[0].id)
         self.delete_all_tasks()
 
@@ -386,12 +717,12 @@ class WorkLogTests(unittest.TestCase):
         Tests editing task notes
         """
         Task.create(
-            employee='Peter Parker',
+            employee=Employee.named('Peter Parker'),
             duration=8,
             title='Spiderman',
             notes='Amazing',
         )
-        tasks = Task.select().where(Task.employee == 'Peter Parker')
+        tasks = search.tasks_by_employee('Peter Parker')
         work_log_database.edit_task(tasks[0].id)
         self.delete_all_tasks()
 
@@ -401,15 +732,1712 @@ class WorkLogTests(unittest.TestCase):
         Tests editing task creation date
         """
         Task.create(
-            employee='Peter Parker',
+            employee=Employee.named('Peter Parker'),
             duration=8,
             title='Spiderman',
             notes='Amazing',
         )
-        tasks = Task.select().where(Task.employee == 'Peter Parker')
+        tasks = search.tasks_by_employee('Peter Parker')
         work_log_database.edit_task(tasks[0].id)
         self.delete_all_tasks()
 
 
+class MigrationTests(unittest.TestCase):
+
+    def test_upgrade_original_database(self):
+        """
+        Tests upgrading a database created before schema versioning,
+        deduplicating employee names into the employee table
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            database = SqliteDatabase(os.path.join(directory, 'old.db'))
+            database.execute_sql(
+                'CREATE TABLE "task" ("id" INTEGER NOT NULL PRIMARY KEY, '
+                '"employee" VARCHAR(60) NOT NULL, '
+                '"duration" INTEGER NOT NULL, '
+                '"title" VARCHAR(140) NOT NULL, "notes" TEXT NOT NULL, '
+                '"created_at" DATETIME NOT NULL)')
+            for employee, title in [('Doc Brown', 'Flux capacitor'),
+                                    ('Marty Mcfly', 'Hoverboard'),
+                                    ('Doc Brown', 'Lunch')]:
+                database.execute_sql(
+                    'INSERT INTO "task" ("employee", "duration", "title", '
+                    '"notes", "created_at") VALUES (?, 5, ?, \'\', '
+                    '\'2015-10-21 16:29:00\')', (employee, title))
+            self.assertEqual(migrations.SCHEMA_VERSION,
+                             migrations.migrate(database))
+            self.assertEqual(
+                [('Doc Brown', 2), ('Marty Mcfly', 1)],
+                database.execute_sql(
+                    'SELECT "name", "task_count" FROM "employee" '
+                    'ORDER BY "name"').fetchall())
+            self.assertEqual(
+                [(1, 'Doc Brown'), (2, 'Marty Mcfly'), (3, 'Doc Brown')],
+                database.execute_sql(
+                    'SELECT "task"."id", "name" FROM "task" JOIN "employee" '
+                    'ON "employee"."id" = "task"."employee_id" '
+                    'ORDER BY "task"."id"').fetchall())
+            self.assertEqual(
+                (1445444940000000, 16729),
+                database.execute_sql(
+                    'SELECT "created_at", "day" FROM "task" '
+                    'WHERE "id" = 1').fetchone())
+            self.assertEqual(
+                [('day', 16729, 10, 2), ('month', 16709, 10, 2),
+                 ('week', 16727, 10, 2)],
+                database.execute_sql(
+                    'SELECT "period", "start_day", "minutes", "tasks" '
+                    'FROM "duration_rollup" WHERE "employee_id" = 1 '
+                    'ORDER BY "period"').fetchall())
+            self.assertEqual(
+                [(2,)],
+                database.execute_sql(
+                    'SELECT "rowid" FROM "task_fts" '
+                    'WHERE "task_fts" MATCH \'hoverboard\'').fetchall())
+            database.close()
+
+
+class StartupTests(unittest.TestCase):
+
+    def test_schema_version_matches_migrations(self):
+        """
+        Tests that the version checked at startup is the one the
+        migrations end at
+        """
+        self.assertEqual(startup.SCHEMA_VERSION, migrations.SCHEMA_VERSION)
+
+    def test_menu_starts_without_peewee(self):
+        """
+        Tests that the main menu comes up on a current database without
+        importing peewee, and that using it loads the models on demand
+        """
+        script = (
+            "import sys\n"
+            "import work_log_database\n"
+            "work_log_database.initialize('work_log.db')\n"
+            "print(work_log_database.task_count(), 'peewee' in sys.modules)\n"
+            "print(work_log_database.search.all_tasks().count())\n")
+        with tempfile.TemporaryDirectory() as directory:
+            configure(os.path.join(directory, 'work_log.db'))
+            try:
+                migrations.migrate(DATABASE)
+                writes.add_task('Startup', 5, 'Startup task', '')
+            finally:
+                DATABASE.close()
+                configure('work_log.db')
+            output = subprocess.run(
+                [sys.executable, '-c', script], cwd=directory, check=True,
+                capture_output=True, text=True,
+                env=dict(os.environ, PYTHONPATH=os.getcwd())).stdout
+        self.assertEqual("1 False\n1\n", output)
+
+    def test_initialize_migrates_new_database(self):
+        """
+        Tests that starting on a missing database file creates the schema
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath('work_log_database.py')],
+                cwd=directory, input='q\n', check=True,
+                capture_output=True, text=True).stdout
+            self.assertIn("WORK LOG", output)
+            self.assertTrue(startup.schema_is_current(
+                os.path.join(directory, 'work_log.db')))
+
+
+class ReportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.marty = Employee.named('Marty Mcfly')
+        self.doc = Employee.named('Doc Brown')
+        for created_at, duration in [(datetime.datetime(2015, 10, 21), 30),
+                                     (datetime.datetime(2015, 10, 21, 16), 15),
+                                     (datetime.datetime(2015, 10, 25), 10),
+                                     (datetime.datetime(2015, 11, 2), 5)]:
+            Task.create(employee=self.marty, duration=duration,
+                        title='Hoverboard', notes='',
+                        created_at=created_at)
+
+    def tearDown(self):
+        Task.delete().where(Task.id > 0).execute()
+
+    def report(self, period, employee='Marty Mcfly'):
+        return [(start.isoformat(), minutes, tasks)
+                for _, start, minutes, tasks in
+                reports.duration_report(period, employee=employee)]
+
+    def test_rollup_periods(self):
+        """
+        Tests the daily, weekly (from Monday) and monthly totals
+        """
+        self.assertEqual([('2015-10-21', 45, 2), ('2015-10-25', 10, 1),
+                          ('2015-11-02', 5, 1)], self.report('day'))
+        self.assertEqual([('2015-10-19', 55, 3), ('2015-11-02', 5, 1)],
+                         self.report('week'))
+        self.assertEqual([('2015-10-01', 55, 3), ('2015-11-01', 5, 1)],
+                         self.report('month'))
+
+    def test_rollup_follows_edits(self):
+        """
+        Tests that changing a task's duration, date and employee, and
+        deleting tasks, moves its minutes between rollups
+        """
+        task = Task.get(Task.duration == 5)
+        Task.set_by_id(task.id, {'duration': 8,
+                                 'created_at': datetime.datetime(2015, 10,
+                                                                 25)})
+        self.assertEqual([('2015-10-01', 63, 4)], self.report('month'))
+        Task.set_by_id(task.id, {'employee': self.doc})
+        self.assertEqual([('2015-10-01', 55, 3)], self.report('month'))
+        self.assertEqual([('2015-10-25', 8, 1)],
+                         self.report('day', 'Doc Brown'))
+        Task.delete_by_id(task.id)
+        self.assertEqual([], self.report('day', 'Doc Brown'))
+        self.assertFalse(DurationRollup.select().where(
+            DurationRollup.employee == self.doc).exists())
+
+    def test_report_range(self):
+        """
+        Tests limiting a report to a date range, including whole periods
+        """
+        rows = reports.duration_report('week',
+                                       datetime.datetime(2015, 10, 22),
+                                       datetime.datetime(2015, 10, 30))
+        self.assertEqual([('Marty Mcfly', datetime.date(2015, 10, 19), 55,
+                           3)], list(rows))
+
+    @patch('builtins.input', side_effect=['x', 'm', '', ''])
+    def test_report_menu(self, mock):
+        """
+        Tests the report menu
+        """
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            work_log_database.report_menu()
+        self.assertIn('10/01/2015', stdout.getvalue())
+
+
+class ImportTests(unittest.TestCase):
+
+    def tearDown(self):
+        Task.delete().where(Task.id > 0).execute()
+
+    def test_import_csv(self):
+        """
+        Tests importing tasks from CSV, reporting rows that fail validation
+        """
+        stream = io.StringIO(
+            "employee,duration,title,notes,created_at\n"
+            "Marty Mcfly,88,Back in Time,Power of Love,10/26/1985\n"
+            "Doc Brown,-5,Flux capacitor,,\n"
+            "Doc Brown,5,Lunch,,2015-10-21 16:29:00\n")
+        rejects = io.StringIO()
+        imported, rejected = importer.import_tasks(stream, 'csv', rejects)
+        self.assertEqual((2, 1), (imported, rejected))
+        self.assertIn("line 3: Duration", rejects.getvalue())
+        task = search.tasks_by_employee('Marty Mcfly').get()
+        self.assertEqual(datetime.datetime(1985, 10, 26), task.created_at)
+        self.assertEqual(2, TaskStats.task_count())
+
+    def test_import_jsonl(self):
+        """
+        Tests importing tasks from JSONL in several small transactions
+        """
+        stream = io.StringIO(
+            '{"employee": "Marty Mcfly", "duration": 88, "title": "A"}\n'
+            'not json\n'
+            '\n'
+            '{"employee": "Marty Mcfly", "duration": 88}\n'
+            '{"employee": "Doc Brown", "duration": 5, "title": "B"}\n'
+            '{"employee": "Doc Brown", "duration": 5, "title": "C"}\n')
+        rejects = io.StringIO()
+        imported, rejected = importer.import_tasks(
+            stream, 'jsonl', rejects, batch_size=1, transaction_size=2)
+        self.assertEqual((3, 2), (imported, rejected))
+        self.assertEqual("line 2: Invalid JSON",
+                         rejects.getvalue().splitlines()[0][:20])
+        self.assertIn("line 4: Missing title.", rejects.getvalue())
+        self.assertEqual(['A', 'B', 'C'],
+                         [task.title for task in
+                          Task.select().order_by(Task.id)])
+
+    def test_detect_format(self):
+        """
+        Tests guessing the import format from the file extension
+        """
+        self.assertEqual('csv', importer.detect_format('tasks.CSV'))
+        self.assertEqual('jsonl', importer.detect_format('tasks.jsonl'))
+        with self.assertRaises(ValueError):
+            importer.detect_format('tasks.xlsx')
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    def test_import_command_errors(self, stderr):
+        """
+        Tests that the import command reports a file of unknown format or
+        a missing file without a traceback
+        """
+        self.assertEqual(1, work_log_database.main(['import', 'tasks.txt']))
+        self.assertIn("--format csv", stderr.getvalue())
+        self.assertEqual(1, work_log_database.main(['import', 'missing.csv']))
+        self.assertIn("missing.csv", stderr.getvalue())
+        self.assertEqual(0, Task.select().count())
+
+
+class ExportTests(unittest.TestCase):
+
+    def setUp(self):
+        Task.create(employee=Employee.named('Marty Mcfly'), duration=88,
+                    title='Back in Time', notes='Power of Love',
+                    created_at=datetime.datetime(1985, 10, 26, 1, 21))
+        Task.create(employee=Employee.named('Doc Brown'), duration=5,
+                    title='Flux capacitor', notes='',
+                    created_at=datetime.datetime(1955, 11, 5))
+
+    def tearDown(self):
+        Task.delete().where(Task.id > 0).execute()
+
+    def test_export_csv(self):
+        """
+        Tests exporting a search result to CSV
+        """
+        stream = io.StringIO()
+        count = exporter.export_tasks(search.tasks_by_employee('Doc Brown'),
+                                      stream, 'csv')
+        self.assertEqual(1, count)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual('id,employee,duration,title,notes,created_at',
+                         lines[0])
+        self.assertTrue(lines[1].endswith(
+            ',Doc Brown,5,Flux capacitor,,1955-11-05 00:00:00'))
+
+    def test_export_gzip_round_trip(self):
+        """
+        Tests that a gzipped JSONL export can be imported again
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tasks.jsonl.gz')
+            self.assertEqual(2, exporter.export_file(search.all_tasks(),
+                                                     path, 'jsonl'))
+            with gzip.open(path, 'rt') as stream:
+                records = [json.loads(line) for line in stream]
+            self.assertEqual('1985-10-26 01:21:00',
+                             records[0]['created_at'])
+            self.assertEqual((2, 0), importer.import_file(path))
+        self.assertEqual(
+            2, search.tasks_by_employee('Marty Mcfly').count())
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_export_command(self, stdout):
+        """
+        Tests the export command with a keyword search
+        """
+        DATABASE.close()
+        work_log_database.main(['export', '--keyword', 'flux'])
+        records = [json.loads(line)
+                   for line in stdout.getvalue().splitlines()]
+        self.assertEqual(['Flux capacitor'],
+                         [record['title'] for record in records])
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    def test_export_command_errors(self, stderr):
+        """
+        Tests that the export command reports an output file of unknown
+        format or one it can't write without a traceback
+        """
+        DATABASE.close()
+        self.assertEqual(1, work_log_database.main(
+            ['export', '-o', 'out.txt']))
+        self.assertIn("--format csv", stderr.getvalue())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'missing', 'tasks.csv')
+            self.assertEqual(1, work_log_database.main(
+                ['export', '-o', path]))
+        self.assertIn(path, stderr.getvalue())
+        self.assertFalse(os.path.exists('out.txt'))
+
+
+class ConcurrencyTests(unittest.TestCase):
+
+    def test_readers_never_block_writers(self):
+        """
+        Tests that writer processes all finish while another connection
+        holds a read transaction open and reader processes search
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'shared.db')
+            database = SqliteDatabase(path, pragmas=PROFILES['wal'])
+            migrations.migrate(database)
+            count = 'SELECT COUNT(*) FROM "task"'
+            database.execute_sql('BEGIN')
+            self.assertEqual(0, database.execute_sql(count).fetchone()[0])
+
+            context = multiprocessing.get_context('spawn')
+            processes = (
+                [context.Process(target=write_tasks,
+                                 args=(path, 'Writer {}'.format(number), 50))
+                 for number in range(4)] +
+                [context.Process(target=read_tasks, args=(path, 20))
+                 for _ in range(2)])
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join(timeout=120)
+            self.assertEqual([0] * len(processes),
+                             [process.exitcode for process in processes])
+
+            # The open read transaction still sees its own snapshot.
+            self.assertEqual(0, database.execute_sql(count).fetchone()[0])
+            database.execute_sql('COMMIT')
+            self.assertEqual(200, database.execute_sql(count).fetchone()[0])
+            self.assertEqual(
+                [50] * 4,
+                [row[0] for row in database.execute_sql(
+                    'SELECT "task_count" FROM "employee"')])
+            self.assertEqual(
+                'wal',
+                database.execute_sql('PRAGMA journal_mode').fetchone()[0])
+            database.close()
+
+
+class GroupCommitTests(WorkLogFileTests):
+
+    file_name = 'group.db'
+
+    def test_concurrent_writes_share_commits(self):
+        """
+        Tests that adds from many threads are committed together and
+        acknowledged once written
+        """
+        writes.start_group_commit(interval=0.05)
+
+        def add_tasks(number):
+            for op in range(10):
+                writes.add_task('Writer {}'.format(number), op + 1,
+                                'Task {}'.format(op), '')
+            DATABASE.close()
+
+        threads = [threading.Thread(target=add_tasks, args=(number,))
+                   for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(80, writes.WRITER.operations)
+        self.assertLess(writes.WRITER.commits, 80)
+        self.assertEqual(80, Task.select().count())
+        self.assertEqual([10] * 8, [employee.task_count
+                                    for employee in Employee.select()])
+
+    def test_failed_write_leaves_batch(self):
+        """
+        Tests that a write that raises is reported to its caller without
+        undoing the rest of its batch
+        """
+        writer = group_commit.GroupCommitWriter(interval=0.05)
+
+        def fail():
+            writes._create('Doc Brown', 5, 'Half done', '', None)
+            raise ValueError("Out of plutonium")
+
+        first = writer.submit(writes._create, 'Marty Mcfly', 5,
+                              'Hoverboard', '', None)
+        failed = writer.submit(fail)
+        last = writer.submit(writes._create, 'Marty Mcfly', 10,
+                             'Skateboard', '', None)
+        writer.close()
+        self.assertEqual('Hoverboard', first.result().title)
+        self.assertRaises(ValueError, failed.result)
+        self.assertEqual('Skateboard', last.result().title)
+        self.assertEqual(1, writer.commits)
+        self.assertEqual(['Hoverboard', 'Skateboard'],
+                         [task.title for task in
+                          Task.select().order_by(Task.id)])
+
+    def test_teardown_flushes_queued_writes(self):
+        """
+        Tests that writes still queued when the program ends are committed
+        """
+        writes.start_group_commit(interval=1)
+        futures = [writes.WRITER.submit(writes._create, 'Doc Brown', 5,
+                                        'Task {}'.format(number), '', None)
+                   for number in range(3)]
+        work_log_database.teardown()
+        self.assertIsNone(writes.WRITER)
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(3, Task.select().count())
+
+
+class PartitionTests(WorkLogFileTests):
+
+    file_name = 'parts.db'
+
+    def setUp(self):
+        super().setUp()
+        self.tasks = self.add_tasks()
+        self.moved = partitions.partition_by('year')
+
+    def test_retried_edit_reassigns_once(self):
+        """
+        Tests that an edit retried after a partition was locked still
+        reassigns the task to the employee named
+        """
+        update = Task.update
+        attempts = []
+
+        def locked_once(**fields):
+            attempts.append(fields)
+            if len(attempts) == 1:
+                raise OperationalError('database is locked')
+            return update(**fields)
+        with patch.object(Task, 'update', side_effect=locked_once):
+            writes.update_task(self.tasks[2].id, {'employee': 'Doc Brown'})
+        self.assertEqual(2, len(attempts))
+        self.assertEqual(attempts[0], attempts[1])
+        self.assertEqual(
+            ['Doc Brown'],
+            [task.employee.name for task in search.tasks_by_employee(
+                'Doc Brown') if task.id == self.tasks[2].id])
+
+    def test_tasks_moved_to_partitions(self):
+        """
+        Tests that partitioning moves every task, with its id, into the
+        file for its year and leaves the main file's task table empty
+        """
+        self.assertEqual(4, self.moved)
+        self.assertEqual(['2023', '2024'], partitions.partitions())
+        self.assertTrue(os.path.isfile(os.path.join(self.directory.name,
+                                                    'parts.2024.db')))
+        self.assertEqual(0, Task.select().count())
+        self.assertEqual(4, partitions.task_count())
+        self.assertEqual(4, startup.task_count(self.path))
+        self.assertEqual(self.ids(self.tasks[::-1]),
+                         self.ids(paging.TaskPager(search.all_tasks(),
+                                                   page_size=2).window +
+                                  [task for task in paging.page_query(
+                                      search.all_tasks(), paging.DATE_ORDER,
+                                      self.tasks[2])]))
+
+    def test_range_search_prunes_partitions(self):
+        """
+        Tests that date searches only read the partitions they overlap
+        and merge their results by date
+        """
+        tasks = search.tasks_on_date(datetime.date(2024, 3, 2))
+        self.assertEqual(1, len(tasks.parts))
+        self.assertEqual(self.ids(self.tasks[3:]), self.ids(tasks))
+        tasks = search.tasks_in_range(datetime.date(2023, 12, 31),
+                                      datetime.date(2024, 1, 1))
+        self.assertEqual(2, len(tasks.parts))
+        self.assertEqual(self.ids(self.tasks[2:0:-1]), self.ids(
+            paging.page_query(tasks, paging.DATE_ORDER, limit=10)))
+        self.assertEqual(self.ids(self.tasks[1:3]), self.ids(
+            paging.page_query(tasks, paging.DATE_ORDER, forward=False,
+                              limit=10)))
+
+    def test_pager_crosses_partitions(self):
+        """
+        Tests paging forward and back across a partition boundary, with
+        each task's employee read from its own partition
+        """
+        pager = paging.TaskPager(search.tasks_by_keyword('flux'),
+                                 paging.order_for(
+                                     search.tasks_by_keyword('flux')),
+                                 page_size=1)
+        seen = [(pager.current.id, pager.current.employee.name)]
+        while pager.has_next:
+            pager.next()
+            seen.append((pager.current.id, pager.current.employee.name))
+        self.assertEqual([(self.tasks[3].id, 'Marty Mcfly'),
+                          (self.tasks[1].id, 'Doc Brown'),
+                          (self.tasks[0].id, 'Marty Mcfly')], seen)
+        pager.previous()
+        self.assertEqual(self.tasks[1].id, pager.current.id)
+
+    def test_writes_are_routed(self):
+        """
+        Tests that adds go to the partition for their date with a new id,
+        and that edits move a task when its year changes
+        """
+        task = writes.add_task('Biff Tannen', 20, 'Sports almanac', '',
+                               datetime.datetime(2025, 5, 1))
+        self.assertGreater(task.id, max(self.ids(self.tasks)))
+        self.assertEqual(['2023', '2024', '2025'], partitions.partitions())
+        self.assertEqual(1, writes.update_task(
+            task.id, {'created_at': datetime.datetime(2023, 6, 1),
+                      'employee': 'Griff Tannen'}))
+        moved = search.task_with_id(task.id).get()
+        self.assertEqual('Griff Tannen', moved.employee.name)
+        self.assertEqual(datetime.datetime(2023, 6, 1), moved.created_at)
+        self.assertEqual(1, search.tasks_in_range(
+            datetime.date(2023, 1, 1), datetime.date(2023, 12, 1)).count())
+        self.assertEqual(1, writes.update_task(task.id, {'duration': 25}))
+        self.assertEqual(25, search.task_with_id(task.id).get().duration)
+        self.assertEqual(1, writes.delete_task(task.id))
+        self.assertEqual(0, writes.delete_task(task.id))
+        self.assertEqual(4, partitions.task_count())
+
+    def test_failed_move_keeps_one_copy(self):
+        """
+        Tests that a task whose move to another partition fails stays in
+        its partition as it was, and that the move can then be retried
+        """
+        source = partitions.database('2024')
+        execute_sql = source.execute_sql
+
+        def fail_insert(sql, params=None):
+            if sql.startswith('INSERT INTO "moving"."task"'):
+                raise OperationalError('disk I/O error')
+            return execute_sql(sql, params)
+        update = {'created_at': datetime.datetime(2023, 6, 1)}
+        with patch.object(source, 'execute_sql', side_effect=fail_insert):
+            with self.assertRaises(OperationalError):
+                writes.update_task(self.tasks[2].id, update)
+        self.assertEqual(4, partitions.task_count())
+        self.assertEqual([self.tasks[2].id], self.ids(
+            Task.select().where(Task.id == self.tasks[2].id).bind(source)))
+        self.assertEqual(1, writes.update_task(self.tasks[2].id, update))
+        self.assertEqual([self.tasks[2].id], self.ids(search.tasks_in_range(
+            datetime.date(2023, 6, 1), datetime.date(2023, 6, 1))))
+        self.assertEqual(4, partitions.task_count())
+
+    def test_employees_and_reports_combine_partitions(self):
+        """
+        Tests that employee lists, lookups and reports add up what each
+        partition holds
+        """
+        self.assertEqual([('Doc Brown', 1), ('Marty Mcfly', 3)],
+                         search.employees_with_tasks())
+        self.assertEqual(['Marty Mcfly'],
+                         search.employee_candidates('Marty'))
+        self.assertEqual(['Marty Mcfly'],
+                         search.employee_candidates('Mrat Mcfly'))
+        # The week starting Monday 12/30/2024 runs into 2025.
+        writes.add_task('Marty Mcfly', 7, 'Party', '',
+                        datetime.datetime(2024, 12, 31, 22))
+        writes.add_task('Marty Mcfly', 8, 'Nap', '',
+                        datetime.datetime(2025, 1, 1, 12))
+        self.assertEqual(
+            [('Marty Mcfly', datetime.date(2024, 12, 30), 15, 2)],
+            [row for row in reports.duration_report(
+                'week', datetime.date(2025, 1, 1),
+                datetime.date(2025, 1, 2), 'Marty Mcfly')])
+
+    def test_import_fills_partitions(self):
+        """
+        Tests that bulk imports into a partitioned work log end up in the
+        partitions, with ids that don't clash
+        """
+        stream = io.StringIO(
+            '{"employee": "Lorraine", "duration": 5, "title": "Dance", '
+            '"created_at": "2024-11-12"}\n')
+        self.assertEqual((1, 0), importer.import_tasks(stream, 'jsonl'))
+        self.assertEqual(0, Task.select().count())
+        task = search.tasks_by_employee('Lorraine').get()
+        self.assertNotIn(task.id, self.ids(self.tasks))
+        self.assertEqual(5, partitions.task_count())
+
+    def test_partition_period_is_fixed(self):
+        """
+        Tests that a partitioned work log can't switch period
+        """
+        with self.assertRaises(ValueError):
+            partitions.partition_by('month')
+        self.assertEqual(0, partitions.partition_by('year'))
+
+
+class ArchiveTests(WorkLogFileTests):
+
+    file_name = 'cold.db'
+
+    def setUp(self):
+        super().setUp()
+        self.archive_path = os.path.join(self.directory.name,
+                                         'cold.archive.db')
+        self.tasks = self.add_tasks()
+
+    def test_searches_reach_archive_only_when_needed(self):
+        """
+        Tests that archiving moves old tasks out of the main file, and
+        that searches only read the archive for the dates it holds
+        """
+        self.assertEqual(2, archive.archive(datetime.date(2024, 1, 1)))
+        self.assertTrue(os.path.isfile(self.archive_path))
+        self.assertEqual(2, Task.select().count())
+        self.assertEqual(4, partitions.task_count())
+        self.assertEqual(4, startup.task_count(self.path))
+        recent = search.tasks_in_range(datetime.date(2024, 1, 1),
+                                       datetime.date(2024, 12, 31))
+        self.assertNotIsInstance(recent, partitions.PartitionedQuery)
+        self.assertEqual(self.ids(self.tasks[2:]), self.ids(recent))
+        old = search.tasks_on_date(datetime.date(2023, 12, 31))
+        self.assertEqual([partitions.database(partitions.ARCHIVE)],
+                         [partition for partition, _ in old.parts])
+        self.assertEqual('Doc Brown', old.get().employee.name)
+        self.assertEqual(self.ids(self.tasks[::-1]), self.ids(
+            paging.page_query(search.all_tasks(), paging.DATE_ORDER,
+                              limit=10)))
+        self.assertEqual(self.ids(self.tasks[:3]), self.ids(
+            paging.page_query(search.all_tasks(), paging.DATE_ORDER,
+                              forward=False, limit=3)))
+        self.assertEqual([('Doc Brown', 1), ('Marty Mcfly', 3)],
+                         search.employees_with_tasks())
+
+    def test_first_page_skips_archive(self):
+        """
+        Tests that the first page of every task, newest first, is read
+        from the main file without opening the archive
+        """
+        archive.archive(datetime.date(2024, 1, 1))
+        with patch('partitions.read', wraps=partitions.read) as read:
+            pager = paging.TaskPager(search.all_tasks(), page_size=1)
+        self.assertEqual(self.tasks[3].id, pager.current.id)
+        self.assertEqual([DATABASE],
+                         [call.args[0][0] for call in read.call_args_list])
+        pager.next()
+        pager.next()
+        self.assertEqual(self.tasks[1].id, pager.current.id)
+
+    def test_archived_tasks_are_read_only(self):
+        """
+        Tests that archived tasks can't be changed, that no task can be
+        dated into the archive, and that new tasks don't reuse the ids
+        of archived ones
+        """
+        archive.archive(datetime.date(2024, 6, 1))
+        self.assertEqual(0, Task.select().count())
+        with self.assertRaises(ValueError):
+            writes.update_task(self.tasks[0].id, {'duration': 1})
+        with self.assertRaises(ValueError):
+            writes.delete_task(self.tasks[3].id)
+        with self.assertRaises(ValueError):
+            writes.add_task('Biff Tannen', 20, 'Sports almanac', '',
+                            datetime.datetime(2024, 5, 31))
+        task = writes.add_task('Biff Tannen', 20, 'Sports almanac', '')
+        self.assertGreater(task.id, max(self.ids(self.tasks)))
+        with self.assertRaises(ValueError):
+            writes.update_task(task.id,
+                               {'created_at': datetime.datetime(2024, 1, 1)})
+        self.assertEqual(0, writes.delete_task(task.id + 1))
+        stream = io.StringIO(
+            '{"employee": "Lorraine", "duration": 5, "title": "Dance", '
+            '"created_at": "2024-05-12"}\n'
+            '{"employee": "Lorraine", "duration": 5, "title": "Dance"}\n')
+        self.assertEqual((1, 1), importer.import_tasks(stream, 'jsonl'))
+        imported = search.tasks_by_employee('Lorraine').get()
+        self.assertGreater(imported.id, task.id)
+        self.assertEqual(6, partitions.task_count())
+
+    def test_archive_partitioned_work_log(self):
+        """
+        Tests that archiving a partitioned work log empties the old
+        partitions into the archive and drops those left empty
+        """
+        partitions.partition_by('year')
+        self.assertEqual(3, archive.archive(datetime.date(2024, 1, 2)))
+        self.assertEqual([partitions.ARCHIVE, '2024'],
+                         partitions.partitions())
+        self.assertFalse(os.path.exists(
+            os.path.join(self.directory.name, 'cold.2023.db')))
+        self.assertEqual(self.ids(self.tasks), self.ids(search.all_tasks()))
+        self.assertEqual(1, search.tasks_in_range(
+            datetime.date(2024, 1, 2), datetime.date(2024, 12, 31)).count())
+        self.assertEqual(
+            [('Marty Mcfly', datetime.date(2023, 12, 1), 30, 1)],
+            list(reports.duration_report('month', employee='Marty Mcfly',
+                                         end_date=datetime.date(2023, 12, 1))))
+        with self.assertRaises(ValueError):
+            writes.update_task(self.tasks[2].id, {'duration': 1})
+
+    def test_failed_archiving_hides_nothing(self):
+        """
+        Tests that archiving stopped partway leaves every task searchable,
+        and that running it again finishes the move
+        """
+        with patch('partitions.transfer', side_effect=OperationalError(
+                'disk I/O error')):
+            with self.assertRaises(OperationalError):
+                archive.archive(datetime.date(2024, 1, 1))
+        self.assertEqual(4, Task.select().count())
+        self.assertEqual(self.ids(self.tasks), self.ids(search.all_tasks()))
+        self.assertEqual(self.ids(self.tasks[:2]), self.ids(
+            search.tasks_in_range(datetime.date(2023, 1, 1),
+                                  datetime.date(2023, 12, 31))))
+        self.assertEqual(2, archive.archive(datetime.date(2024, 1, 1)))
+        self.assertFalse(partitions.archiving())
+        self.assertEqual(self.ids(self.tasks), self.ids(search.all_tasks()))
+
+    def test_failed_partitioned_archiving_resumes(self):
+        """
+        Tests that archiving a partitioned work log stopped after some of
+        its files were emptied resumes with the rest
+        """
+        partitions.partition_by('year')
+        transfer = partitions.transfer
+        calls = []
+
+        def fail_second(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise OperationalError('disk I/O error')
+            return transfer(*args)
+        with patch('partitions.transfer', side_effect=fail_second):
+            with self.assertRaises(OperationalError):
+                archive.archive(datetime.date(2024, 1, 2))
+        self.assertEqual(self.ids(self.tasks), self.ids(search.all_tasks()))
+        self.assertEqual(1, archive.archive(datetime.date(2024, 1, 2)))
+        self.assertEqual([partitions.ARCHIVE, '2024'],
+                         partitions.partitions())
+        self.assertEqual(self.ids(self.tasks), self.ids(search.all_tasks()))
+
+    def test_cutoff_only_moves_forward(self):
+        """
+        Tests that archiving can't go back before an earlier cutoff or
+        past today, and that repeating a cutoff moves nothing
+        """
+        with self.assertRaises(ValueError):
+            archive.archive(datetime.date.today() +
+                            datetime.timedelta(days=1))
+        archive.archive(datetime.date(2024, 1, 1))
+        with self.assertRaises(ValueError):
+            archive.archive(datetime.date(2023, 12, 31))
+        self.assertEqual(0, archive.archive(datetime.date(2024, 1, 1)))
+        self.assertEqual(1, archive.archive(datetime.date(2024, 1, 2)))
+        self.assertEqual(self.ids(self.tasks[:3]), self.ids(
+            search.tasks_in_range(datetime.date(2023, 1, 1),
+                                  datetime.date(2024, 1, 1))))
+
+
+class SearchCacheTests(WorkLogFileTests):
+
+    file_name = 'cached.db'
+
+    def setUp(self):
+        super().setUp()
+        for number in range(3):
+            writes.add_task('Marty Mcfly', number + 1,
+                            'Skateboard {}'.format(number), 'hoverboard',
+                            datetime.datetime(1985, 10, 26 + number))
+        search_cache.CACHE.clear()
+        self.stats = search_cache.CACHE.stats()
+
+    def tearDown(self):
+        search_cache.CACHE.clear()
+        super().tearDown()
+
+    def counted(self, name):
+        return search_cache.CACHE.stats()[name] - self.stats[name]
+
+    def titles(self, tasks):
+        return [task.title for task in paging.TaskPager(tasks).window]
+
+    def test_repeated_search_runs_no_queries(self):
+        """
+        Tests that repeating a search and paging back over a page come
+        from the cache, without running any SQL
+        """
+        self.assertTrue(search_cache.exists(
+            search.tasks_by_employee('Marty Mcfly')))
+        first = self.titles(search.tasks_by_employee('Marty Mcfly'))
+        log = io.StringIO()
+        instrumentation.enable(DATABASE, log)
+        try:
+            self.assertTrue(search_cache.exists(
+                search.tasks_by_employee('Marty Mcfly')))
+            pager = paging.TaskPager(search.tasks_by_employee('Marty Mcfly'))
+            self.assertEqual('Marty Mcfly', pager.current.employee.name)
+        finally:
+            instrumentation.disable()
+        self.assertEqual(first, [task.title for task in pager.window])
+        self.assertEqual('', log.getvalue())
+        self.assertEqual(2, self.counted('hits'))
+        self.assertEqual(2, self.counted('misses'))
+
+    def test_writes_invalidate(self):
+        """
+        Tests that writes through the work log, straight to the table and
+        from another connection all drop cached results
+        """
+        def titles():
+            return self.titles(search.tasks_by_keyword('hoverboard'))
+        self.assertEqual(3, len(titles()))
+        writes.add_task('Doc Brown', 5, 'Flux', 'hoverboard',
+                        datetime.datetime(1985, 10, 30))
+        self.assertEqual(4, len(titles()))
+        Task.delete().where(Task.title == 'Flux').execute()
+        self.assertEqual(3, len(titles()))
+        other = SqliteDatabase(self.path)
+        other.execute_sql('DELETE FROM "task" WHERE "duration" = 1')
+        other.close()
+        self.assertEqual(2, len(titles()))
+        self.assertEqual(3, self.counted('invalidations'))
+        self.assertEqual(0, self.counted('hits'))
+
+    def test_shared_across_threads(self):
+        """
+        Tests that results one thread caches are hits on another thread
+        once it has looked up anything
+        """
+        def titles():
+            return self.titles(search.tasks_by_keyword('hoverboard'))
+        first = titles()
+        found = []
+
+        def other():
+            try:
+                found.extend([titles(), titles()])
+            finally:
+                DATABASE.close()
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        self.assertEqual([first, first], found)
+        self.assertEqual(first, titles())
+        self.assertEqual(2, self.counted('hits'))
+
+    def test_bounded_by_entries_and_bytes(self):
+        """
+        Tests that the least recently used results are evicted once the
+        cache holds too many or too large results
+        """
+        cache = search_cache.SearchCache(max_entries=2)
+        for key in ['a', 'b', 'a', 'c']:
+            cache.get(key, lambda: [key])
+        self.assertEqual(['a', 'c'], list(cache.entries))
+        self.assertEqual(1, cache.stats()['evictions'])
+        cache = search_cache.SearchCache(max_bytes=1000)
+        cache.get('small', lambda: 'x')
+        cache.get('large', lambda: 'x' * 2000)
+        self.assertEqual(['small'], list(cache.entries))
+        cache.get('medium', lambda: 'x' * 940)
+        self.assertEqual(['medium'], list(cache.entries))
+        self.assertLessEqual(cache.stats()['bytes'], 1000)
+
+
+class ChangeLogTests(WorkLogFileTests):
+
+    file_name = 'changes.db'
+
+    def tail(self, since=None):
+        stream = io.StringIO()
+        changes.tail(stream, since)
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    def test_tail_since_seq(self):
+        """
+        Tests that the change log records the fields each insert and
+        update set, skips edits changing nothing, and that tail resumes
+        after a seq
+        """
+        task = writes.add_task('Marty Mcfly', 30, 'Hoverboard', 'flux',
+                               datetime.datetime(2015, 10, 21, 16, 29))
+        writes.update_task(task.id, {'duration': 45,
+                                     'employee': 'Doc Brown'})
+        writes.update_task(task.id, {'title': 'Hoverboard'})
+        writes.delete_task(task.id)
+        found = self.tail()
+        self.assertEqual([
+            {'seq': 1, 'op': 'insert', 'task_id': task.id,
+             'uuid': task.uuid,
+             'fields': {'employee': 'Marty Mcfly', 'duration': 30,
+                        'title': 'Hoverboard', 'notes': 'flux',
+                        'created_at': '2015-10-21 16:29:00'}},
+            {'seq': 2, 'op': 'update', 'task_id': task.id,
+             'uuid': task.uuid,
+             'fields': {'employee': 'Doc Brown', 'duration': 45}},
+            {'seq': 3, 'op': 'delete', 'task_id': task.id,
+             'uuid': task.uuid},
+        ], found)
+        self.assertEqual([3], [line['seq'] for line in
+                               self.tail(changes.parse_cursor('2'))])
+
+    def test_tail_partitioned_work_log(self):
+        """
+        Tests that tail reads the change log of every file, naming each
+        change's log and giving a cursor to resume from
+        """
+        writes.add_task('Marty Mcfly', 30, 'Hoverboard', 'flux',
+                        datetime.datetime(2015, 10, 21))
+        partitions.partition_by('year')
+        found = self.tail()
+        self.assertEqual([('2015', 'insert'), ('main', 'insert'),
+                          ('main', 'delete')],
+                         [(line['log'], line['op']) for line in found])
+        self.assertEqual('2015:1,main:2', found[-1]['cursor'])
+        cursor = changes.parse_cursor(found[-1]['cursor'])
+        self.assertEqual([], self.tail(cursor))
+        writes.add_task('Doc Brown', 5, 'Flux', '',
+                        datetime.datetime(1985, 10, 26))
+        self.assertEqual([('1985', 1)], [(line['log'], line['seq'])
+                                         for line in self.tail(cursor)])
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_tail_command(self, stdout):
+        """
+        Tests the tail command writing the changes after a seq as JSON
+        lines, and rejecting a position it can't read
+        """
+        for duration in [10, 20, 30]:
+            writes.add_task('Marty Mcfly', duration, 'Skateboard', '')
+        DATABASE.close()
+        self.assertEqual(0, work_log_database.main(
+            ['--database', self.path, 'tail', '--since', '1']))
+        self.assertEqual([20, 30], [
+            json.loads(line)['fields']['duration']
+            for line in stdout.getvalue().splitlines()])
+        with patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.assertEqual(1, work_log_database.main(
+                ['--database', self.path, 'tail', '--since', 'x']))
+        self.assertIn("isn't a change log position", stderr.getvalue())
+
+
+class SyncTests(WorkLogFileTests):
+
+    file_name = 'office.db'
+
+    def setUp(self):
+        super().setUp()
+        self.office = self.path
+        self.laptop = os.path.join(self.directory.name, 'laptop.db')
+        self.tasks = [
+            writes.add_task('Marty Mcfly', 30, 'Hoverboard', 'flux',
+                            datetime.datetime(2015, 10, 21, 16, 29)),
+            writes.add_task('Doc Brown', 15, 'Flux capacitor', 'flux',
+                            datetime.datetime(1955, 11, 5)),
+        ]
+
+    def tasks_in(self, path):
+        self.use(path)
+        found = {task.uuid: (task.employee.name, task.duration, task.title)
+                 for task in Task.select(Task, Employee).join(Employee)}
+        self.use(self.office)
+        return found
+
+    def edit(self, path, task, update):
+        self.use(path)
+        writes.update_task(Task.get(Task.uuid == task.uuid).id, update)
+        self.use(self.office)
+
+    def test_sync_changes_both_ways(self):
+        """
+        Tests that syncing sends and receives only the tasks changed
+        since the last sync, and that a sync with nothing changed writes
+        nothing
+        """
+        self.assertEqual((2, 0, 0), sync.sync(self.laptop))
+        self.assertEqual((0, 0, 0), sync.sync(self.laptop))
+        self.assertEqual(self.tasks_in(self.office),
+                         self.tasks_in(self.laptop))
+        self.edit(self.laptop, self.tasks[0], {'duration': 45})
+        writes.delete_task(self.tasks[1].id)
+        added = writes.add_task('Biff Tannen', 5, 'Almanac', '')
+        self.assertEqual((2, 1, 0), sync.sync(self.laptop))
+        expected = {
+            self.tasks[0].uuid: ('Marty Mcfly', 45, 'Hoverboard'),
+            added.uuid: ('Biff Tannen', 5, 'Almanac'),
+        }
+        self.assertEqual(expected, self.tasks_in(self.office))
+        self.assertEqual(expected, self.tasks_in(self.laptop))
+        self.assertEqual((0, 0, 0), sync.sync(self.laptop))
+
+    def test_copied_tasks_are_not_changes(self):
+        """
+        Tests that tasks a sync copied into a file aren't taken for that
+        file's own changes by the next sync
+        """
+        self.assertEqual((2, 0, 0), sync.sync(self.laptop))
+        writes.update_task(self.tasks[0].id, {'duration': 45})
+        self.assertEqual((1, 0, 0), sync.sync(self.laptop))
+        self.edit(self.laptop, self.tasks[1], {'duration': 20})
+        self.assertEqual((0, 1, 0), sync.sync(self.laptop))
+        self.assertEqual((0, 0, 0), sync.sync(self.laptop))
+        self.assertEqual(self.tasks_in(self.office),
+                         self.tasks_in(self.laptop))
+
+    def test_conflicts_go_to_the_last_change(self):
+        """
+        Tests that a task changed in both files ends up as it was last
+        changed in both, whichever file runs the sync, and that a task
+        edited after it was deleted elsewhere is kept
+        """
+        sync.sync(self.laptop)
+        writes.update_task(self.tasks[0].id, {'title': 'Office'})
+        writes.delete_task(self.tasks[1].id)
+        time.sleep(0.01)
+        self.edit(self.laptop, self.tasks[0], {'title': 'Laptop'})
+        self.edit(self.laptop, self.tasks[1], {'duration': 20})
+        self.use(self.laptop)
+        self.assertEqual((2, 0, 2), sync.sync(self.office))
+        self.use(self.office)
+        expected = {
+            self.tasks[0].uuid: ('Marty Mcfly', 30, 'Laptop'),
+            self.tasks[1].uuid: ('Doc Brown', 20, 'Flux capacitor'),
+        }
+        self.assertEqual(expected, self.tasks_in(self.office))
+        self.assertEqual(expected, self.tasks_in(self.laptop))
+        self.assertEqual((0, 0, 0), sync.sync(self.laptop))
+
+    def test_copied_file_and_partitioned_log(self):
+        """
+        Tests syncing with a copy of the work log file, which is given a
+        replica id of its own, and that partitioned logs can't be synced
+        """
+        DATABASE.close()
+        shutil.copy(self.office, self.laptop)
+        self.assertEqual((0, 0, 0), sync.sync(self.laptop))
+        self.assertNotEqual(sync.replica_id(DATABASE),
+                            self.replica_of(self.laptop))
+        self.edit(self.laptop, self.tasks[1], {'employee': 'Marty Mcfly'})
+        self.assertEqual((0, 1, 0), sync.sync(self.laptop))
+        self.assertEqual(2, Employee.get(name='Marty Mcfly').task_count)
+        with self.assertRaises(ValueError):
+            sync.sync(self.office)
+        partitions.partition_by('year')
+        with self.assertRaises(ValueError):
+            sync.sync(self.laptop)
+        partitions.close()
+
+    def test_copies_of_an_older_file(self):
+        """
+        Tests syncing two copies of a work log file made before tasks had
+        uuids, each upgraded on its own, which match every task and count
+        as updated before any later edit
+        """
+        DATABASE.close()
+        old = os.path.join(self.directory.name, 'old.db')
+        database = SqliteDatabase(old)
+        database.execute_sql(
+            'CREATE TABLE "task" ("id" INTEGER NOT NULL PRIMARY KEY, '
+            '"employee" VARCHAR(60) NOT NULL, '
+            '"duration" INTEGER NOT NULL, '
+            '"title" VARCHAR(140) NOT NULL, "notes" TEXT NOT NULL, '
+            '"created_at" DATETIME NOT NULL)')
+        for employee, title in [('Doc Brown', 'Flux capacitor'),
+                                ('Marty Mcfly', 'Hoverboard'),
+                                ('Doc Brown', 'Lunch')]:
+            database.execute_sql(
+                'INSERT INTO "task" ("employee", "duration", "title", '
+                '"notes", "created_at") VALUES (?, 5, ?, \'\', '
+                '\'2015-10-21 16:29:00\')', (employee, title))
+        database.close()
+        shutil.copy(old, self.laptop)
+        self.use(old)
+        self.assertEqual([0, 0, 0], [updated_at for updated_at, in
+                                     Task.select(Task.updated_at).tuples()])
+        self.assertEqual((0, 0, 0), sync.sync(self.laptop))
+        found = self.tasks_in(old)
+        self.assertEqual(3, len(found))
+        self.assertEqual(found, self.tasks_in(self.laptop))
+
+    def replica_of(self, path):
+        self.use(path)
+        replica = sync.replica_id(DATABASE)
+        self.use(self.office)
+        return replica
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_sync_command(self, stdout):
+        """
+        Tests the sync command creating a new work log file to sync with
+        """
+        DATABASE.close()
+        self.assertEqual(0, work_log_database.main(
+            ['--database', self.office, 'sync', self.laptop]))
+        self.assertIn("Sent 2 tasks and received 0, settling 0 conflicts.",
+                      stdout.getvalue())
+        self.assertEqual(2, len(self.tasks_in(self.laptop)))
+
+
+class BulkChangeTests(WorkLogFileTests):
+
+    file_name = 'bulk.db'
+
+    def setUp(self):
+        super().setUp()
+        self.tasks = self.add_tasks()
+
+    def counts(self):
+        return [(employee.name, employee.task_count)
+                for employee in Employee.select().order_by(Employee.name)]
+
+    def test_update_and_delete_search_results(self):
+        """
+        Tests that every task a search found is changed at once, with the
+        employee counters, full-text index and totals kept in step
+        """
+        tasks = search.tasks_by_keyword('flux')
+        self.assertEqual((3, 0), writes.count_tasks(tasks))
+        self.assertEqual(3, writes.update_tasks(
+            tasks, {'employee': 'Biff Tannen', 'duration': 20}))
+        self.assertEqual([('Biff Tannen', 3), ('Doc Brown', 0),
+                          ('Marty Mcfly', 1)], self.counts())
+        self.assertEqual(
+            {20}, {task.duration for task in
+                   search.tasks_by_employee('Biff Tannen')})
+        self.assertEqual(3, len(search.tasks_by_keyword('flux')))
+        self.assertEqual(3, writes.delete_tasks(
+            search.tasks_by_employee('Biff Tannen')))
+        self.assertEqual(['Guitar'],
+                         [task.title for task in search.all_tasks()])
+        self.assertEqual(0, len(search.tasks_by_keyword('flux')))
+        self.assertEqual(1, partitions.task_count())
+
+    def test_partitioned_and_archived_tasks(self):
+        """
+        Tests that changing all results reaches every partition but leaves
+        archived tasks alone, and that redating them all is refused
+        """
+        archive.archive(datetime.date(2024, 1, 1))
+        partitions.partition_by('year')
+        tasks = search.tasks_by_employee('Marty Mcfly')
+        self.assertEqual((2, 1), writes.count_tasks(tasks))
+        self.assertEqual(2, writes.update_tasks(tasks, {'duration': 1}))
+        self.assertEqual([30, 1, 1], [
+            task.duration for task in search.tasks_by_employee(
+                'Marty Mcfly').order_by(Task.created_at)])
+        with self.assertRaises(ValueError):
+            writes.update_tasks(tasks, {
+                'created_at': datetime.datetime(2024, 6, 1)})
+        self.assertEqual(2, writes.delete_tasks(search.all_tasks()))
+        self.assertEqual(2, partitions.task_count())
+
+    @patch('work_log_database.clear')
+    @patch('builtins.input', side_effect=['a', 'r', 'Biff Tannen', 'y', ''])
+    def test_change_all_menu(self, mock, clear):
+        """
+        Tests reassigning every task a search found from the task menu,
+        after it shows how many tasks will change
+        """
+        with patch('sys.stdout', new_callable=io.StringIO) as output:
+            work_log_database.task_page_menu(
+                search.tasks_by_employee('Marty Mcfly'))
+        self.assertIn("3 tasks found.", output.getvalue())
+        prompts = [call[0][0] for call in mock.call_args_list]
+        self.assertIn("This will reassign 3 tasks to Biff Tannen. "
+                      "Are you sure? [yN] ", prompts)
+        self.assertIn("3 tasks updated.", prompts[-1])
+        self.assertEqual([('Biff Tannen', 3), ('Doc Brown', 1),
+                          ('Marty Mcfly', 0)], self.counts())
+
+
+@unittest.skipUnless(snapshot, "NumPy isn't installed")
+class SnapshotTests(WorkLogFileTests):
+
+    file_name = 'columns.db'
+
+    def setUp(self):
+        super().setUp()
+        self.tasks = self.add_tasks()
+
+    def assertMatchesLog(self, tasks):
+        """Checks a snapshot holds exactly the tasks in the work log"""
+        expected = sorted(
+            row for part in partitions.each(
+                lambda database: list(
+                    Task.select(Task.id, Employee.name, Task.duration,
+                                Task.created_at)
+                    .join(Employee).bind(database).tuples()))
+            for row in part)
+        self.assertEqual(expected, sorted(
+            (int(task_id), tasks.names[employee], int(duration),
+             Task.created_at.python_value(int(created)))
+            for task_id, employee, duration, created in zip(
+                tasks.ids, tasks.employees, tasks.durations,
+                tasks.created)))
+
+    def test_filters_and_aggregates(self):
+        """
+        Tests that snapshot filters and aggregates agree with the tasks,
+        and that titles are read for just the tasks selected
+        """
+        tasks = snapshot.Snapshot.load()
+        self.assertMatchesLog(tasks)
+        mask = tasks.select(employee='Marty Mcfly',
+                            start_date=datetime.date(2023, 12, 31))
+        self.assertEqual(
+            {'tasks': 2, 'minutes': 15, 'mean': 7.5,
+             'percentiles': {50: 7.5, 90: 9.5, 99: 9.95}},
+            tasks.summary(mask))
+        self.assertEqual(['Almanac', 'Guitar'], sorted(tasks.titles(mask)))
+        self.assertEqual([('Doc Brown', 1, 15), ('Marty Mcfly', 3, 45)],
+                         list(tasks.by_employee()))
+        self.assertEqual([('Marty Mcfly', 1, 30)], list(tasks.by_employee(
+            tasks.select(min_duration=20, max_duration=30))))
+        nobody = tasks.summary(tasks.select(employee='Biff Tannen'))
+        self.assertEqual((0, 0, None), (nobody['tasks'], nobody['minutes'],
+                                        nobody['mean']))
+
+    def test_refresh_reads_changes(self):
+        """
+        Tests that refreshing reads only the tasks added, edited and
+        deleted since the snapshot was taken, including tasks moved into
+        partitions
+        """
+        tasks = snapshot.Snapshot.load()
+        self.assertEqual(0, tasks.refresh())
+        writes.update_task(self.tasks[0].id, {'duration': 45})
+        writes.delete_task(self.tasks[1].id)
+        writes.add_task('Biff Tannen', 20, 'Almanac', 'sports',
+                        datetime.datetime(2024, 3, 3, 9))
+        self.assertEqual(2, tasks.refresh())
+        self.assertMatchesLog(tasks)
+        self.assertEqual('Biff Tannen', tasks.names[-1])
+        self.assertEqual(0, len(list(tasks.by_employee(
+            tasks.select(employee='Doc Brown')))))
+        partitions.partition_by('year')
+        tasks.refresh()
+        self.assertMatchesLog(tasks)
+        writes.update_task(self.tasks[2].id, {'duration': 1})
+        self.assertEqual(1, tasks.refresh())
+        self.assertMatchesLog(tasks)
+
+
+class PlannerTests(WorkLogFileTests):
+
+    file_name = 'planned.db'
+
+    def setUp(self):
+        super().setUp()
+        day = datetime.datetime(2023, 12, 1, 9)
+        for number in range(60):
+            writes.add_task(
+                'Marty Mcfly' if number % 10 else 'Doc Brown',
+                number + 1, 'Invoice {}'.format(number) if number % 3
+                else 'Hoverboard {}'.format(number), 'flux capacitor',
+                day + datetime.timedelta(days=number))
+
+    def found(self, criteria):
+        """Returns the titles a combined search finds, and its plan"""
+        tasks, keys, plan = planner.combined_search(criteria)
+        titles = []
+        pager = paging.TaskPager(tasks, keys, page_size=7)
+        while pager.current is not None:
+            titles.append(pager.current.title)
+            if not pager.has_next:
+                break
+            pager.next()
+        return titles, plan
+
+    def expected(self, criteria):
+        """Filters every task by 'criteria' in Python, newest first"""
+        tasks = sorted(
+            (task for part in partitions.each(lambda database: list(
+                Task.select(Task, Employee).join(Employee).bind(database)))
+             for task in part), key=lambda task: (task.created_at, task.id),
+            reverse=True)
+        start, end = criteria.days
+        return [task.title for task in tasks
+                if criteria.employee in (None, task.employee.name) and
+                (criteria.min_duration or 0) <= task.duration and
+                task.duration <= (criteria.max_duration or 1000) and
+                (not criteria.keyword or
+                 criteria.keyword in task.title.lower()) and
+                (start is None or start <= task.day) and
+                (end is None or task.day <= end)]
+
+    def test_plan_follows_selectivity(self):
+        """
+        Tests that the planner leads with the criterion matching fewest
+        tasks, and that every plan finds the same tasks as filtering them
+        one by one
+        """
+        cases = [
+            (planner.Criteria(employee='Doc Brown', keyword='invoice'),
+             'employee'),
+            (planner.Criteria(employee='Marty Mcfly', min_duration=58),
+             'duration'),
+            (planner.Criteria(employee='Marty Mcfly',
+                              start_date=datetime.date(2024, 1, 10),
+                              end_date=datetime.date(2024, 1, 1)),
+             'employee_date'),
+            (planner.Criteria(keyword='hoverboard', max_duration=50),
+             'keyword'),
+            (planner.Criteria(keyword='invoice', min_duration=30,
+                              max_duration=5), 'duration'),
+        ]
+        with patch('planner.SAMPLE_LIMIT', 30):
+            for criteria, driver in cases:
+                titles, plan = self.found(criteria)
+                self.assertEqual(driver, plan.driver, criteria)
+                expected = self.expected(criteria)
+                if driver == 'keyword':
+                    # The matches all rank the same, so best match first
+                    # leaves them oldest first.
+                    expected.reverse()
+                self.assertEqual(expected, titles, criteria)
+        titles, plan = self.found(planner.Criteria())
+        self.assertIsNone(plan.driver)
+        self.assertEqual(60, len(titles))
+
+    def test_describe_shows_plan(self):
+        """
+        Tests that a plan is described with each criterion's estimate and
+        SQLite's plan, which uses only the chosen index
+        """
+        criteria = planner.Criteria(employee='Doc Brown', min_duration=2)
+        tasks, keys, plan = planner.combined_search(criteria)
+        lines = '\n'.join(planner.describe(plan, tasks, keys))
+        self.assertIn('employee index           6 tasks', lines)
+        self.assertIn('duration index           59 tasks', lines)
+        self.assertIn('Using the employee index.', lines)
+        self.assertIn('task_employee_id_created_at', lines)
+        self.assertNotIn('task_duration', lines)
+
+    def test_partitioned_search(self):
+        """
+        Tests combined searches across partitions, and that sampled
+        estimates are counted further when an exact one is larger
+        """
+        partitions.partition_by('year')
+        criteria = planner.Criteria(employee='Marty Mcfly',
+                                    keyword='hoverboard',
+                                    start_date=datetime.date(2023, 12, 20))
+        titles, plan = self.found(criteria)
+        self.assertEqual(self.expected(criteria), titles)
+        with patch('planner.SAMPLE_LIMIT', 5):
+            plan = planner.plan(planner.Criteria(employee='Marty Mcfly',
+                                                 keyword='invoice'))
+        self.assertEqual({'employee': 54, 'keyword': 40},
+                         dict(plan.estimates))
+        self.assertEqual('keyword', plan.driver)
+
+
+class FederationTests(WorkLogFileTests):
+
+    file_name = 'team0.db'
+
+    def setUp(self):
+        super().setUp()
+        self.paths = []
+        for team, employee in enumerate(['Marty Mcfly', 'Doc Brown',
+                                         'Marty Mcfly']):
+            path = os.path.join(self.directory.name,
+                                'team{}.db'.format(team))
+            self.use(path)
+            for day in range(team, 12, 2):
+                writes.add_task(employee, day + 1, 'Task {}'.format(day),
+                                'flux', datetime.datetime(2023, 12, 25) +
+                                datetime.timedelta(days=day))
+            self.paths.append(path)
+        partitions.partition_by('year')
+        partitions.close()
+        DATABASE.close()
+        configure(self.paths[0])
+        self.workers = patch('federation.WORKERS', 2)
+        self.workers.start()
+
+    def tearDown(self):
+        federation.close()
+        self.workers.stop()
+        super().tearDown()
+
+    def positions(self, tasks):
+        return [(task.created_at, os.path.basename(task.source), task.title)
+                for task in tasks]
+
+    def test_expand(self):
+        """
+        Tests that globs find work logs but not their partition files,
+        and that missing files are reported
+        """
+        pattern = os.path.join(self.directory.name, '*.db')
+        self.assertTrue(any('2024' in path for path in glob.glob(pattern)))
+        self.assertEqual(self.paths, federation.expand([pattern]))
+        self.assertEqual(self.paths[1:], federation.expand(self.paths[1:]))
+        with self.assertRaises(ValueError):
+            federation.expand([os.path.join(self.directory.name, 'x.db')])
+
+    def test_searches_merge_by_date(self):
+        """
+        Tests that a federated search pages through the tasks of every
+        file in date order, forward and back, and combines employee lists
+        """
+        found = federation.Federation(self.paths)
+        self.assertEqual(17, found.task_count())
+        self.assertEqual([('Doc Brown', 6), ('Marty Mcfly', 11)],
+                         found.employees_with_tasks())
+        self.assertEqual(['Marty Mcfly'], found.employee_candidates('mar'))
+        pager = paging.TaskPager(found.tasks_by_employee('Marty Mcfly'),
+                                 page_size=4)
+        tasks = [pager.current]
+        while pager.has_next:
+            pager.next()
+            tasks.append(pager.current)
+        expected = sorted(
+            ((datetime.datetime(2023, 12, 25) + datetime.timedelta(days=day),
+              'team{}.db'.format(team), 'Task {}'.format(day))
+             for team in [0, 2] for day in range(team, 12, 2)),
+            reverse=True)
+        self.assertEqual(expected, self.positions(tasks))
+        backward = [pager.current]
+        while pager.has_previous:
+            pager.previous()
+            backward.append(pager.current)
+        self.assertEqual(expected[::-1], self.positions(backward))
+        tasks = found.tasks_in_range(datetime.date(2023, 12, 31),
+                                     datetime.date(2024, 1, 1))
+        self.assertEqual(['Task 6', 'Task 6', 'Task 7'],
+                         [task.title for task in tasks])
+        self.assertFalse(search_cache.exists(found.tasks_by_keyword('zzz')))
+
+    def test_partitions_opened_read_only(self):
+        """
+        Tests that a worker opens partition files read only and leaves
+        missing ones uncreated
+        """
+        rows = federation.search_page(self.paths[2], 'all_tasks', (), None,
+                                      True, 10)
+        self.assertEqual(5, len(rows))
+        with self.assertRaises(OperationalError):
+            partitions.database('2024').execute_sql('DELETE FROM "task"')
+        partitions.close()
+        DATABASE.close()
+        missing = startup.partition_path(self.paths[2], '2023')
+        os.remove(missing)
+        with self.assertRaises(OperationalError):
+            federation.search_page(self.paths[2], 'all_tasks', (), None,
+                                   True, 10)
+        self.assertFalse(os.path.exists(missing))
+
+    @patch('work_log_database.clear')
+    @patch('builtins.input', side_effect=['a', 'v', 'n', 'e', 'b', 'q'])
+    def test_federated_menu(self, mock, clear):
+        """
+        Tests that the menu over several work logs offers only viewing
+        and searching, and shows each task read only with its file
+        """
+        with patch('sys.stdout', new_callable=io.StringIO) as output:
+            self.assertEqual(0, work_log_database.main(
+                ['--federate', os.path.join(self.directory.name, '*.db')]))
+        output = output.getvalue()
+        self.assertIn("Searching 3 work logs.", output)
+        self.assertIn("Selection not recognized.", output)
+        self.assertIn("Work log: {}".format(self.paths[1]), output)
+        self.assertIn("Choice not recognized.", output)
+        self.assertNotIn("(E)dit", output)
+        self.assertIsInstance(work_log_database.search,
+                              startup.LazyModule)
+
+
+class APITests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.loop = asyncio.new_event_loop()
+        cls.server = api.Server(workers=2)
+        cls.listener = cls.loop.run_until_complete(
+            cls.server.start('127.0.0.1', 0))
+        cls.port = cls.listener.sockets[0].getsockname()[1]
+        cls.thread = threading.Thread(target=cls.loop.run_forever)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread.join()
+        cls.listener.close()
+        cls.loop.run_until_complete(cls.listener.wait_closed())
+        cls.loop.close()
+        cls.server.close()
+
+    def setUp(self):
+        for number in range(5):
+            Task.create(employee=Employee.named('Marty Mcfly'),
+                        duration=number + 1,
+                        title='Skateboard {}'.format(number), notes='',
+                        created_at=datetime.datetime(1985, 10, 26 + number))
+        self.connection = http.client.HTTPConnection('127.0.0.1', self.port)
+
+    def tearDown(self):
+        self.connection.close()
+        Task.delete().where(Task.id > 0).execute()
+
+    def call(self, method, path, body=None):
+        self.connection.request(
+            method, path, None if body is None else json.dumps(body))
+        response = self.connection.getresponse()
+        data = response.read()
+        return response.status, json.loads(data) if data else None
+
+    def test_add_edit_delete(self):
+        """
+        Tests adding, reading, editing and deleting a task over the API
+        """
+        status, task = self.call('POST', '/tasks', {
+            'employee': 'Doc Brown', 'duration': 5,
+            'title': 'Flux capacitor', 'created_at': '1955-11-05'})
+        self.assertEqual(201, status)
+        self.assertEqual('1955-11-05 00:00:00', task['created_at'])
+        path = '/tasks/{}'.format(task['id'])
+        self.assertEqual((200, task), self.call('GET', path))
+        status, task = self.call('PATCH', path, {'employee': 'Emmett Brown',
+                                                 'notes': '1.21 gigawatts'})
+        self.assertEqual(('Emmett Brown', '1.21 gigawatts', 5),
+                         (task['employee'], task['notes'], task['duration']))
+        self.assertEqual((204, None), self.call('DELETE', path))
+        self.assertEqual(404, self.call('GET', path)[0])
+        self.assertEqual(404, self.call('DELETE', path)[0])
+
+    def test_invalid_requests(self):
+        """
+        Tests that bad input is answered with an error message
+        """
+        self.assertEqual(
+            (400, {'error': 'Duration must be a positive whole number.'}),
+            self.call('POST', '/tasks', {'employee': 'Doc Brown',
+                                         'duration': 0, 'title': 'Lunch'}))
+        self.assertEqual(400, self.call('GET', '/tasks?limit=0')[0])
+        self.assertEqual(400, self.call('GET', '/tasks?employee=Doc'
+                                               '&keyword=flux')[0])
+        self.assertEqual(400, self.call('GET', '/tasks?after=999999')[0])
+        self.assertEqual(404, self.call('GET', '/nothing')[0])
+        self.assertEqual(405, self.call('PUT', '/tasks')[0])
+
+    def test_search_pages(self):
+        """
+        Tests following the next cursor through pages of a search
+        """
+        titles = []
+        path = '/tasks?keyword=skateboard&limit=2'
+        while path:
+            status, page = self.call('GET', path)
+            self.assertEqual(200, status)
+            titles.extend(task['title'] for task in page['tasks'])
+            path = (page['next'] and '/tasks?keyword=skateboard&limit=2'
+                    '&after={}'.format(page['next']))
+        self.assertEqual(['Skateboard {}'.format(number)
+                          for number in range(5)], sorted(titles))
+        status, page = self.call('GET', '/tasks?date=1985-10-27')
+        self.assertEqual(['Skateboard 1'],
+                         [task['title'] for task in page['tasks']])
+
+    def test_searches_built_off_the_event_loop(self):
+        """
+        Tests that a search's query, which reads the partition catalog, is
+        built on the database thread pool
+        """
+        threads = []
+        original = api.search_query
+
+        def search_query(params):
+            threads.append(threading.current_thread())
+            return original(params)
+        with patch('api.search_query', side_effect=search_query):
+            self.assertEqual(200, self.call('GET', '/tasks?limit=1')[0])
+        self.assertEqual(1, len(threads))
+        self.assertIsNot(self.thread, threads[0])
+
+    def test_pipelined_requests(self):
+        """
+        Tests that requests sent together on one connection are answered
+        in order
+        """
+        ids = [task.id for task in Task.select().order_by(Task.id.desc())]
+        with socket.create_connection(('127.0.0.1', self.port)) as client:
+            client.sendall(b''.join(
+                'GET /tasks/{} HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                .format(task_id).encode() for task_id in ids) +
+                b'GET /tasks?limit=1 HTTP/1.1\r\nConnection: close\r\n\r\n')
+            data = b''
+            while True:
+                received = client.recv(65536)
+                if not received:
+                    break
+                data += received
+        responses = [response.split(b'\r\n\r\n', 1)[1]
+                     for response in data.split(b'HTTP/1.1 ')[1:]]
+        self.assertEqual(ids, [json.loads(body)['id']
+                               for body in responses[:-1]])
+        # The search is streamed as chunks, each a size line then data.
+        page = json.loads(b''.join(responses[-1].split(b'\r\n')[1::2]))
+        self.assertEqual(1, len(page['tasks']))
+
+
+class InstrumentationTests(unittest.TestCase):
+
+    def setUp(self):
+        for number in range(3):
+            Task.create(employee=Employee.named('Marty Mcfly'),
+                        duration=number + 1,
+                        title='Skateboard {}'.format(number), notes='')
+
+    def tearDown(self):
+        instrumentation.disable()
+        Task.delete().where(Task.id > 0).execute()
+
+    @patch('builtins.input', return_value='b')
+    def test_records_statements(self, mock):
+        """
+        Tests that statements are logged with their time, row count and
+        the menu function that ran them
+        """
+        log = io.StringIO()
+        monitor = instrumentation.enable(DATABASE, log)
+        self.assertIn('execute_sql', DATABASE.__dict__)
+        work_log_database.task_page_menu(search.all_tasks())
+        instrumentation.disable()
+        self.assertNotIn('execute_sql', DATABASE.__dict__)
+
+        records = [json.loads(line) for line in log.getvalue().splitlines()]
+        page = [record for record in records
+                if record['sql'].startswith('SELECT')
+                and '"task"' in record['sql']]
+        self.assertEqual('task_page_menu', page[0]['caller'])
+        self.assertEqual(3, page[0]['rows'])
+        self.assertGreaterEqual(page[0]['ms'], 0)
+        self.assertEqual(len(records),
+                         monitor.histograms['(all)'].count)
+        report = io.StringIO()
+        monitor.report(report)
+        self.assertIn('task_page_menu', report.getvalue())
+
+    def test_slow_query_plan(self):
+        """
+        Tests that statements over the threshold are logged with their
+        query plan
+        """
+        instrumentation.enable(DATABASE, slow_ms=0)
+        tasks = search.tasks_by_duration(2)
+        with self.assertLogs('work_log.queries', 'WARNING') as logs:
+            list(tasks)
+        self.assertIn('USING INDEX task_duration', logs.output[0])
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def test_generated_work_log(self):
+        """
+        Tests that the synthetic work log is repeatable and skewed toward
+        a few busy employees
+        """
+        rows = list(generate.work_log(2000, seed=1))
+        self.assertEqual(rows, list(generate.work_log(2000, seed=1)))
+        counts = sorted(collections.Counter(row[0] for row in rows).values())
+        self.assertGreater(counts[-1], 10 * counts[0])
+        created = [row[-1] for row in rows]
+        self.assertEqual(sorted(created), created)
+        for row in rows[:50]:
+            importer.clean_record(dict(zip(
+                ['employee', 'duration', 'title', 'notes'], row)), None)
+
+    def test_compare_flags_regressions(self):
+        """
+        Tests that only slowdowns beyond the threshold and noise count
+        """
+        def results(**medians):
+            return {'results': {name: {'median_ms': median}
+                                for name, median in medians.items()}}
+        flagged = {name: regressed for name, _, _, _, regressed in
+                   compare.regressions(results(a=10, b=10, c=0.1),
+                                       results(a=20, b=11, c=0.3))}
+        self.assertEqual({'a': True, 'b': False, 'c': False}, flagged)
+
+    def test_startup_benchmark(self):
+        """
+        Tests that the startup benchmark times the menu coming up
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            generate.generate(os.path.join(directory, 'work_log.db'), 50)
+            self.assertGreater(startup_benchmark.first_menu(directory), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
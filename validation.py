@@ -0,0 +1,54 @@
+"""
+Validation shared by the interactive prompts and the bulk importer.
+
+Each function returns the cleaned value, or raises ValueError with a
+message that can be shown to the user.
+"""
+import datetime
+
+
+DATE_FORMATS = ["%m/%d/%Y", "%Y-%m-%d"]
+
+
+def clean_employee(employee):
+    """Validates an employee name as 60 or fewer characters."""
+    if len(employee) > 60:
+        raise ValueError("Name must be 60 or fewer characters.")
+    return employee
+
+
+def clean_duration(duration):
+    """Validates a duration as a positive whole number of minutes."""
+    try:
+        duration = int(duration)
+        if duration < 1:
+            raise ValueError
+    except (TypeError, ValueError):
+        raise ValueError("Duration must be a positive whole number.")
+    return duration
+
+
+def clean_title(title):
+    """Validates a task title as 140 or fewer characters."""
+    if len(title) > 140:
+        raise ValueError("Task title must be 140 or fewer characters.")
+    return title
+
+
+def clean_date(value):
+    """
+    Converts an ISO 8601 timestamp, a YYYY-MM-DD date or a MM/DD/YYYY
+    date into a datetime.
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except (TypeError, ValueError):
+            continue
+    raise ValueError("Couldn't convert {!r} into a date.".format(value))
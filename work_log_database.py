@@ -1,17 +1,84 @@
+import argparse
 from collections import OrderedDict
 import datetime
+import logging
 import os
+import signal
+import sys
+
+from startup import LazyModule
+import startup
+import validation
+
+# The modules needing peewee are imported on first use, so the main menu
+# can come up before peewee has loaded.
+api = LazyModule('api')
+archive = LazyModule('archive')
+changes = LazyModule('changes')
+exporter = LazyModule('exporter')
+federation = LazyModule('federation')
+group_commit = LazyModule('group_commit')
+importer = LazyModule('importer')
+instrumentation = LazyModule('instrumentation')
+migrations = LazyModule('migrations')
+paging = LazyModule('paging')
+partitions = LazyModule('partitions')
+planner = LazyModule('planner')
+reports = LazyModule('reports')
+search = LazyModule('search')
+search_cache = LazyModule('search_cache')
+snapshot = LazyModule('snapshot')
+sync = LazyModule('sync')
+task = LazyModule('task')
+writes = LazyModule('writes')
+
+
+# The database file the menu reads the task count from with sqlite3, or
+# None to count through the models.  See initialize().
+COUNT_FILE = None
+
+
+def initialize(path=None):
+    """
+    Brings the database schema up to date.  Given the 'path' the menu
+    starts on, before anything has loaded the models, the schema version
+    is checked with sqlite3 and the menu counts tasks the same way, so
+    launching with a current schema doesn't import peewee.  The
+    connection itself opens on the first query.
+    """
+    global COUNT_FILE
+    COUNT_FILE = path
+    if path is not None and startup.schema_is_current(path):
+        return
+    migrations.migrate(task.DATABASE)
 
-from task import Task, DATABASE
 
+def teardown():
+    """Closes whatever the program opened, and stops counting by file."""
+    global COUNT_FILE
+    COUNT_FILE = None
+    startup.teardown()
 
-def initialize():
-    DATABASE.connect()
-    DATABASE.create_tables([Task], safe=True)
 
+def task_count():
+    """
+    Returns the number of tasks, reading it with sqlite3 from COUNT_FILE
+    when initialize() was given one.
+    """
+    if federated():
+        return search.task_count()
+    if COUNT_FILE is not None:
+        return startup.task_count(COUNT_FILE)
+    return partitions.task_count()
 
-def teardown():
-    DATABASE.close()
+
+def federated():
+    """
+    Tells whether the menus search several work logs at once.  With
+    --federate, 'search' is a federation.Federation standing in for the
+    search module.
+    """
+    return not isinstance(search, LazyModule)
 
 
 def menu_loop(message=None):
@@ -22,7 +89,8 @@ def menu_loop(message=None):
         # Main menu input loop
         menu_input = main_menu(message).lower()
         while True:
-            if menu_input in menu:
+            if menu_input in menu and (not federated() or
+                                       menu_input in FEDERATED_MENU):
                 break
             else:
                 menu_input = main_menu("Selection not recognized. Try again.")
@@ -46,14 +114,19 @@ def main_menu(message=None):
     """
     clear()
     print("WORK LOG\n========\n")
+    if federated():
+        print("Searching {} work logs.\n".format(len(search.paths)))
     if message:
         print(message+"\n")
     else:
         print("What would you like to do?\n")
-    print("(A)dd a task")
-    if Task.select().count() != 0:
+    if not federated():
+        print("(A)dd a task")
+    if task_count() != 0:
         print("(V)iew all tasks")
         print("(S)earch for a task")
+        if not federated():
+            print("(R)eport minutes worked")
     print("(Q)uit")
     return input("> ")
 
@@ -69,10 +142,7 @@ def add_task():
     duration = get_duration()
     title = get_title()
     notes = get_notes()
-    Task.create(employee=employee,
-                duration=duration,
-                title=title,
-                notes=notes)
+    writes.add_task(employee, duration, title, notes)
     input("Task created!  Press Enter to return to main menu.\n")
 
 
@@ -86,10 +156,10 @@ def get_employee():
         clear()
         employee = input(
             "{}Which employee completed the task?\n> ".format(message))
-        if len(employee) > 60:
-            message = "Name must be 60 or fewer characters.\n\n"
-            continue
-        return employee
+        try:
+            return validation.clean_employee(employee)
+        except ValueError as error:
+            message = "{}\n\n".format(error)
 
 
 def get_duration():
@@ -104,13 +174,9 @@ def get_duration():
             "{}How long did it take to complete the task? "
             "(in minutes)\n> ".format(message))
         try:
-            duration = int(duration)
-            if duration < 1:
-                raise ValueError
-        except ValueError:
-            message = "Duration must be a positive whole number.\n\n"
-        else:
-            return duration
+            return validation.clean_duration(duration)
+        except ValueError as error:
+            message = "{}\n\n".format(error)
 
 
 def get_title():
@@ -123,10 +189,10 @@ def get_title():
         clear()
         title = input(
             "{}Enter a short description of the task:\n> ".format(message))
-        if len(title) > 140:
-            message = "Task title must be 140 or fewer characters.\n\n"
-            continue
-        return title
+        try:
+            return validation.clean_title(title)
+        except ValueError as error:
+            message = "{}\n\n".format(error)
 
 
 def get_notes():
@@ -162,13 +228,12 @@ def view_all_tasks():
     """
     Get all tasks from the database and send them to the task pagination
     """
-    tasks = Task.select()
-    if tasks.count() == 0:
+    if task_count() == 0:
         clear()
         input("No tasks exist in the database. Press ENTER to return to "
               "the main menu")
         return
-    task_page_menu(tasks)
+    task_page_menu(search.all_tasks())
 
 
 def search_tasks():
@@ -180,7 +245,7 @@ def search_tasks():
 
     Also detects when a search filter returns no results.
     """
-    if Task.select().count() == 0:
+    if task_count() == 0:
         clear()
         input("No tasks exist in the database. Press ENTER to return to "
               "the main menu")
@@ -191,6 +256,7 @@ def search_tasks():
         ('k', keyword_search),
         ('d', date_search),
         ('r', date_range_search),
+        ('c', combined_search),
     ])
     message = "Enter criteria below:"
     while True:
@@ -201,20 +267,25 @@ def search_tasks():
         print("Search by (K)eyword")
         print("Search by (D)ate")
         print("Search by Date (R)ange")
+        print("Search by several (C)riteria at once")
         print("Or go (B)ack")
         print("\n{}\n".format(message))
         choice = input("> ").lower().strip()
 
-        if choice not in ['e', 't', 'k', 'd', 'r', 'b']:
+        if choice not in ['e', 't', 'k', 'd', 'r', 'c', 'b']:
             message = "Entry not recognized. Try again."
             continue
         if choice == 'b':
             break
-        tasks = search_menu[choice]()
-        if len(tasks) == 0:
+        if choice == 'c':
+            tasks, keys = combined_search()
+        else:
+            tasks = search_menu[choice]()
+            keys = paging.order_for(tasks)
+        if not search_cache.exists(tasks):
             message = "No tasks found by that criteria. Try again."
             continue
-        task_page_menu(tasks)
+        task_page_menu(tasks, keys)
 
 
 def employee_search():
@@ -245,9 +316,7 @@ def list_of_employees():
     Generates list of employees that have tasks, then returns all of that
     employees tasks.
     """
-    employees = []
-    for task in Task.select(Task.employee).distinct():
-        employees.append(task.employee)
+    employees = [name for name, _ in search.employees_with_tasks()]
     message = "Which employee's tasks do you want to view?"
     return employee_from_selection(employees, message)
 
@@ -255,25 +324,29 @@ def list_of_employees():
 def employee_by_entry():
     """
     Takes user input for searching for existing employee,
-    shows multiple results if they exist,
+    shows ranked matches, including near misses for typos,
     allows users to choose which if multiple exist,
     and returns list of employee's tasks.
     """
-    employee = get_employee()
-    emp_match = (Task.select(Task.employee)
-                 .distinct()
-                 .where(Task.employee ** "%{}%".format(employee)))
-    if len(emp_match) > 1:
-        employees = []
-        for emp in emp_match:
-            employees.append(emp.employee)
+    return search.tasks_by_employee(match_employee(get_employee()))
+
+
+def match_employee(employee):
+    """
+    Returns the name of the employee the user meant by 'employee', letting
+    them choose when several names or only near misses match.
+    """
+    employees = search.employee_candidates(employee)
+    if (len(employees) == 1 and
+            employee.lower() in employees[0].lower()):
+        return employees[0]
+    if len(employees) == 0:
+        return employee
+    if any(employee.lower() in name.lower() for name in employees):
         message = "Multiple employees found with similar name."
-        return employee_from_selection(employees, message)
     else:
-        if len(emp_match) == 0:
-            return []
-        employee = emp_match[0].employee
-        return Task.select().where(Task.employee == employee)
+        message = "No employee found with that name. Did you mean:"
+    return select_employee(employees, message)
 
 
 def employee_from_selection(employees, message):
@@ -281,6 +354,11 @@ def employee_from_selection(employees, message):
     Takes a list of employees, and returns all tasks from the user selected
     employee
     """
+    return search.tasks_by_employee(select_employee(employees, message))
+
+
+def select_employee(employees, message):
+    """Takes a list of employees, and returns the one the user selects"""
     error = "====="
     while True:
         clear()
@@ -297,8 +375,7 @@ def employee_from_selection(employees, message):
         except ValueError:
             error = "Entry not recognized. Try again."
             continue
-        employee = employees[employee_index]
-        return Task.select().where(Task.employee == employee)
+        return employees[employee_index]
 
 
 def duration_search():
@@ -307,78 +384,134 @@ def duration_search():
     user and return all tasks with that duration
     """
     duration = get_duration()
-    return Task.select().where(Task.duration == duration)
+    return search.tasks_by_duration(duration)
 
 
 def keyword_search():
     """
     Takes user input for a keyword and returns all tasks that have the given
-    keyword in the task title or note.
+    keyword in the task title or note, best matches first.
     """
     clear()
-    keyword = input("What keyword would you like to search by?\n> ")
-    return Task.select().where(Task.title.contains(keyword) |
-                               Task.notes.contains(keyword))
+    keyword = input("What keyword would you like to search by? "
+                    "(end a word with * to match its prefix, "
+                    "use \"quotes\" for a phrase)\n> ")
+    return search.tasks_by_keyword(keyword)
 
 
 def date_search():
     """
     Uses the existing 'get_date' function to get a valid date from a user.
-    Sets the end date to be 23:59:59 on the same day
-    Returns all tasks in that date range
+    Returns all tasks created on that day.
     """
     clear()
-    start_date = get_date()
-    end_date = datetime.datetime.combine(start_date.date(),
-                                         datetime.time(23, 59, 59))
-    return Task.select().where(Task.created_at.between(start_date, end_date))
+    return search.tasks_on_date(get_date())
 
 
 def date_range_search():
     """
     Uses the existing 'get_date' function to get two valid dates from a user.
-    Returns all tasks in that date range from the two dates provided.
+    Returns all tasks created from the first day through the last.
     """
     start_date = get_date("Enter the beginning date in the date range.\n\n")
     end_date = get_date("Enter the end date in the date range.\n\n")
-    if start_date > end_date:
-        start_date, end_date = end_date, start_date
-    return Task.select().where(Task.created_at.between(start_date, end_date))
+    return search.tasks_in_range(start_date, end_date)
+
+
+def get_optional(prompt, clean):
+    """
+    Runs loop to capture an optional criterion, returning None when left
+    blank, or else the input as cleaned by 'clean'.
+    """
+    message = ""
+    while True:
+        clear()
+        value = input("{}{} (leave blank for any)\n> ".format(
+            message, prompt)).strip()
+        if not value:
+            return None
+        try:
+            return clean(value)
+        except ValueError as error:
+            message = "{}\n\n".format(error)
 
 
-def task_page_menu(tasks):
+def combined_search():
+    """
+    Takes any mix of employee, duration range, keyword and date range,
+    shows how the search will find the tasks matching all of them, and
+    returns those tasks with the sort keys to page through them by.
     """
-    Task pagination menu. Takes a list of tasks.  Smartly shows next and
-    previous options based on amount of tasks and position in list of tasks.
+    employee = get_optional("Which employee's tasks?",
+                            validation.clean_employee)
+    if employee is not None:
+        employee = match_employee(employee)
+    criteria = planner.Criteria(
+        employee=employee,
+        min_duration=get_optional("Shortest duration in minutes?",
+                                  validation.clean_duration),
+        max_duration=get_optional("Longest duration in minutes?",
+                                  validation.clean_duration),
+        keyword=get_optional("Which keyword? (end a word with * to match "
+                             "its prefix, use \"quotes\" for a phrase)",
+                             str),
+        start_date=get_optional("From which date? (MM/DD/YYYY)",
+                                validation.clean_date),
+        end_date=get_optional("Through which date? (MM/DD/YYYY)",
+                              validation.clean_date))
+    if federated():
+        # Each work log plans the search for itself.
+        return search.combined_search(criteria), paging.DATE_ORDER
+    tasks, keys, plan = planner.combined_search(criteria)
+    clear()
+    print("SEARCH PLAN\n===========\n")
+    for line in planner.describe(plan, tasks, keys):
+        print(line)
+    input("\nPress ENTER to see the tasks.")
+    return tasks, keys
+
+
+def task_page_menu(tasks, keys=None):
+    """
+    Task pagination menu. Takes a query of tasks and the sort keys to page
+    through them by, newest first by default.  Smartly shows next and
+    previous options based on amount of tasks and position in the results.
     Validates user input for editing, deleting, and going through pages.
+    Every task found can be changed or deleted at once.  Tasks found
+    across several work logs are shown with their file, and can't be
+    edited or deleted from here.
     """
-    index = 0
+    pager = paging.TaskPager(tasks, keys or paging.DATE_ORDER)
+    editable = not federated()
     message = "What would you like to do?"
-    while True:
+    while pager.current is not None:
         clear()
-        task = tasks[index]
+        task = pager.current
         print("TASK\n====\n")
         print("Task ID# {}".format(task.id))
-        print("Employee: {}".format(task.employee))
+        print("Employee: {}".format(task.employee.name))
         print("Title: {}".format(task.title))
         print("Duration: {}".format(task.duration))
         print("Notes: {}".format(task.notes))
         print("Date Created: {}".format(task.created_at.strftime("%m/%d/%Y")))
+        if not editable:
+            print("Work log: {}".format(task.source))
         print("\n{}\n".format(message))
 
-        # Generate valid options and messaging based on current index
-        if len(tasks) == 1:
-            options = ['e', 'd']
-            print("(E)dit, (D)elete,")
-        elif index == 0:
-            options = ['e', 'd', 'n']
-            print("(E)dit, (D)elete, view (N)ext,")
-        elif index == len(tasks) - 1:
-            options = ['e', 'd', 'p']
-            print("(E)dit, (D)elete, view (P)revious,")
-        else:
-            options = ['e', 'd', 'n', 'p']
-            print("(E)dit, (D)elete, view (N)ext, view (P)revious,")
+        # Generate valid options and messaging based on current position
+        options = []
+        labels = []
+        if editable:
+            options += ['e', 'd', 'a']
+            labels += ["(E)dit", "(D)elete", "change (A)ll results"]
+        if pager.has_next:
+            options.append('n')
+            labels.append("view (N)ext")
+        if pager.has_previous:
+            options.append('p')
+            labels.append("view (P)revious")
+        if labels:
+            print(", ".join(labels) + ",")
         print("Or go (B)ack.")
         options.append('b')
 
@@ -391,11 +524,13 @@ def task_page_menu(tasks):
             edit_task(task.id)
         if choice == 'd':
             delete_task(task.id)
+        if choice == 'a':
+            change_all(tasks)
         if choice == 'n':
-            index += 1
+            pager.next()
             continue
         if choice == 'p':
-            index -= 1
+            pager.previous()
             continue
         break
 
@@ -436,7 +571,11 @@ def edit_task(task_id):
             update['created_at'] = get_date()
         break
 
-    Task.set_by_id(task_id, update)
+    try:
+        writes.update_task(task_id, update)
+    except ValueError as error:
+        input("{} Press Enter to return to the main menu.".format(error))
+        return
     input("Task has been updated. Press Enter to return to the main menu.")
 
 
@@ -446,10 +585,108 @@ def delete_task(task_id):
     and deletes if they do.
     """
     if input("Are you sure? [yN] ").lower() == 'y':
-        Task.delete_by_id(task_id)
+        try:
+            writes.delete_task(task_id)
+        except ValueError as error:
+            input("{} Press Enter to return to the main menu.".format(error))
+            return
         input("Entry deleted! Press Enter to return to the main menu.")
 
 
+def change_all(tasks):
+    """
+    Runs menu for reassigning, setting the duration of, or deleting every
+    task a search found.  Shows how many tasks will change and asks the
+    user to confirm before changing them all at once.
+    """
+    changeable, archived = writes.count_tasks(tasks)
+    message = "What do you want to do with them?"
+    while True:
+        clear()
+        print("ALL RESULTS\n===========\n")
+        print("{} tasks found.".format(changeable))
+        if archived:
+            print("{} more are archived and won't change.".format(archived))
+        print("\n{}\n".format(message))
+        print("(R)eassign them to another employee")
+        print("Set their D(u)ration")
+        print("(D)elete them\n")
+        print("Or go (B)ack.")
+        choice = input("> ").lower().strip()
+        if choice not in ['r', 'u', 'd', 'b']:
+            message = "Choice not recognized. Try again."
+            continue
+        break
+    if choice == 'b':
+        return
+    if choice == 'r':
+        update = {'employee': get_employee()}
+        action = "reassign {} tasks to {}".format(changeable,
+                                                  update['employee'])
+    if choice == 'u':
+        update = {'duration': get_duration()}
+        action = "set the duration of {} tasks to {}".format(
+            changeable, update['duration'])
+    if choice == 'd':
+        action = "delete {} tasks".format(changeable)
+    clear()
+    confirm = input("This will {}. Are you sure? [yN] ".format(action))
+    if confirm.lower() != 'y':
+        return
+    try:
+        if choice == 'd':
+            changed = writes.delete_tasks(tasks)
+        else:
+            changed = writes.update_tasks(tasks, update)
+    except ValueError as error:
+        input("{} Press Enter to return to the main menu.".format(error))
+        return
+    input("{} tasks {}. Press Enter to return to the main menu.".format(
+        changed, "deleted" if choice == 'd' else "updated"))
+
+
+def report_menu():
+    """
+    Runs the report menu.  Asks for the period to total minutes by and
+    an optional employee, then shows the minutes and tasks per employee
+    for each period.
+    """
+    if task_count() == 0:
+        clear()
+        input("No tasks exist in the database. Press ENTER to return to "
+              "the main menu")
+        return
+    periods = OrderedDict([
+        ('d', 'day'),
+        ('w', 'week'),
+        ('m', 'month'),
+    ])
+    message = "Enter criteria below:"
+    while True:
+        clear()
+        print("How would you like to total minutes worked?\n")
+        print("Per (D)ay")
+        print("Per (W)eek")
+        print("Per (M)onth")
+        print("Or go (B)ack")
+        print("\n{}\n".format(message))
+        choice = input("> ").lower().strip()
+        if choice == 'b':
+            return
+        if choice not in periods:
+            message = "Entry not recognized. Try again."
+            continue
+        break
+    clear()
+    employee = input("Which employee? (leave blank for everyone)\n> ")
+    clear()
+    for line in reports.format_report(
+            reports.duration_report(periods[choice],
+                                    employee=employee or None)):
+        print(line)
+    input("\nPress Enter to return to the main menu.")
+
+
 def quit_program():
     """
     Prints exit message.  The main menu loop contains the logic to break
@@ -463,11 +700,434 @@ menu = OrderedDict([
     ('a', add_task),
     ('v', view_all_tasks),
     ('s', search_tasks),
+    ('r', report_menu),
     ('q', quit_program),
 ])
 
+# The main menu options offered when searching several work logs.
+FEDERATED_MENU = ['v', 's', 'q']
 
-if __name__ == '__main__':
+
+def import_command(args):
+    """
+    Runs the bulk import command and reports how many rows were imported
+    and rejected.  Rejected rows are listed on stderr.
+    """
+    try:
+        imported, rejected = importer.import_file(args.path, args.format,
+                                                  rejects=sys.stderr)
+    except (ValueError, OSError) as error:
+        print(error, file=sys.stderr)
+        return 1
+    print("Imported {} tasks, rejected {}.".format(imported, rejected))
+    return 1 if rejected else 0
+
+
+def export_command(args):
+    """
+    Runs the export command, streaming every task or the results of one
+    search to a file or stdout.
+    """
+    if args.employee is not None:
+        tasks = search.tasks_by_employee(args.employee)
+    elif args.duration is not None:
+        tasks = search.tasks_by_duration(args.duration)
+    elif args.keyword is not None:
+        tasks = search.tasks_by_keyword(args.keyword)
+    elif args.date is not None:
+        tasks = search.tasks_on_date(args.date)
+    elif args.range is not None:
+        tasks = search.tasks_in_range(*args.range)
+    else:
+        tasks = search.all_tasks()
+    file_format = args.format
+    try:
+        if file_format is None:
+            file_format = ('jsonl' if args.output == '-'
+                           else importer.detect_format(args.output))
+        count = exporter.export_file(tasks, args.output, file_format,
+                                     compress=args.gzip or None)
+    except (ValueError, OSError) as error:
+        print(error, file=sys.stderr)
+        return 1
+    print("Exported {} tasks.".format(count), file=sys.stderr)
+    return 0
+
+
+def report_command(args):
+    """
+    Runs the report command, printing minutes and tasks per employee
+    per period as a table or CSV.
+    """
+    rows = reports.duration_report(args.period, args.start, args.end,
+                                   args.employee)
+    if args.format == 'csv':
+        reports.write_csv(rows, sys.stdout)
+    else:
+        for line in reports.format_report(rows):
+            print(line)
+    return 0
+
+
+def stats_command(args):
+    """
+    Runs the stats command, printing the number of tasks matching the
+    filters given, their total and mean minutes and duration percentiles,
+    and the tasks and minutes of each employee.
+    """
+    try:
+        tasks = snapshot.Snapshot.load()
+    except ImportError:
+        print("The stats command needs NumPy: pip install numpy",
+              file=sys.stderr)
+        return 1
+    mask = tasks.select(args.employee, args.start, args.end,
+                        args.min_duration, args.max_duration)
+    summary = tasks.summary(mask)
+    print("Tasks: {}".format(summary['tasks']))
+    print("Minutes: {}".format(summary['minutes']))
+    if summary['tasks']:
+        print("Mean minutes: {:.1f}".format(summary['mean']))
+        for percentile, minutes in summary['percentiles'].items():
+            print("{}th percentile: {:g} minutes".format(percentile,
+                                                         minutes))
+        print()
+        print("{:<30} {:>6} {:>8}".format("Employee", "Tasks", "Minutes"))
+        for name, count, minutes in tasks.by_employee(mask):
+            print("{:<30} {:>6} {:>8}".format(name[:30], count, minutes))
+    return 0
+
+
+def serve_command(args):
+    """Runs the command that serves the JSON API until interrupted."""
+    options = {name: value for name, value in
+               [('host', args.host), ('port', args.port),
+                ('workers', args.workers)] if value is not None}
+    api.serve(**options)
+    return 0
+
+
+def partition_command(args):
+    """
+    Runs the command that partitions the work log into a file per year
+    or month, or moves tasks left in the main file into their partitions.
+    """
+    try:
+        moved = partitions.partition_by(args.by)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    print("Moved {} tasks into partitions by {}.".format(moved, args.by))
+    return 0
+
+
+def archive_command(args):
+    """
+    Runs the command that moves tasks created before a date into the
+    read only archive file.
+    """
+    try:
+        moved = archive.archive(args.before)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    print("Archived {} tasks created before {:%Y-%m-%d}.".format(
+        moved, args.before))
+    return 0
+
+
+def sync_command(args):
+    """
+    Runs the sync command, exchanging the tasks added, edited and deleted
+    since the last sync with another work log file, both ways.
+    """
+    try:
+        result = sync.sync(args.path)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    print("Sent {} tasks and received {}, settling {} conflicts.".format(
+        result.sent, result.received, result.conflicts))
+    return 0
+
+
+def tail_command(args):
+    """
+    Runs the tail command, writing the task changes after a position in
+    the change log to stdout as JSON lines, and with --follow, the
+    changes made after that as they happen, until interrupted.
+    """
+    try:
+        since = changes.parse_cursor(args.since)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    try:
+        changes.tail(sys.stdout, since, follow=args.follow)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def parse_args(argv=None):
+    """Parses command line arguments.  No command runs the menu."""
+    parser = argparse.ArgumentParser(description="Work log database")
+    parser.add_argument(
+        '--database', default=startup.DATABASE_FILE,
+        help="database file to use (default: %(default)s)")
+    parser.add_argument(
+        '--profile', choices=sorted(task.PROFILES),
+        default=task.DEFAULT_PROFILE,
+        help="connection settings: wal lets several people use the "
+             "database at once, rollback suits network drives "
+             "(default: {})".format(task.DEFAULT_PROFILE))
+    parser.add_argument(
+        '--group-commit', action='store_true',
+        help="commit adds, edits and deletes in shared batches from a "
+             "background writer")
+    parser.add_argument(
+        '--commit-interval', type=int, metavar='MS',
+        default=int(group_commit.INTERVAL * 1000),
+        help="with --group-commit, longest wait in milliseconds for a "
+             "batch to fill (default: %(default)s)")
+    parser.add_argument(
+        '--commit-batch', type=int, metavar='OPS',
+        default=group_commit.BATCH_SIZE,
+        help="with --group-commit, most writes per batch "
+             "(default: %(default)s)")
+    parser.add_argument(
+        '--query-log', metavar='FILE',
+        help="append every SQL statement run, with its time, rows and "
+             "calling function, to FILE as JSON lines")
+    parser.add_argument(
+        '--slow-query-ms', type=float, metavar='MS',
+        help="log statements taking at least MS milliseconds, with their "
+             "query plan, to stderr")
+    parser.add_argument(
+        '--query-stats', action='store_true',
+        help="print query latency histograms per menu function and "
+             "search cache hits and misses on exit (send SIGUSR1 to print "
+             "them at any time)")
+    parser.add_argument(
+        '--federate', nargs='+', metavar='FILE',
+        help="search these work log files, or files matching these glob "
+             "patterns, together in the menu, read only")
+    commands = parser.add_subparsers(dest='command')
+
+    import_parser = commands.add_parser(
+        'import', help="import tasks from a CSV or JSONL file")
+    import_parser.add_argument(
+        'path', help="file to import, or - to read JSONL from stdin")
+    import_parser.add_argument(
+        '--format', choices=sorted(importer.READERS),
+        help="file format (default: guessed from the file extension)")
+    import_parser.set_defaults(run=import_command)
+
+    export_parser = commands.add_parser(
+        'export', help="export all tasks or a search to CSV or JSONL")
+    export_parser.add_argument(
+        '-o', '--output', default='-',
+        help="file to write, or - for stdout (default)")
+    export_parser.add_argument(
+        '--format', choices=sorted(exporter.WRITERS),
+        help="file format (default: guessed from the output file "
+             "extension, or jsonl for stdout)")
+    export_parser.add_argument(
+        '--gzip', action='store_true',
+        help="gzip the output (default for files ending in .gz)")
+    criteria = export_parser.add_mutually_exclusive_group()
+    criteria.add_argument('--employee', help="only this employee's tasks")
+    criteria.add_argument('--duration', type=validation.clean_duration,
+                          help="only tasks that took this many minutes")
+    criteria.add_argument('--keyword',
+                          help="only tasks matching this keyword search")
+    criteria.add_argument('--date', type=validation.clean_date,
+                          help="only tasks created on this date")
+    criteria.add_argument('--range', nargs=2, type=validation.clean_date,
+                          metavar=('START', 'END'),
+                          help="only tasks created between two dates")
+    export_parser.set_defaults(run=export_command)
+
+    report_parser = commands.add_parser(
+        'report', help="total minutes per employee per day, week or month")
+    report_parser.add_argument(
+        '--period', choices=reports.PERIODS, default='week',
+        help="period to total by (default: week)")
+    report_parser.add_argument('--employee', help="only this employee")
+    report_parser.add_argument(
+        '--from', dest='start', type=validation.clean_date,
+        help="first date to report on")
+    report_parser.add_argument(
+        '--to', dest='end', type=validation.clean_date,
+        help="last date to report on")
+    report_parser.add_argument(
+        '--format', choices=['table', 'csv'], default='table',
+        help="output format (default: table)")
+    report_parser.set_defaults(run=report_command)
+
+    stats_parser = commands.add_parser(
+        'stats', help="task counts, minutes and duration percentiles "
+                      "(needs NumPy)")
+    stats_parser.add_argument('--employee', help="only this employee")
+    stats_parser.add_argument(
+        '--from', dest='start', type=validation.clean_date,
+        help="first date to include")
+    stats_parser.add_argument(
+        '--to', dest='end', type=validation.clean_date,
+        help="last date to include")
+    stats_parser.add_argument(
+        '--min-duration', type=validation.clean_duration, metavar='MINUTES',
+        help="only tasks that took at least this long")
+    stats_parser.add_argument(
+        '--max-duration', type=validation.clean_duration, metavar='MINUTES',
+        help="only tasks that took at most this long")
+    stats_parser.set_defaults(run=stats_command)
+
+    serve_parser = commands.add_parser(
+        'serve', help="serve a JSON API over HTTP for scripts and dashboards")
+    # The defaults are left to api.serve(), so that other commands don't
+    # import asyncio just to parse their arguments.
+    serve_parser.add_argument(
+        '--host', help="address to listen on (default: 127.0.0.1)")
+    serve_parser.add_argument(
+        '--port', type=int,
+        help="port to listen on, or 0 for any free port (default: 8080)")
+    serve_parser.add_argument(
+        '--workers', type=int,
+        help="threads running database work (default: 4)")
+    serve_parser.set_defaults(run=serve_command)
+
+    partition_parser = commands.add_parser(
+        'partition', help="store tasks in a database file per year or month")
+    partition_parser.add_argument(
+        '--by', choices=sorted(partitions.PERIODS), default='year',
+        help="period each file holds (default: %(default)s)")
+    partition_parser.set_defaults(run=partition_command)
+
+    sync_parser = commands.add_parser(
+        'sync', help="exchange changed tasks with another work log file")
+    sync_parser.add_argument(
+        'path', help="work log file to sync with, created if there is none")
+    sync_parser.set_defaults(run=sync_command)
+
+    tail_parser = commands.add_parser(
+        'tail', help="stream task changes as JSON lines")
+    tail_parser.add_argument(
+        '--since', default='0', metavar='SEQ',
+        help="write the changes after this seq, or the cursor of a work "
+             "log with several files (default: every change)")
+    tail_parser.add_argument(
+        '-f', '--follow', action='store_true',
+        help="keep writing new changes as they are made")
+    tail_parser.set_defaults(run=tail_command)
+
+    archive_parser = commands.add_parser(
+        'archive', help="move old tasks into a read only archive file")
+    archive_parser.add_argument(
+        '--before', type=validation.clean_date, required=True,
+        help="archive the tasks created before this date")
+    archive_parser.set_defaults(run=archive_command)
+
+    return parser.parse_args(argv)
+
+
+def federated_menu(args):
+    """
+    Runs the menu searching the work logs given by --federate, in place
+    of the one database.
+    """
+    global search
+    if args.command:
+        print("--federate only applies to the menu.", file=sys.stderr)
+        return 1
+    try:
+        search = federation.Federation(federation.expand(args.federate))
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    try:
+        menu_loop()
+    finally:
+        teardown()
+        search = LazyModule('search')
+    return 0
+
+
+def start_instrumentation(args):
+    """
+    Turns on query instrumentation as asked for on the command line and
+    returns the monitor, or returns None if none was asked for.
+    """
+    if not (args.query_log or args.slow_query_ms is not None or
+            args.query_stats):
+        return None
+    log = None
+    if args.query_log:
+        log = open(args.query_log, 'a', encoding='utf-8')
+    if args.slow_query_ms is not None:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        instrumentation.logger.addHandler(handler)
+    monitor = instrumentation.enable(task.DATABASE, log,
+                                     args.slow_query_ms)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1,
+                      lambda signum, frame: report_stats(monitor))
+    return monitor
+
+
+def report_stats(monitor):
+    """
+    Prints the query latency histograms and the search cache counters.
+    """
+    monitor.report(sys.stderr)
+    search_cache.CACHE.report(sys.stderr)
+
+
+def stop_instrumentation(monitor, args):
+    """Turns instrumentation off, printing the histograms if asked."""
+    instrumentation.disable()
+    if args.query_stats:
+        report_stats(monitor)
+    if monitor.log is not None:
+        monitor.log.close()
+
+
+def main(argv=None):
+    """
+    Runs a command line command, or the interactive menu.
+
+    With no arguments the menu starts on the default database and
+    profile, without building the argument parser, since the parser
+    needs the modules its commands come from.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        initialize(startup.DATABASE_FILE)
+        try:
+            menu_loop()
+        finally:
+            teardown()
+        return
+    args = parse_args(argv)
+    if args.federate:
+        return federated_menu(args)
+    task.configure(args.database, args.profile)
+    monitor = start_instrumentation(args)
     initialize()
-    menu_loop()
-    teardown()
+    if args.group_commit:
+        writes.start_group_commit(args.commit_interval / 1000,
+                                  args.commit_batch)
+    try:
+        if args.command:
+            return args.run(args)
+        menu_loop()
+    finally:
+        teardown()
+        if monitor is not None:
+            stop_instrumentation(monitor, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
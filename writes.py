@@ -0,0 +1,187 @@
+"""
+Task writes shared by the menus and commands.
+
+Each write runs in its own IMMEDIATE transaction, which takes the write
+lock up front so it waits on busy_timeout rather than failing halfway,
+and is retried with backoff if the database stays locked.  While group
+commit is on, writes are handed to the background writer instead, and
+return once the shared transaction holding them has committed.
+
+In a partitioned work log, writes go to the partition for the task's
+date instead, each in its own transaction.  Archived tasks can't be
+changed, and no task can be dated into the archived days.  Every write
+bumps the search cache's write generation.
+
+update_tasks() and delete_tasks() change every task a search found with
+one UPDATE or DELETE per file, selecting the tasks by the search's own
+query, so nothing is read into Python first.  The triggers keep the
+full-text index, counters, rollups and change log in step as they do for
+single writes.  Each file is its own transaction, and archived tasks are
+left as they are.
+"""
+from group_commit import GroupCommitWriter, BATCH_SIZE, INTERVAL
+from startup import on_teardown
+from task import Employee, Task, DATABASE, retry_on_busy
+import partitions
+import search_cache
+
+
+# The running GroupCommitWriter, or None to commit each write directly.
+WRITER = None
+
+REDATE_PARTITIONED = ("Tasks can't be redated all at once in a partitioned "
+                      "work log, since they may move between files.")
+
+
+def start_group_commit(interval=INTERVAL, batch_size=BATCH_SIZE):
+    """Sends later writes through a group commit writer."""
+    global WRITER
+    stop_group_commit()
+    WRITER = GroupCommitWriter(interval, batch_size)
+
+
+@on_teardown
+def stop_group_commit():
+    """Commits any queued writes and goes back to committing directly."""
+    global WRITER
+    if WRITER is not None:
+        WRITER.close()
+        WRITER = None
+
+
+@retry_on_busy
+def run_now(func, *args, **kwargs):
+    """Runs a write function in its own transaction."""
+    with DATABASE.atomic(lock_type='IMMEDIATE'):
+        return func(*args, **kwargs)
+
+
+def run(func, *args, **kwargs):
+    """Runs a write function with group commit if it's on."""
+    if WRITER is None:
+        return run_now(func, *args, **kwargs)
+    return WRITER.submit(func, *args, **kwargs).result()
+
+
+def _create(employee, duration, title, notes, created_at):
+    """Inserts a task, adding the employee if they're new."""
+    fields = {'duration': duration, 'title': title, 'notes': notes}
+    if created_at is not None:
+        fields['created_at'] = created_at
+    task_id = partitions.reserve_ids(1)
+    if task_id is not None:
+        fields['id'] = task_id
+    return Task.create(employee=Employee.named(employee), **fields)
+
+
+def _update(task_id, update):
+    """Updates a task, adding the employee if they're new."""
+    update = dict(update)
+    if 'employee' in update:
+        update['employee'] = Employee.named(update['employee'])
+    return Task.set_by_id(task_id, update)
+
+
+def _delete(task_id):
+    """Deletes a task."""
+    return Task.delete_by_id(task_id)
+
+
+def add_task(employee, duration, title, notes, created_at=None):
+    """Creates a task for the named employee and returns it."""
+    if created_at is not None:
+        partitions.check_date(created_at)
+    search_cache.CACHE.bump()
+    if partitions.period() is not None:
+        return partitions.add_task(employee, duration, title, notes,
+                                   created_at)
+    return run(_create, employee, duration, title, notes, created_at)
+
+
+def update_task(task_id, update):
+    """
+    Updates the task with 'task_id' from a dict of field names to new
+    values.  The employee is given by name.  Returns the number of tasks
+    updated, and raises ValueError if the task is archived.
+    """
+    if 'created_at' in update:
+        partitions.check_date(update['created_at'])
+    search_cache.CACHE.bump()
+    if partitions.period() is not None:
+        return partitions.update_task(task_id, update)
+    updated = run(_update, task_id, update)
+    if not updated:
+        partitions.check_not_archived(task_id)
+    return updated
+
+
+def delete_task(task_id):
+    """
+    Deletes the task with 'task_id'.  Returns the number of tasks
+    deleted, and raises ValueError if the task is archived.
+    """
+    search_cache.CACHE.bump()
+    if partitions.period() is not None:
+        return partitions.delete_task(task_id)
+    deleted = run(_delete, task_id)
+    if not deleted:
+        partitions.check_not_archived(task_id)
+    return deleted
+
+
+def matching(tasks):
+    """
+    Returns (database, query of task ids) for each file holding tasks the
+    search query 'tasks' found, as the tasks that can be changed and the
+    archived ones.
+    """
+    if isinstance(tasks, partitions.PartitionedQuery):
+        parts = tasks.parts
+    else:
+        parts = [(DATABASE, tasks)]
+    changeable, archived = [], []
+    for database, query in parts:
+        ids = query.select(Task.id).order_by().limit(None)
+        if database.database == partitions.archive_path():
+            archived.append((database, ids))
+        else:
+            changeable.append((database, ids))
+    return changeable, archived
+
+
+def count_tasks(tasks):
+    """
+    Returns how many of the tasks a search found can be changed, and how
+    many are archived.
+    """
+    return tuple(
+        sum(partitions.run_parallel(
+            lambda part: part[1].clone().bind(part[0]).count(), parts))
+        for parts in matching(tasks))
+
+
+def update_tasks(tasks, update):
+    """
+    Updates every task the search query 'tasks' found from a dict of field
+    names to new values, as update_task() does.  Returns the number of
+    tasks updated, which leaves out archived tasks.
+    """
+    if 'created_at' in update:
+        if partitions.period() is not None:
+            raise ValueError(REDATE_PARTITIONED)
+        partitions.check_date(update['created_at'])
+    changeable, _ = matching(tasks)
+    search_cache.CACHE.bump()
+    return sum(partitions.update_matching(database, ids, update)
+               for database, ids in changeable)
+
+
+def delete_tasks(tasks):
+    """
+    Deletes every task the search query 'tasks' found.  Returns the number
+    of tasks deleted, which leaves out archived tasks.
+    """
+    changeable, _ = matching(tasks)
+    search_cache.CACHE.bump()
+    return sum(partitions.delete_matching(database, ids)
+               for database, ids in changeable)